@@ -4,9 +4,17 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 version_path = os.path.join(SCRIPT_DIR, "version.txt")
 __version__ = open(version_path).read()
 
-from .env import ProcgenEnv, ProcgenGym3Env
-from .gym_registration import register_environments
+from .gym_registration import register_when_imported
 
-register_environments()
+register_when_imported()
 
 __all__ = ["ProcgenEnv", "ProcgenGym3Env"]
+
+
+def __getattr__(name):
+    # the environment classes import gym3 and numpy, so they are only loaded when first used
+    if name in __all__:
+        from . import env
+
+        return getattr(env, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,85 @@
+"""
+asyncio interface for procgen environments
+"""
+
+import asyncio
+import os
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from .env import BaseProcgenEnv
+
+
+class AsyncProcgenEnv:
+    """
+    Step a procgen environment without blocking the event loop
+
+    `await env.step(actions)` starts a step on the environment's stepping threads and resolves once they are done.
+    The stepping threads signal completion through a pipe that is watched by the event loop, so no thread is used
+    per call.  Only one step can be in flight at a time for each environment.
+
+    Requires an event loop that supports add_reader(), which excludes the proactor event loop on Windows.
+
+    :param env: a ProcgenGym3Env, created with num_threads > 0 for steps to run in the background
+    """
+
+    def __init__(self, env: BaseProcgenEnv) -> None:
+        self.env = env
+        self._fd = env.call_c_func("create_completion_fd")
+        assert self._fd >= 0, "completion notification is not supported on this platform"
+        self._lock = asyncio.Lock()
+
+    @property
+    def num(self) -> int:
+        return self.env.num
+
+    async def step(self, ac: Any) -> Tuple[np.ndarray, Dict[str, np.ndarray], np.ndarray]:
+        """
+        Take an action and return (rew, ob, first) once the step is complete
+        """
+        async with self._lock:
+            self.env.act(ac)
+            await self._wait()
+            return self.env.observe()
+
+    async def observe(self) -> Tuple[np.ndarray, Dict[str, np.ndarray], np.ndarray]:
+        async with self._lock:
+            await self._wait()
+            return self.env.observe()
+
+    async def get_info(self) -> List[Dict[str, Any]]:
+        async with self._lock:
+            await self._wait()
+            return self.env.get_info()
+
+    async def _wait(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not self.env.call_c_func("is_step_complete"):
+            readable = loop.create_future()
+
+            def on_readable():
+                if not readable.done():
+                    readable.set_result(None)
+
+            loop.add_reader(self._fd, on_readable)
+            try:
+                # a notification may have arrived between the check above and add_reader(), in
+                # which case the fd is already readable and the future resolves immediately
+                await readable
+            finally:
+                loop.remove_reader(self._fd)
+            self._drain()
+
+    def _drain(self) -> None:
+        # notifications from earlier steps may still be in the pipe, the loop condition in _wait()
+        # is what decides whether the step is done
+        while True:
+            try:
+                if len(os.read(self._fd, 4096)) == 0:
+                    return
+            except BlockingIOError:
+                return
+
+    def close(self) -> None:
+        self.env.close()
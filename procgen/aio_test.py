@@ -0,0 +1,38 @@
+import asyncio
+
+import numpy as np
+import pytest
+from procgen import ProcgenGym3Env
+from .aio import AsyncProcgenEnv
+
+
+@pytest.mark.parametrize("num_threads", [0, 4])
+def test_async_step(num_threads):
+    num_steps = 100
+    rng = np.random.RandomState(0)
+    actions = rng.randint(0, 15, size=(num_steps, 4), dtype=np.int32)
+
+    sync_env = ProcgenGym3Env(num=4, env_name="coinrun", rand_seed=0, num_threads=num_threads)
+    expected = []
+    for ac in actions:
+        sync_env.act(ac)
+        expected.append(sync_env.observe()[1]["rgb"])
+
+    async def run():
+        envs = [
+            AsyncProcgenEnv(ProcgenGym3Env(num=4, env_name="coinrun", rand_seed=0, num_threads=num_threads))
+            for _ in range(3)
+        ]
+
+        async def rollout(env):
+            obs = []
+            for ac in actions:
+                _, ob, _ = await env.step(ac)
+                obs.append(ob["rgb"])
+            return obs
+
+        # interleave several environments on the same event loop
+        return await asyncio.gather(*[rollout(env) for env in envs])
+
+    for obs in asyncio.run(run()):
+        assert np.array_equal(np.array(obs), np.array(expected))
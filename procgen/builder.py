@@ -6,6 +6,8 @@ import shutil
 import json
 import sys
 import platform
+import hashlib
+import time
 import multiprocessing as mp
 
 import gym3
@@ -14,17 +16,34 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
 global_build_lock = threading.Lock()
-global_builds = set()
+# maps build type to the directory containing the built library
+global_builds = {}
 
+# number of cached libraries to keep around, older entries are evicted after each build
+MAX_CACHED_BUILDS = 4
+# entries used more recently than this many seconds ago are never evicted, so that a process that looked up an
+# entry has time to load the library before another process can remove it
+MIN_CACHE_ENTRY_AGE = 10 * 60
+LIB_FILENAMES = ["libenv.so", "libenv.dylib", "env.dll"]
 
-class RunFailure(Exception):
-    pass
+# build modes mapped to the cmake build type they use
+BUILD_MODES = {
+    "relwithdebinfo": "relwithdebinfo",
+    "debug": "debug",
+    # link time optimization
+    "lto": "relwithdebinfo",
+    # profile guided optimization plus link time optimization, profiles are collected by running pgo_workload()
+    "pgo": "relwithdebinfo",
+    # the instrumented library used to collect profiles for "pgo"
+    "pgo-instrumented": "relwithdebinfo",
+}
 
+# number of steps pgo_workload() runs for each game
+PGO_WORKLOAD_STEPS = 2000
 
-@contextlib.contextmanager
-def nullcontext():
-    # this is here for python 3.6 support
-    yield
+
+class RunFailure(Exception):
+    pass
 
 
 @contextlib.contextmanager
@@ -49,7 +68,7 @@ def check(proc, verbose):
         print(f"RUN {proc.args}:\n{proc.stdout}")
 
 
-def _attempt_configure(build_type, package):
+def _attempt_configure(build_type, package, cmake_options):
     if "PROCGEN_CMAKE_PREFIX_PATH" in os.environ:
         cmake_prefix_paths = [os.environ["PROCGEN_CMAKE_PREFIX_PATH"]]
     else:
@@ -81,6 +100,7 @@ def _attempt_configure(build_type, package):
         *extra_configure_options,
         "-DCMAKE_PREFIX_PATH=" + ";".join(cmake_prefix_paths),
         f"-DLIBENV_DIR={gym3.libenv.get_header_dir()}",
+        *cmake_options,
         "../..",
     ]
     if package:
@@ -92,56 +112,299 @@ def _attempt_configure(build_type, package):
     check(run(configure_cmd), verbose=package)
 
 
-def build(package=False, debug=False):
+def _native_cpu_id():
+    # non-package builds use -march=native, so a cached library is only valid on the same kind of cpu
+    if platform.system() == "Linux":
+        lines = []
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name") or line.startswith("flags"):
+                    lines.append(line.strip())
+                if line.strip() == "":
+                    # the first processor is enough
+                    break
+        return "\n".join(lines)
+    return platform.processor()
+
+
+def _source_paths():
+    paths = [os.path.join(SCRIPT_DIR, "CMakeLists.txt")]
+    for root, dirs, files in os.walk(os.path.join(SCRIPT_DIR, "src")):
+        dirs.sort()
+        for name in sorted(files):
+            paths.append(os.path.join(root, name))
+    return paths
+
+
+def _cache_key(mode, package):
+    """
+    Hash everything that affects the built library: the sources, the build flags and the paths
+    used to find Qt and libenv.h
+    """
+    h = hashlib.sha256()
+    libenv_dir = gym3.libenv.get_header_dir()
+    config = {
+        "mode": mode,
+        "package": package,
+        "system": platform.system(),
+        "machine": platform.machine(),
+        "cpu": "" if package else _native_cpu_id(),
+        "libenv_dir": libenv_dir,
+        "env": {
+            name: os.environ.get(name)
+            for name in [
+                "PROCGEN_CMAKE_PREFIX_PATH",
+                "CONDA_PREFIX",
+                "CC",
+                "CXX",
+                "CXXFLAGS",
+                "LDFLAGS",
+            ]
+        },
+    }
+    h.update(json.dumps(config, sort_keys=True).encode("utf8"))
+    for path in _source_paths() + [os.path.join(libenv_dir, "libenv.h")]:
+        h.update(os.path.relpath(path, SCRIPT_DIR).encode("utf8"))
+        with open(path, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()[:16]
+
+
+def _find_lib(lib_dir):
+    for filename in LIB_FILENAMES:
+        if os.path.exists(os.path.join(lib_dir, filename)):
+            return filename
+    return None
+
+
+def _store_in_cache(lib_dir, cache_root, key):
+    """
+    Copy the built library into the cache, the entry is moved into place in a single rename so that
+    other processes either see a complete entry or none at all
+    """
+    filename = _find_lib(lib_dir)
+    assert filename is not None, f"built library not found in {lib_dir}"
+    entry_dir = os.path.join(cache_root, key)
+    if os.path.exists(entry_dir):
+        return entry_dir
+    tmp_dir = os.path.join(cache_root, f".tmp-{key}-{os.getpid()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    shutil.copy2(os.path.join(lib_dir, filename), os.path.join(tmp_dir, filename))
+    os.replace(tmp_dir, entry_dir)
+    return entry_dir
+
+
+def _evict_cache_entries(cache_root, max_entries, keep=None, min_age=MIN_CACHE_ENTRY_AGE):
+    """
+    Remove the least recently used cache entries, entries used within the last `min_age` seconds are kept even if
+    that leaves more than `max_entries` entries
+
+    Deleting the library file is safe for processes that already loaded it on unix, on windows
+    the delete fails for loaded libraries and the entry is left alone
+    """
+    entries = []
+    cutoff = time.time() - min_age
+    for name in os.listdir(cache_root):
+        path = os.path.join(cache_root, name)
+        if name.startswith(".") or not os.path.isdir(path) or name == keep:
+            continue
+        entries.append((os.path.getmtime(path), path))
+    entries.sort(reverse=True)
+    num_to_keep = max_entries - (0 if keep is None else 1)
+    for mtime, path in entries[max(num_to_keep, 0):]:
+        if mtime > cutoff:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _lookup_cache(cache_root, key):
+    """
+    Return the entry directory for `key` or None if there is no such entry, this should be called while holding the
+    cache lock so that the entry cannot be evicted between finding it and marking it as used
+    """
+    entry_dir = os.path.join(cache_root, key)
+    if _find_lib(entry_dir) is None:
+        return None
+    # mark the entry as recently used so that it is not evicted
+    try:
+        os.utime(entry_dir)
+    except OSError:
+        pass
+    return entry_dir
+
+
+def _cmake_build(mode, package, build_subdir, cmake_options=()):
+    build_type = BUILD_MODES[mode]
+    sys.stdout.write(f"building procgen ({mode})...")
+    sys.stdout.flush()
+    try:
+        os.makedirs(build_subdir, exist_ok=True)
+        with chdir(build_subdir):
+            _attempt_configure(build_type, package, cmake_options)
+    except RunFailure:
+        # cmake can get into a weird state, so nuke the build directory and retry once
+        sys.stdout.write("retrying configure due to failure...")
+        sys.stdout.flush()
+        shutil.rmtree(build_subdir)
+        os.makedirs(build_subdir, exist_ok=True)
+        with chdir(build_subdir):
+            _attempt_configure(build_type, package, cmake_options)
+
+    if "MAKEFLAGS" not in os.environ:
+        os.environ["MAKEFLAGS"] = f"-j{mp.cpu_count()}"
+
+    with chdir(build_subdir):
+        build_cmd = ["cmake", "--build", ".", "--config", build_type]
+        check(run(build_cmd), verbose=package)
+    print("done")
+
+    lib_dir = os.path.abspath(build_subdir)
+    if platform.system() == "Windows":
+        # the built library is in a different location on windows
+        lib_dir = os.path.join(lib_dir, build_type)
+    return lib_dir
+
+
+def pgo_workload(num_steps=PGO_WORKLOAD_STEPS):
+    """
+    Representative training workload used to collect profiles for the "pgo" build mode,
+    this steps a batch of every game with random actions using the instrumented library
+    """
+    import numpy as np
+    from procgen.env import ENV_NAMES, ProcgenGym3Env
+
+    rng = np.random.RandomState(0)
+    for env_name in ENV_NAMES:
+        env = ProcgenGym3Env(
+            num=16, env_name=env_name, rand_seed=0, build_mode="pgo-instrumented"
+        )
+        for _ in range(num_steps):
+            env.act(
+                rng.randint(
+                    low=0, high=env.ac_space.eltype.n, size=(env.num,), dtype=np.int32
+                )
+            )
+            env.observe()
+        env.close()
+
+
+def _remove_profiles(build_subdir, profile_dir):
+    # gcc writes .gcda files next to the object files, clang writes .profraw files to the profile dir
+    shutil.rmtree(profile_dir, ignore_errors=True)
+    for root, _, files in os.walk(build_subdir):
+        for name in files:
+            if name.endswith(".gcda"):
+                os.remove(os.path.join(root, name))
+
+
+def _merge_clang_profiles(profile_dir):
+    if not os.path.exists(profile_dir):
+        return
+    profraw_paths = [
+        os.path.join(profile_dir, name)
+        for name in os.listdir(profile_dir)
+        if name.endswith(".profraw")
+    ]
+    if len(profraw_paths) == 0:
+        return
+    merge_cmd = ["llvm-profdata"]
+    if platform.system() == "Darwin":
+        merge_cmd = ["xcrun", "llvm-profdata"]
+    merge_cmd += ["merge", "-output=" + os.path.join(profile_dir, "default.profdata")]
+    check(run(merge_cmd + profraw_paths), verbose=False)
+
+
+def _build_mode(mode, package, cache_root):
+    """
+    Run cmake for the given build mode, returns the directory containing the built library
+    """
+    if mode in ("relwithdebinfo", "debug"):
+        return _cmake_build(mode, package, mode)
+    elif mode == "lto":
+        return _cmake_build(mode, package, mode, ["-DPROCGEN_LTO=ON"])
+
+    assert platform.system() != "Windows", "profile guided optimization is not supported on windows"
+    # both pgo phases share a build directory, gcc looks for profiles next to the object files
+    build_subdir = "pgo"
+    profile_dir = os.path.abspath(os.path.join(build_subdir, "profile"))
+    generate_options = [
+        "-DPROCGEN_PGO_PHASE=generate",
+        f"-DPROCGEN_PGO_DIR={profile_dir}",
+    ]
+    if mode == "pgo-instrumented":
+        return _cmake_build(mode, package, build_subdir, generate_options)
+
+    lib_dir = _cmake_build("pgo-instrumented", package, build_subdir, generate_options)
+    # the workload runs in a separate process that finds the instrumented library in the cache
+    _store_in_cache(lib_dir, cache_root, _cache_key("pgo-instrumented", package))
+    _remove_profiles(build_subdir, profile_dir)
+    sys.stdout.write("collecting profiles...")
+    sys.stdout.flush()
+    with chdir(os.path.dirname(SCRIPT_DIR)):
+        check(
+            run([sys.executable, "-c", "from procgen.builder import pgo_workload; pgo_workload()"]),
+            verbose=False,
+        )
+    print("done")
+    _merge_clang_profiles(profile_dir)
+    return _cmake_build(
+        mode,
+        package,
+        build_subdir,
+        ["-DPROCGEN_LTO=ON", "-DPROCGEN_PGO_PHASE=use", f"-DPROCGEN_PGO_DIR={profile_dir}"],
+    )
+
+
+def build(package=False, debug=False, mode=None):
     """
     Build the requested environment in a process-safe manner and only once per process.
+
+    Outside of package builds, the library is stored in a cache keyed by a hash of the sources and build
+    configuration, so that processes started later can load it without running cmake.
+
+    `mode` is one of BUILD_MODES and defaults to "debug" if `debug` is set and "relwithdebinfo" otherwise.
     """
     build_dir = os.path.join(SCRIPT_DIR, ".build")
     os.makedirs(build_dir, exist_ok=True)
 
-    build_type = "relwithdebinfo"
-    if debug:
-        build_type = "debug"
+    if mode is None:
+        mode = "debug" if debug else "relwithdebinfo"
+    assert mode in BUILD_MODES, f"invalid build mode {mode}"
+    assert not debug or mode == "debug", "debug is only valid with the debug build mode"
 
     with chdir(build_dir), global_build_lock:
         # check if we have built yet in this process
-        if build_type not in global_builds:
-            if package:
-                # avoid the filelock dependency when building from setup.py
-                lock_ctx = nullcontext()
-            else:
+        if mode in global_builds:
+            return global_builds[mode]
+
+        cache_root = os.path.join(build_dir, "cache")
+        if package:
+            # avoid the filelock dependency when building from setup.py
+            # setup.py moves the library out of the build directory, so don't use the cache
+            assert mode in ("relwithdebinfo", "debug"), "package builds do not support this build mode"
+            lib_dir = _build_mode(mode, package, cache_root)
+        else:
+            os.makedirs(cache_root, exist_ok=True)
+            key = _cache_key(mode, package)
+            import filelock
+
+            # the cache lock is only held briefly, it orders lookups against eviction while the build lock
+            # is held for the duration of a build, the build lock is always taken first
+            cache_lock = filelock.FileLock(".cache-lock")
+            with cache_lock:
+                lib_dir = _lookup_cache(cache_root, key)
+            if lib_dir is None:
                 # prevent multiple processes from trying to build at the same time
-                import filelock
-
-                lock_ctx = filelock.FileLock(".build-lock")
-            with lock_ctx:
-                sys.stdout.write("building procgen...")
-                sys.stdout.flush()
-                try:
-                    os.makedirs(build_type, exist_ok=True)
-                    with chdir(build_type):
-                        _attempt_configure(build_type, package)
-                except RunFailure:
-                    # cmake can get into a weird state, so nuke the build directory and retry once
-                    sys.stdout.write("retrying configure due to failure...")
-                    sys.stdout.flush()
-                    shutil.rmtree(build_type)
-                    os.makedirs(build_type, exist_ok=True)
-                    with chdir(build_type):
-                        _attempt_configure(build_type, package)
-
-                if "MAKEFLAGS" not in os.environ:
-                    os.environ["MAKEFLAGS"] = f"-j{mp.cpu_count()}"
-
-                with chdir(build_type):
-                    build_cmd = ["cmake", "--build", ".", "--config", build_type]
-                    check(run(build_cmd), verbose=package)
-                print("done")
-
-            global_builds.add(build_type)
-
-    lib_dir = os.path.join(build_dir, build_type)
-    if platform.system() == "Windows":
-        # the built library is in a different location on windows
-        lib_dir = os.path.join(lib_dir, build_type)
+                with filelock.FileLock(".build-lock"):
+                    # another process may have finished the build while we were waiting
+                    with cache_lock:
+                        lib_dir = _lookup_cache(cache_root, key)
+                    if lib_dir is None:
+                        built_lib_dir = _build_mode(mode, package, cache_root)
+                        with cache_lock:
+                            lib_dir = _store_in_cache(built_lib_dir, cache_root, key)
+                            _evict_cache_entries(cache_root, MAX_CACHED_BUILDS, keep=key)
+
+        global_builds[mode] = lib_dir
     return lib_dir
@@ -0,0 +1,56 @@
+import os
+import time
+
+from . import builder
+
+
+def test_cache_key():
+    assert builder._cache_key("relwithdebinfo", False) == builder._cache_key(
+        "relwithdebinfo", False
+    )
+    assert builder._cache_key("relwithdebinfo", False) != builder._cache_key(
+        "debug", False
+    )
+
+
+def test_cache_store_and_evict(tmp_path):
+    lib_dir = tmp_path / "build"
+    lib_dir.mkdir()
+    (lib_dir / "libenv.so").write_bytes(b"lib")
+    cache_root = tmp_path / "cache"
+    cache_root.mkdir()
+
+    assert builder._lookup_cache(str(cache_root), "a") is None
+    keys = ["a", "b", "c"]
+    for i, key in enumerate(keys):
+        entry_dir = builder._store_in_cache(str(lib_dir), str(cache_root), key)
+        assert builder._lookup_cache(str(cache_root), key) == entry_dir
+        # make sure the entries have distinct modification times
+        t = time.time() - 100 + i
+        os.utime(entry_dir, (t, t))
+
+    builder._evict_cache_entries(str(cache_root), max_entries=2, keep="a", min_age=0)
+    assert sorted(os.listdir(cache_root)) == ["a", "c"]
+    assert (cache_root / "a" / "libenv.so").read_bytes() == b"lib"
+
+
+def test_cache_evict_keeps_recent_entries(tmp_path):
+    lib_dir = tmp_path / "build"
+    lib_dir.mkdir()
+    (lib_dir / "libenv.so").write_bytes(b"lib")
+    cache_root = tmp_path / "cache"
+    cache_root.mkdir()
+
+    for key in ["a", "b", "c"]:
+        builder._store_in_cache(str(lib_dir), str(cache_root), key)
+    old_entry_dir = str(cache_root / "a")
+    t = time.time() - 2 * builder.MIN_CACHE_ENTRY_AGE
+    os.utime(old_entry_dir, (t, t))
+    builder._evict_cache_entries(str(cache_root), max_entries=1)
+    # only the entry that has not been used recently is removed
+    assert sorted(os.listdir(cache_root)) == ["b", "c"]
+    # looking up an entry marks it as recently used
+    os.utime(str(cache_root / "b"), (t, t))
+    assert builder._lookup_cache(str(cache_root), "b") is not None
+    builder._evict_cache_entries(str(cache_root), max_entries=1)
+    assert sorted(os.listdir(cache_root)) == ["b", "c"]
@@ -0,0 +1,42 @@
+"""
+Constants that are needed without loading the environment library, kept separate so that they can be imported quickly
+"""
+
+ENV_NAMES = [
+    "bigfish",
+    "bossfight",
+    "caveflyer",
+    "chaser",
+    "climber",
+    "coinrun",
+    "dodgeball",
+    "fruitbot",
+    "heist",
+    "jumper",
+    "leaper",
+    "maze",
+    "miner",
+    "ninja",
+    "plunder",
+    "starpilot",
+]
+
+EXPLORATION_LEVEL_SEEDS = {
+    "coinrun": 1949448038,
+    "caveflyer": 1259048185,
+    "leaper": 1318677581,
+    "jumper": 1434825276,
+    "maze": 158988835,
+    "heist": 876640971,
+    "climber": 1561126160,
+    "ninja": 1123500215,
+}
+
+# should match DistributionMode in game.h, except for 'exploration' which is handled by Python
+DISTRIBUTION_MODE_DICT = {
+    "easy": 0,
+    "hard": 1,
+    "extreme": 2,
+    "memory": 10,
+    "exploration": 20,
+}
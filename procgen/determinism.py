@@ -0,0 +1,127 @@
+"""
+Check that rollouts are deterministic by comparing per-step digests
+
+With digest_info=True, each step's info contains "state_digest" and "obs_digest", 64 bit FNV-1a hashes of the
+serialized state of the game (the bytes returned by get_state()) and of its observation.  Recording these for two
+runs of the same actions takes 16 bytes per environment per step, and the first step where they differ is where the
+runs diverged.
+
+    python -m procgen.determinism record --env-name coinrun --steps 10000 --output a.npz
+    python -m procgen.determinism record --env-name coinrun --steps 10000 --output b.npz
+    python -m procgen.determinism compare a.npz b.npz
+"""
+
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .env import ProcgenGym3Env
+
+DIGEST_KEYS = ["state_digest", "obs_digest"]
+
+
+def fnv1a_64(data: bytes) -> int:
+    """
+    Reference implementation of the digest computed by the C code
+    """
+    h = 0xCBF29CE484222325
+    for byte in data:
+        h ^= byte
+        h = (h * 0x100000001B3) & 0xFFFFFFFFFFFFFFFF
+    return h
+
+
+def info_digests(infos: List[Dict[str, Any]], key: str) -> np.ndarray:
+    """
+    Convert a digest info field from each environment to a uint64 array
+    """
+    return np.stack([info[key] for info in infos]).view("<u8").reshape(len(infos))
+
+
+def record_digests(env_kwargs: Dict[str, Any], actions: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Step a new environment with actions of shape [steps, num] and return the digests of each step
+
+    The result maps "state_digest" and "obs_digest" to uint64 arrays of shape [steps + 1, num], including the
+    initial observation, along with the actions that were taken.
+    """
+    env = ProcgenGym3Env(num=actions.shape[1], digest_info=True, **env_kwargs)
+    result = {key: np.zeros((len(actions) + 1, env.num), dtype=np.uint64) for key in DIGEST_KEYS}
+
+    def record(t):
+        infos = env.get_info()
+        for key in DIGEST_KEYS:
+            result[key][t] = info_digests(infos, key)
+
+    record(0)
+    for t, ac in enumerate(actions):
+        env.act(ac)
+        record(t + 1)
+    env.close()
+    result["actions"] = actions
+    return result
+
+
+def find_first_divergence(
+    a: Dict[str, np.ndarray], b: Dict[str, np.ndarray]
+) -> Optional[Tuple[int, int, str]]:
+    """
+    Return (step, env_idx, key) for the first step where two recordings differ, or None if they match
+
+    Steps are compared up to the length of the shorter recording.  The state digest is checked before the
+    observation digest since a state difference usually causes the observation difference.
+    """
+    steps = min(len(a["state_digest"]), len(b["state_digest"]))
+    mismatch = np.zeros(a["state_digest"][:steps].shape, dtype=bool)
+    for key in DIGEST_KEYS:
+        mismatch |= a[key][:steps] != b[key][:steps]
+    if not mismatch.any():
+        return None
+    step = int(np.argmax(mismatch.any(axis=1)))
+    env_idx = int(np.argmax(mismatch[step]))
+    for key in DIGEST_KEYS:
+        if a[key][step, env_idx] != b[key][step, env_idx]:
+            return step, env_idx, key
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="record and compare procgen rollout digests")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record = subparsers.add_parser("record")
+    record.add_argument("--env-name", default="coinrun")
+    record.add_argument("--distribution-mode", default="hard")
+    record.add_argument("--num", type=int, default=2)
+    record.add_argument("--steps", type=int, default=10000)
+    record.add_argument("--rand-seed", type=int, default=0)
+    record.add_argument("--action-seed", type=int, default=0)
+    record.add_argument("--output", required=True)
+    compare = subparsers.add_parser("compare")
+    compare.add_argument("a")
+    compare.add_argument("b")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        rng = np.random.RandomState(args.action_seed)
+        env_kwargs = dict(
+            env_name=args.env_name, distribution_mode=args.distribution_mode, rand_seed=args.rand_seed
+        )
+        # should match the length of BaseProcgenEnv.get_combos()
+        actions = rng.randint(0, 15, size=(args.steps, args.num), dtype=np.int32)
+        np.savez(args.output, **record_digests(env_kwargs, actions))
+    else:
+        a = dict(np.load(args.a))
+        b = dict(np.load(args.b))
+        steps = min(len(a["actions"]), len(b["actions"]))
+        assert np.array_equal(a["actions"][:steps], b["actions"][:steps]), "recordings used different actions"
+        divergence = find_first_divergence(a, b)
+        if divergence is None:
+            print(f"no divergence in {steps} steps")
+        else:
+            step, env_idx, key = divergence
+            print(f"first divergence at step {step} in env {env_idx} ({key})")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from procgen import ProcgenGym3Env
+from .determinism import fnv1a_64, find_first_divergence, info_digests, record_digests
+from .state_test import run_in_subproc
+
+NUM_STEPS = 1000
+
+
+@pytest.mark.parametrize("env_name", ["coinrun", "bigfish", "plunder"])
+def test_digests_match_across_processes(env_name):
+    env_kwargs = dict(env_name=env_name, rand_seed=0)
+    rng = np.random.RandomState(0)
+    actions = rng.randint(0, 15, size=(NUM_STEPS, 2), dtype=np.int32)
+    a = run_in_subproc(record_digests, env_kwargs=env_kwargs, actions=actions)
+    b = run_in_subproc(record_digests, env_kwargs=env_kwargs, actions=actions)
+    assert find_first_divergence(a, b) is None
+
+
+def test_state_digest():
+    env = ProcgenGym3Env(num=2, env_name="coinrun", rand_seed=0, digest_info=True)
+    for _ in range(10):
+        env.act(np.zeros(env.num, dtype=np.int32))
+    state_digests, obs_digests = env.get_digests()
+    expected = [fnv1a_64(state) for state in env.get_state()]
+    assert state_digests.tolist() == expected
+    assert np.array_equal(info_digests(env.get_info(), "state_digest"), state_digests)
+    _, ob, _ = env.observe()
+    assert obs_digests.tolist() == [fnv1a_64(o.tobytes()) for o in ob["rgb"]]
+
+
+def test_find_first_divergence():
+    a = {key: np.zeros((5, 3), dtype=np.uint64) for key in ["state_digest", "obs_digest"]}
+    b = {key: arr.copy() for key, arr in a.items()}
+    assert find_first_divergence(a, b) is None
+    b["obs_digest"][3, 2] = 1
+    b["state_digest"][4, 0] = 1
+    assert find_first_divergence(a, b) == (3, 2, "obs_digest")
+    b["state_digest"][3, 2] = 1
+    assert find_first_divergence(a, b) == (3, 2, "state_digest")
@@ -1,58 +1,53 @@
+import hashlib
+import importlib.util
 import os
 import random
+import sys
+import threading
+import warnings
 from typing import Sequence, Optional, List
 
 import gym3
+from gym3 import libenv
 from gym3.libenv import CEnv
 import numpy as np
-from .builder import build
+from .constants import ENV_NAMES, EXPLORATION_LEVEL_SEEDS, DISTRIBUTION_MODE_DICT
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
 MAX_STATE_SIZE = 2 ** 20
 
-ENV_NAMES = [
-    "bigfish",
-    "bossfight",
-    "caveflyer",
-    "chaser",
-    "climber",
-    "coinrun",
-    "dodgeball",
-    "fruitbot",
-    "heist",
-    "jumper",
-    "leaper",
-    "maze",
-    "miner",
-    "ninja",
-    "plunder",
-    "starpilot",
+C_FUNC_DEFS = [
+    "int get_state(libenv_env *, int, char *, int);",
+    "void set_state(libenv_env *, int, char *, int);",
+    "int create_completion_fd(libenv_env *);",
+    "int is_step_complete(libenv_env *);",
+    "void set_render_human(libenv_env *, uint8_t *, int);",
+    "void get_digests(libenv_env *, uint64_t *, uint64_t *);",
+    "void get_step_costs(libenv_env *, float *);",
+    "void clone_envs(libenv_env *, int *, int *, int, int);",
+    "void set_state_pool(libenv_env *, char *, int *, float *, int);",
+    "void set_state_pool_weights(libenv_env *, float *, int);",
+    "int get_level_metadata_names(libenv_env *, char *, int);",
+    "void generate_levels(libenv_env *, int *, int, float *);",
+    "int get_env_level_metadata(libenv_env *, int, char *, int, float *, int);",
+    "void rollout(libenv_env *, int32_t *, int, int, uint8_t *, float *, uint8_t *);",
+    "int num_episode_stats(libenv_env *);",
+    "int get_episode_stats(libenv_env *, int *, float *, int *, uint8_t *, int *, int *, int);",
 ]
 
-EXPLORATION_LEVEL_SEEDS = {
-    "coinrun": 1949448038,
-    "caveflyer": 1259048185,
-    "leaper": 1318677581,
-    "jumper": 1434825276,
-    "maze": 158988835,
-    "heist": 876640971,
-    "climber": 1561126160,
-    "ninja": 1123500215,
-}
-
-# should match DistributionMode in game.h, except for 'exploration' which is handled by Python
-DISTRIBUTION_MODE_DICT = {
-    "easy": 0,
-    "hard": 1,
-    "extreme": 2,
-    "memory": 10,
-    "exploration": 20,
-}
+# environment variables set by common MPI launchers for each rank
+MPI_RANK_VARS = ["OMPI_COMM_WORLD_RANK", "PMI_RANK", "PMIX_RANK", "MV2_COMM_WORLD_RANK", "SLURM_PROCID"]
+
+_lib_dir_lock = threading.Lock()
+_prebuilt_lib_dir = None
 
 
 def create_random_seed():
     rand_seed = random.SystemRandom().randint(0, 2 ** 31 - 1)
+    if "mpi4py" not in sys.modules and not any(var in os.environ for var in MPI_RANK_VARS):
+        # importing mpi4py is slow, skip it when this is clearly not an MPI process
+        return rand_seed
     try:
         # force MPI processes to definitely choose different random seeds
         from mpi4py import MPI
@@ -63,6 +58,84 @@ def create_random_seed():
     return rand_seed
 
 
+def _find_prebuilt_lib_dir():
+    """
+    Return the directory of the library included in an installed package, or None if there isn't one, the result is
+    cached since the files can't change while the package is in use
+    """
+    global _prebuilt_lib_dir
+    with _lib_dir_lock:
+        if _prebuilt_lib_dir is None:
+            lib_dir = os.path.join(SCRIPT_DIR, "data", "prebuilt")
+            if os.path.exists(lib_dir):
+                assert any([os.path.exists(os.path.join(lib_dir, name)) for name in ["libenv.so", "libenv.dylib", "env.dll"]]), "package is installed, but the prebuilt environment library is missing"
+                _prebuilt_lib_dir = lib_dir
+            else:
+                _prebuilt_lib_dir = ""
+        return _prebuilt_lib_dir or None
+
+
+class _CompiledFFI:
+    """
+    Wrap the FFI object of an out-of-line module to accept the keyword arguments that CEnv passes to dlopen()
+    """
+
+    def __init__(self, ffi):
+        self._ffi = ffi
+
+    def dlopen(self, name, flags=0):
+        return self._ffi.dlopen(name, flags)
+
+    def __getattr__(self, name):
+        return getattr(self._ffi, name)
+
+
+def _load_compiled_ffi(c_func_defs):
+    """
+    Load the cffi definitions for `c_func_defs` from an out-of-line module, which is generated the first time and is
+    much faster to load than parsing the libenv header in every process
+    """
+    import cffi
+    from cffi import recompiler
+
+    cdefs = [libenv._load_libenv_cdef()] + list(c_func_defs)
+    key = hashlib.sha256("\n".join([cffi.__version__] + cdefs).encode("utf8")).hexdigest()[:16]
+    module_name = f"_procgen_ffi_{key}"
+    # a per-user cache rather than the package directory, which may be shared or read-only
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    module_dir = os.path.join(cache_home, "procgen", "cffi")
+    module_path = os.path.join(module_dir, module_name + ".py")
+    if not os.path.exists(module_path):
+        ffi = cffi.FFI()
+        for cdef in cdefs:
+            ffi.cdef(cdef)
+        os.makedirs(module_dir, exist_ok=True)
+        tmp_path = f"{module_path}.{os.getpid()}.tmp"
+        recompiler.make_py_source(ffi, module_name, tmp_path)
+        os.replace(tmp_path, module_path)
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return _CompiledFFI(module.ffi)
+
+
+def _prepare_ffi(c_func_defs):
+    """
+    Add the compiled cffi definitions to the cache used by CEnv, falling back to parsing the header if they can't
+    be generated, for instance because the cache directory can't be written or the installed cffi can't load them
+
+    CEnv adds the parsed definitions to the cache, so the warning is only shown by the first environment
+    """
+    key = tuple(c_func_defs)
+    with libenv.FFI_CACHE_LOCK:
+        if key in libenv.FFI_CACHE:
+            return
+        try:
+            libenv.FFI_CACHE[key] = _load_compiled_ffi(c_func_defs)
+        except (OSError, ImportError) as e:
+            warnings.warn(f"failed to load the compiled cffi definitions, parsing the header instead: {e!r}")
+
+
 class BaseProcgenEnv(CEnv):
     """
     Base procedurally generated environment
@@ -82,19 +155,29 @@ class BaseProcgenEnv(CEnv):
         resource_root=None,
         num_threads=4,
         render_mode=None,
+        render_resolution=512,
+        render_env_indices=None,
+        render_interval=1,
+        digest_info=False,
+        episode_stats=False,
+        pregenerate_levels=False,
         level_options=None,
+        build_mode=None,
+        reuse_arrays=False,
     ):
         if resource_root is None:
             resource_root = os.path.join(SCRIPT_DIR, "data", "assets") + os.sep
             assert os.path.exists(resource_root)
 
-        lib_dir = os.path.join(SCRIPT_DIR, "data", "prebuilt")
-        if os.path.exists(lib_dir):
-            assert any([os.path.exists(os.path.join(lib_dir, name)) for name in ["libenv.so", "libenv.dylib", "env.dll"]]), "package is installed, but the prebuilt environment library is missing"
+        lib_dir = _find_prebuilt_lib_dir()
+        if lib_dir is not None:
             assert not debug, "debug has no effect for pre-compiled library"
+            assert build_mode is None, "build_mode has no effect for pre-compiled library"
         else:
             # only compile if we don't find a pre-built binary
-            lib_dir = build(debug=debug)
+            from .builder import build
+
+            lib_dir = build(debug=debug, mode=build_mode)
         
         self.combos = self.get_combos()
 
@@ -129,6 +212,11 @@ class BaseProcgenEnv(CEnv):
                 "rand_seed": rand_seed,
                 "num_threads": num_threads,
                 "render_human": render_human,
+                "render_resolution": render_resolution,
+                "render_interval": render_interval,
+                "digest_info": bool(digest_info),
+                "episode_stats": bool(episode_stats),
+                "pregenerate_levels": bool(pregenerate_levels),
                 # these will only be used the first time an environment is created in a process
                 "resource_root": resource_root,
                 "level_options_1": level_options_1,
@@ -136,19 +224,22 @@ class BaseProcgenEnv(CEnv):
             }
         )
 
+        if render_env_indices is not None:
+            options["render_env_indices"] = np.array(render_env_indices, dtype=np.int32)
+
         self.options = options
 
+        _prepare_ffi(C_FUNC_DEFS)
         super().__init__(
             lib_dir=lib_dir,
             num=num,
             options=options,
-            c_func_defs=[
-                "int get_state(libenv_env *, int, char *, int);",
-                "void set_state(libenv_env *, int, char *, int);",
-            ],
+            c_func_defs=C_FUNC_DEFS,
+            reuse_arrays=reuse_arrays,
         )
         # don't use the dict space for actions
         self.ac_space = self.ac_space["action"]
+        self._state_pool_size = 0
 
     def get_state(self):
         length = MAX_STATE_SIZE
@@ -165,6 +256,64 @@ class BaseProcgenEnv(CEnv):
             state = states[env_idx]
             self.call_c_func("set_state", env_idx, state, len(state))
 
+    def clone_envs(self, src_indices, dst_indices, observe=True):
+        """
+        Copy the state of environment src_indices[i] to environment dst_indices[i] for each i, which is the same
+        as calling set_state() with states from get_state() but doesn't copy the states to python.  States are
+        read before any environment is written, so an environment can be both a source and a destination.
+
+        :param observe: if False, the observations and infos of the destinations are not updated until the next
+            step, which saves rendering them when the next call is act()
+        """
+        src = np.ascontiguousarray(src_indices, dtype=np.int32)
+        dst = np.ascontiguousarray(dst_indices, dtype=np.int32)
+        assert src.ndim == 1 and src.shape == dst.shape
+        assert np.all((0 <= src) & (src < self.num)) and np.all((0 <= dst) & (dst < self.num)), "index out of range"
+        assert len(np.unique(dst)) == len(dst), "each environment can only be a destination once"
+        self.call_c_func(
+            "clone_envs",
+            self._ffi.from_buffer("int[]", src),
+            self._ffi.from_buffer("int[]", dst),
+            len(src),
+            int(observe),
+        )
+
+    def set_state_pool(self, states, weights=None):
+        """
+        Start each new episode from a state drawn from `states` (as returned by get_state()) instead of a new
+        level, for instance to restart from archived states in Go-Explore.  Environments only draw states of their
+        own game, with probability proportional to `weights`, and environments without any states in the pool reset
+        normally.  An empty list clears the pool.
+
+        The pool and the random draws from it are not part of the state returned by get_state().
+        """
+        if weights is None:
+            weights = np.ones(len(states), dtype=np.float32)
+        weights = self._check_state_pool_weights(weights, len(states))
+        lengths = np.array([len(state) for state in states], dtype=np.int32)
+        data = b"".join(states)
+        self.call_c_func(
+            "set_state_pool",
+            self._ffi.from_buffer("char[]", data),
+            self._ffi.from_buffer("int[]", lengths),
+            self._ffi.from_buffer("float[]", weights),
+            len(states),
+        )
+        self._state_pool_size = len(states)
+
+    def set_state_pool_weights(self, weights):
+        """
+        Change the sampling weights of the states passed to set_state_pool(), a weight of 0 excludes a state
+        """
+        weights = self._check_state_pool_weights(weights, self._state_pool_size)
+        self.call_c_func("set_state_pool_weights", self._ffi.from_buffer("float[]", weights), len(weights))
+
+    def _check_state_pool_weights(self, weights, count):
+        weights = np.ascontiguousarray(weights, dtype=np.float32)
+        assert weights.shape == (count,), f"expected {count} weights"
+        assert np.all(np.isfinite(weights)) and np.all(weights >= 0), "weights must be finite and non-negative"
+        return weights
+
     def get_combos(self):
         return [
             ("LEFT", "DOWN"),
@@ -207,10 +356,238 @@ class BaseProcgenEnv(CEnv):
             result.append(action)
         return result
 
+    def generate_levels(self, seeds):
+        """
+        Generate the level for each seed with the game and options of the first environment, without rendering or
+        changing the state of any environment, on `num_threads` threads
+
+        Returns a dict with the "seed" of each level and an array for each metadata field of the game, such as
+        "width" and "height", see procgen.levels.
+        """
+        seeds = np.ascontiguousarray(seeds, dtype=np.int32)
+        assert seeds.ndim == 1
+        length = self.call_c_func("get_level_metadata_names", self._ffi.NULL, 0)
+        names_buf = self._ffi.new(f"char[{length + 1}]")
+        self.call_c_func("get_level_metadata_names", names_buf, length)
+        names = self._ffi.string(names_buf).decode().split(",") if length > 0 else []
+        values = np.zeros((len(seeds), len(names)), dtype=np.float32)
+        self.call_c_func(
+            "generate_levels", self._ffi.from_buffer("int[]", seeds), len(seeds), self._ffi.from_buffer("float[]", values)
+        )
+        result = {"seed": seeds.copy()}
+        for i, name in enumerate(names):
+            result[name] = values[:, i]
+        return result
+
+    def get_level_metadata(self):
+        """
+        Return a list with a dict of the metadata fields of the current level of each environment, which are the
+        fields that generate_levels() returns for the game of the environment.  Fields that count entities or
+        measure the distance to the goal describe the level as it is now, so they only match generate_levels() at
+        the start of an episode.
+        """
+        result = []
+        for env_idx in range(self.num):
+            length = self.call_c_func("get_env_level_metadata", env_idx, self._ffi.NULL, 0, self._ffi.NULL, 0)
+            names_buf = self._ffi.new(f"char[{length + 1}]")
+            # each name takes at least one byte, so there are at most length fields
+            values = np.zeros(length, dtype=np.float32)
+            self.call_c_func(
+                "get_env_level_metadata", env_idx, names_buf, length, self._ffi.from_buffer("float[]", values), length
+            )
+            names = self._ffi.string(names_buf).decode().split(",") if length > 0 else []
+            result.append({name: float(values[i]) for i, name in enumerate(names)})
+        return result
+
+    def get_episode_stats(self):
+        """
+        Return the stats of the episodes that ended since the last call, requires episode_stats=True
+
+        The result is a dict of arrays with one entry per episode: "env_index", "return", "length", "level_complete",
+        "max_progress" and "level_seed", ordered by environment and then by the time the episode ended.  Only the
+        last 64 episodes of each environment are kept between calls.
+        """
+        count = self.call_c_func("num_episode_stats")
+        stats = {
+            "env_index": np.zeros(count, dtype=np.int32),
+            "return": np.zeros(count, dtype=np.float32),
+            "length": np.zeros(count, dtype=np.int32),
+            "level_complete": np.zeros(count, dtype=bool),
+            "max_progress": np.zeros(count, dtype=np.int32),
+            "level_seed": np.zeros(count, dtype=np.int32),
+        }
+        n = self.call_c_func(
+            "get_episode_stats",
+            self._ffi.from_buffer("int[]", stats["env_index"]),
+            self._ffi.from_buffer("float[]", stats["return"]),
+            self._ffi.from_buffer("int[]", stats["length"]),
+            self._ffi.from_buffer("uint8_t[]", stats["level_complete"]),
+            self._ffi.from_buffer("int[]", stats["max_progress"]),
+            self._ffi.from_buffer("int[]", stats["level_seed"]),
+            count,
+        )
+        assert n == count
+        return stats
+
+    def get_digests(self):
+        """
+        Return 64 bit digests of each environment's state (as returned by get_state()) and of its observation
+
+        The digests are two uint64 arrays of shape [num].
+        """
+        state_digests = np.zeros(self.num, dtype=np.uint64)
+        obs_digests = np.zeros(self.num, dtype=np.uint64)
+        self.call_c_func(
+            "get_digests",
+            self._ffi.from_buffer("uint64_t[]", state_digests),
+            self._ffi.from_buffer("uint64_t[]", obs_digests),
+        )
+        return state_digests, obs_digests
+
+    def get_step_costs(self):
+        """
+        Return a running average of the seconds taken by each environment's step, as a float32 array of shape [num]
+
+        Environments are stepped in order of decreasing cost so that the threads finish at about the same time.
+        """
+        costs = np.zeros(self.num, dtype=np.float32)
+        self.call_c_func("get_step_costs", self._ffi.from_buffer("float[]", costs))
+        return costs
+
+    def set_render_envs(self, env_indices=None, interval=1):
+        """
+        Change which environments render the "rgb" info when using render_mode="rgb_array", None selects all of
+        them.  Selected environments render every `interval` steps, other environments keep their last frame.
+        """
+        enabled = np.zeros(self.num, dtype=np.uint8)
+        if env_indices is None:
+            enabled[:] = 1
+        else:
+            enabled[np.asarray(env_indices, dtype=np.int64)] = 1
+        self.call_c_func("set_render_human", self._ffi.from_buffer("uint8_t[]", enabled), interval)
+
     def act(self, ac):
+        ac = _as_ndarray(ac)
+        buf = self._ac["action"]
+        assert (
+            buf.shape == ac.shape
+        ), f"action shape did not match expected={buf.shape} actual={ac.shape}"
         # tensorflow may return int64 actions (https://github.com/openai/gym/blob/master/gym/spaces/discrete.py#L13)
-        # so always cast actions to int32
-        return super().act({"action": ac.astype(np.int32)})
+        # so cast actions to int32 while copying them into the action buffer, this avoids allocating a new array
+        np.copyto(buf, ac, casting="unsafe")
+        self._c_lib.libenv_act(self._c_env)
+
+    def rollout(self, actions, frame_interval=1, ob=None, rew=None, first=None):
+        """
+        Take a fixed sequence of actions, each environment takes all of its steps on one stepping thread without
+        waiting for the other environments or returning to python between steps
+
+        `actions` has shape [T, num].  Returns (rew, ob, first) like observe(), where rew and first have shape
+        [T, num] and hold the reward and first flag after each step, and ob["rgb"] has shape
+        [T // frame_interval, num, 64, 64, 3] and holds the observation after every `frame_interval`-th step.
+        Observations that are not kept are not rendered.  The "rgb" info is only rendered on the steps where the
+        observation is kept.  After the call, observe() and get_info() return the results of the last step.
+
+        :param ob: optional uint8 array to write the observations to, rew and first are optional float32 and bool
+            arrays for the rewards and first flags
+        """
+        actions = np.ascontiguousarray(actions, dtype=np.int32)
+        assert actions.ndim == 2 and actions.shape[1] == self.num, f"actions must have shape [T, {self.num}]"
+        assert frame_interval > 0
+        num_steps = actions.shape[0]
+        ob_space = self.ob_space["rgb"]
+        shapes = dict(
+            ob=(num_steps // frame_interval, self.num) + ob_space.shape,
+            rew=(num_steps, self.num),
+            first=(num_steps, self.num),
+        )
+        dtypes = dict(ob=np.uint8, rew=np.float32, first=bool)
+        arrays = dict(ob=ob, rew=rew, first=first)
+        for name, arr in arrays.items():
+            if arr is None:
+                arrays[name] = np.zeros(shapes[name], dtype=dtypes[name])
+            else:
+                assert arr.shape == shapes[name] and arr.dtype == dtypes[name], f"{name} must be {dtypes[name].__name__} with shape {shapes[name]}"
+                assert arr.flags.c_contiguous, f"{name} must be C contiguous"
+        self.call_c_func(
+            "rollout",
+            self._ffi.from_buffer("int32_t[]", actions),
+            num_steps,
+            frame_interval,
+            self._ffi.from_buffer("uint8_t[]", arrays["ob"]),
+            self._ffi.from_buffer("float[]", arrays["rew"]),
+            self._ffi.from_buffer("uint8_t[]", arrays["first"]),
+        )
+        return arrays["rew"], {"rgb": arrays["ob"]}, arrays["first"]
+
+    def get_buffers(self):
+        """
+        Return the arrays that the environment writes to, as a dict with keys "ob", "info", "rew" and "first"
+
+        "ob" and "info" are dicts of arrays.  These arrays are updated in place, so they can be wrapped once as
+        tensors (for instance with torch.from_dlpack()) and read after each call to observe().
+        """
+        return dict(ob=self._ob, info=self._info, rew=self._rew, first=self._first)
+
+    def set_buffers(self, ob=None, info=None, rew=None, first=None):
+        """
+        Make the environment write to caller provided memory, such as pinned tensors
+
+        Each argument is optional and has the same layout as the corresponding entry from get_buffers().  Arrays can
+        be numpy arrays or any object supporting DLPack, they must be C contiguous and stay alive for as long as
+        the environment uses them.  The current observation is written to the new buffers.
+        """
+        ob = self._ob if ob is None else {k: _as_ndarray(v) for k, v in ob.items()}
+        info = self._info if info is None else {k: _as_ndarray(v) for k, v in info.items()}
+        rew = self._rew if rew is None else _as_ndarray(rew)
+        first = self._first if first is None else _as_ndarray(first)
+
+        for name, new, old in [("ob", ob, self._ob), ("info", info, self._info)]:
+            assert list(new.keys()) == list(old.keys()), f"{name} keys did not match"
+            for key in old:
+                _check_buffer(f"{name}.{key}", new[key], old[key])
+        _check_buffer("rew", rew, self._rew)
+        _check_buffer("first", first, self._first)
+
+        self._c_ob_buffers = self._buffer_pointers(ob)
+        self._c_info_buffers = self._buffer_pointers(info)
+        self._c_buffers.ob = self._c_ob_buffers
+        self._c_buffers.info = self._c_info_buffers
+        self._c_buffers.rew = self._ffi.cast("float *", rew.ctypes.data)
+        self._c_buffers.first = self._ffi.cast("uint8_t *", first.ctypes.data)
+        self._ob, self._info, self._rew, self._first = ob, info, rew, first
+        self._c_lib.libenv_set_buffers(self._c_env, self._c_buffers)
+
+    def _buffer_pointers(self, arrays):
+        pointers = self._ffi.new(f"void *[{len(arrays) * self.num}]")
+        for space_idx, arr in enumerate(arrays.values()):
+            stride = arr.strides[0]
+            for env_idx in range(self.num):
+                pointers[space_idx * self.num + env_idx] = self._ffi.cast(
+                    "void *", arr.ctypes.data + env_idx * stride
+                )
+        return pointers
+
+
+def _as_ndarray(arr):
+    """
+    View an array or tensor as a numpy array without copying it if possible
+    """
+    if isinstance(arr, np.ndarray):
+        return arr
+    if hasattr(arr, "__dlpack__"):
+        return np.from_dlpack(arr)
+    return np.asarray(arr)
+
+
+def _check_buffer(name, arr, expected):
+    assert (
+        arr.shape == expected.shape
+    ), f"{name} shape did not match expected={expected.shape} actual={arr.shape}"
+    assert (
+        arr.dtype == expected.dtype
+    ), f"{name} dtype did not match expected={expected.dtype} actual={arr.dtype}"
+    assert arr.flags.c_contiguous, f"{name} must be C contiguous"
 
 
 class ProcgenGym3Env(BaseProcgenEnv):
@@ -228,6 +605,8 @@ class ProcgenGym3Env(BaseProcgenEnv):
         use_generated_assets=False,
         paint_vel_info=False,
         distribution_mode="hard",
+        cache_static_layer=False,
+        generated_background_resolution=500,
         **kwargs,
     ):
         assert (
@@ -255,6 +634,8 @@ class ProcgenGym3Env(BaseProcgenEnv):
                 "use_backgrounds": bool(use_backgrounds),
                 "paint_vel_info": bool(paint_vel_info),
                 "distribution_mode": distribution_mode,
+                "cache_static_layer": bool(cache_static_layer),
+                "generated_background_resolution": generated_background_resolution,
             }
         super().__init__(num, env_name, options, **kwargs)
         
@@ -1,7 +1,12 @@
+import os
+import subprocess
+import sys
+
 import numpy as np
 import pytest
 from .env import ENV_NAMES
 from procgen import ProcgenGym3Env
+from .state_test import run_in_subproc
 
 
 @pytest.mark.parametrize("env_name", ["coinrun", "starpilot"])
@@ -52,6 +57,239 @@ def test_determinism(env_name):
     assert np.array_equal(obs1, obs2)
 
 
+def test_set_buffers():
+    rng = np.random.RandomState(0)
+    env1 = ProcgenGym3Env(num=2, env_name="coinrun", rand_seed=23)
+    env2 = ProcgenGym3Env(num=2, env_name="coinrun", rand_seed=23, reuse_arrays=True)
+    buffers = env2.get_buffers()
+    ob = {k: np.zeros_like(v) for k, v in buffers["ob"].items()}
+    rew = np.zeros_like(buffers["rew"])
+    first = np.zeros_like(buffers["first"])
+    env2.set_buffers(ob=ob, rew=rew, first=first)
+    assert env2.get_buffers()["ob"]["rgb"] is ob["rgb"]
+    for _ in range(64):
+        # int64 actions are converted without allocating a new array
+        ac = rng.randint(low=0, high=env1.ac_space.eltype.n, size=(env1.num,))
+        env1.act(ac)
+        env2.act(ac)
+        rew1, obs1, first1 = env1.observe()
+        env2.observe()
+        assert np.array_equal(obs1["rgb"], ob["rgb"])
+        assert np.array_equal(rew1, rew)
+        assert np.array_equal(first1, first)
+
+
+def test_render_subset():
+    rng = np.random.RandomState(0)
+    kwargs = dict(num=4, env_name="coinrun", rand_seed=0, render_mode="rgb_array", render_resolution=128)
+    env_all = ProcgenGym3Env(**kwargs)
+    env_subset = ProcgenGym3Env(render_env_indices=[1, 3], render_interval=2, **kwargs)
+    for step in range(1, 9):
+        ac = rng.randint(0, env_all.ac_space.eltype.n, size=(4,), dtype=np.int32)
+        env_all.act(ac)
+        env_subset.act(ac)
+        rgb_all = np.array([info["rgb"] for info in env_all.get_info()])
+        rgb_subset = np.array([info["rgb"] for info in env_subset.get_info()])
+        assert rgb_all.shape == (4, 128, 128, 3)
+        assert not rgb_subset[[0, 2]].any()
+        if step % 2 == 0:
+            assert np.array_equal(rgb_all[[1, 3]], rgb_subset[[1, 3]])
+
+    env_subset.set_render_envs([0])
+    env_all.act(np.zeros(4, dtype=np.int32))
+    env_subset.act(np.zeros(4, dtype=np.int32))
+    assert np.array_equal(env_all.get_info()[0]["rgb"], env_subset.get_info()[0]["rgb"])
+
+
+def test_joint_game_weights():
+    env = ProcgenGym3Env(num=8, env_name="bigfish:3,bossfight", rand_seed=0)
+    names = []
+    for state in env.get_state():
+        # the serialized state starts with the version and the length prefixed game name
+        length = int.from_bytes(state[4:8], "little")
+        names.append(state[8 : 8 + length].decode())
+    assert names == ["bigfish"] * 3 + ["bossfight"] + ["bigfish"] * 3 + ["bossfight"]
+    for _ in range(16):
+        env.act(np.zeros(env.num, dtype=np.int32))
+    costs = env.get_step_costs()
+    assert costs.shape == (8,) and np.all(costs > 0)
+
+
+def test_episode_stats():
+    rng = np.random.RandomState(0)
+    env = ProcgenGym3Env(num=4, env_name="coinrun", rand_seed=0, episode_stats=True)
+    returns = np.zeros(env.num, dtype=np.float32)
+    lengths = np.zeros(env.num, dtype=np.int32)
+    expected = []
+    for _ in range(2000):
+        env.act(rng.randint(0, env.ac_space.eltype.n, size=(env.num,), dtype=np.int32))
+        rew, _, first = env.observe()
+        returns += rew
+        lengths += 1
+        info = env.get_buffers()["info"]
+        for i in np.flatnonzero(first):
+            assert info["episode_return"][i] == returns[i]
+            assert info["episode_length"][i] == lengths[i]
+            expected.append((i, returns[i], lengths[i], info["episode_level_complete"][i]))
+            returns[i] = 0
+            lengths[i] = 0
+
+    stats = env.get_episode_stats()
+    actual = list(zip(stats["env_index"], stats["return"], stats["length"], stats["level_complete"]))
+    assert actual == sorted(expected, key=lambda episode: episode[0])
+    assert np.all(stats["max_progress"] <= 100)
+    # the step that reaches the coin is included in the progress
+    assert np.all(stats["max_progress"][stats["level_complete"].astype(bool)] == 100)
+    assert len(env.get_episode_stats()["return"]) == 0
+
+
+@pytest.mark.parametrize("env_name", ["coinrun", "climber", "chaser"])
+@pytest.mark.parametrize("frame_interval", [1, 3, 8])
+def test_rollout(env_name, frame_interval):
+    # these games compute their level progress each step, which must not depend on whether the step is rendered
+    rng = np.random.RandomState(0)
+    env1 = ProcgenGym3Env(num=4, env_name=env_name, rand_seed=0, episode_stats=True)
+    env2 = ProcgenGym3Env(num=4, env_name=env_name, rand_seed=0, episode_stats=True)
+    actions = rng.randint(0, env1.ac_space.eltype.n, size=(400, env1.num), dtype=np.int32)
+    rews, obs, firsts = [], [], []
+    for ac in actions:
+        env1.act(ac)
+        rew, ob, first = env1.observe()
+        rews.append(rew.copy())
+        obs.append(ob["rgb"].copy())
+        firsts.append(first.copy())
+
+    rew, ob, first = env2.rollout(actions, frame_interval=frame_interval)
+    assert np.array_equal(rew, np.array(rews))
+    assert np.array_equal(first, np.array(firsts))
+    assert np.array_equal(ob["rgb"], np.array(obs)[frame_interval - 1 :: frame_interval])
+    assert env1.get_state() == env2.get_state()
+    assert np.array_equal(env1.observe()[1]["rgb"], env2.observe()[1]["rgb"])
+    stats1, stats2 = env1.get_episode_stats(), env2.get_episode_stats()
+    for key in stats1:
+        assert np.array_equal(stats1[key], stats2[key]), key
+
+
+@pytest.mark.parametrize("use_rollout", [False, True])
+def test_rollout_speed(use_rollout, benchmark):
+    benchmark.group = "rollout"
+    env = ProcgenGym3Env(num=16, env_name="coinrun")
+    actions = np.zeros([1000, env.num], dtype=np.int32)
+
+    def run():
+        if use_rollout:
+            env.rollout(actions)
+        else:
+            for ac in actions:
+                env.act(ac)
+                env.observe()
+
+    benchmark(run)
+
+
+@pytest.mark.parametrize("env_name", ENV_NAMES)
+def test_pregenerate_levels(env_name):
+    rng = np.random.RandomState(0)
+    env_kwargs = dict(num=4, env_name=env_name, rand_seed=0, distribution_mode="easy", digest_info=True)
+    env1 = ProcgenGym3Env(**env_kwargs)
+    env2 = ProcgenGym3Env(pregenerate_levels=True, **env_kwargs)
+    for step in range(1000):
+        ac = rng.randint(0, env1.ac_space.eltype.n, size=(env1.num,), dtype=np.int32)
+        env1.act(ac)
+        env2.act(ac)
+        rew1, ob1, first1 = env1.observe()
+        rew2, ob2, first2 = env2.observe()
+        assert np.array_equal(rew1, rew2) and np.array_equal(first1, first2), f"step {step}"
+        assert np.array_equal(ob1["rgb"], ob2["rgb"]), f"step {step}"
+        for env_idx, (info1, info2) in enumerate(zip(env1.get_info(), env2.get_info())):
+            for key in ["state_digest", "level_seed"]:
+                assert np.array_equal(info1[key], info2[key]), f"step {step} env {env_idx} {key}"
+        if step == 500:
+            # replacing the states discards the levels that were generated for the old states
+            env2.set_state(env1.get_state())
+    assert env1.get_state() == env2.get_state()
+
+
+@pytest.mark.parametrize("pregenerate_levels", [False, True])
+def test_pregenerate_levels_speed(pregenerate_levels, benchmark):
+    benchmark.group = "pregenerate-levels"
+    env = ProcgenGym3Env(num=16, env_name="maze", pregenerate_levels=pregenerate_levels)
+    rng = np.random.RandomState(0)
+    actions = rng.randint(0, env.ac_space.eltype.n, size=(1000, env.num), dtype=np.int32)
+
+    def run():
+        for ac in actions:
+            env.act(ac)
+            env.observe()
+
+    benchmark(run)
+
+
+def rollout_with_assets(env_kwargs, num_steps=64):
+    env = ProcgenGym3Env(num=2, rand_seed=0, **env_kwargs)
+    obs = []
+    for _ in range(num_steps):
+        env.act(np.zeros(env.num, dtype=np.int32))
+        obs.append(env.observe()[1]["rgb"])
+    states = None if env_kwargs.get("use_generated_assets") else env.get_state()
+    return np.array(obs), states
+
+
+@pytest.mark.parametrize("env_name", ["coinrun", "bigfish"])
+@pytest.mark.parametrize("use_generated_assets", [False, True])
+def test_shared_assets(env_name, use_generated_assets):
+    # assets are shared by all environments in a process, so the second rollout here reuses the assets of the first
+    env_kwargs = dict(env_name=env_name, use_generated_assets=use_generated_assets)
+    rollout_with_assets(env_kwargs)
+    obs, states = rollout_with_assets(env_kwargs)
+    fresh_obs, fresh_states = run_in_subproc(rollout_with_assets, env_kwargs=env_kwargs)
+    assert np.array_equal(obs, fresh_obs)
+    assert states == fresh_states
+
+
+def test_background_cache():
+    # with few levels, most resets use a cached background
+    env_kwargs = dict(env_name="bigfish", use_generated_assets=True, num_levels=3)
+    obs, _ = rollout_with_assets(env_kwargs, num_steps=512)
+    fresh_obs, _ = run_in_subproc(rollout_with_assets, env_kwargs=env_kwargs, num_steps=512)
+    assert np.array_equal(obs, fresh_obs)
+
+
+@pytest.mark.parametrize("env_name", ["maze", "heist", "miner", "climber"])
+def test_cache_static_layer(env_name):
+    rng = np.random.RandomState(0)
+    kwargs = dict(num=2, env_name=env_name, rand_seed=0, render_mode="rgb_array", render_resolution=128)
+    env1 = ProcgenGym3Env(**kwargs)
+    env2 = ProcgenGym3Env(cache_static_layer=True, **kwargs)
+    for _ in range(256):
+        ac = rng.randint(0, env1.ac_space.eltype.n, size=(env1.num,), dtype=np.int32)
+        env1.act(ac)
+        env2.act(ac)
+        _, obs1, _ = env1.observe()
+        _, obs2, _ = env2.observe()
+        assert np.array_equal(obs1["rgb"], obs2["rgb"])
+        for info1, info2 in zip(env1.get_info(), env2.get_info()):
+            assert np.array_equal(info1["rgb"], info2["rgb"])
+
+
+@pytest.mark.parametrize("env_name", ["maze", "heist", "miner", "climber"])
+@pytest.mark.parametrize("cache_static_layer", [False, True])
+def test_static_layer_speed(env_name, cache_static_layer, benchmark):
+    benchmark.group = f"static-layer-{env_name}"
+    env = ProcgenGym3Env(num=16, env_name=env_name, cache_static_layer=cache_static_layer)
+
+    actions = np.zeros([env.num])
+
+    def rollout(max_steps):
+        step_count = 0
+        while step_count < max_steps:
+            env.act(actions)
+            env.observe()
+            step_count += 1
+
+    benchmark(lambda: rollout(1000))
+
+
 @pytest.mark.parametrize("env_name", ENV_NAMES)
 @pytest.mark.parametrize("num_envs", [1, 2, 16])
 def test_multi_speed(env_name, num_envs, benchmark):
@@ -66,4 +304,84 @@ def test_multi_speed(env_name, num_envs, benchmark):
             env.observe()
             step_count += 1
 
-    benchmark(lambda: rollout(1000))
\ No newline at end of file
+    benchmark(lambda: rollout(1000))
+
+@pytest.mark.skip(reason="slow")
+@pytest.mark.parametrize("env_name", ENV_NAMES)
+@pytest.mark.parametrize("build_mode", ["relwithdebinfo", "lto", "pgo"])
+def test_build_mode_speed(env_name, build_mode, benchmark):
+    benchmark.group = f"build-mode-{env_name}"
+    env = ProcgenGym3Env(num=16, env_name=env_name, build_mode=build_mode)
+
+    actions = np.zeros([env.num])
+
+    def rollout(max_steps):
+        step_count = 0
+        while step_count < max_steps:
+            env.act(actions)
+            env.observe()
+            step_count += 1
+
+    benchmark(lambda: rollout(1000))
+
+
+@pytest.mark.skip(reason="slow")
+@pytest.mark.parametrize("num_envs", [1024, 4096, 16384])
+def test_construction_speed(num_envs, benchmark):
+    benchmark.group = "construction"
+
+    def construct():
+        env = ProcgenGym3Env(num=num_envs, env_name="coinrun", num_threads=8)
+        # wait for the initial reset
+        env.observe()
+        env.close()
+
+    benchmark.pedantic(construct, rounds=3)
+
+
+def test_lazy_import():
+    # the environment classes, gym, gym3 and gymnasium are only loaded when they are first used
+    code = "import sys, procgen; assert not {'gym', 'gym3', 'gymnasium', 'procgen.env'} & set(sys.modules)"
+    subprocess.run([sys.executable, "-c", code], check=True)
+    # the gym environments are registered when gym is imported after procgen
+    code = "import procgen, gym; gym.spec('procgen-coinrun-v0')"
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_unwritable_ffi_cache(tmp_path):
+    # the cffi definitions are parsed from the header instead, with a single warning
+    cache_home = tmp_path / "not-a-directory"
+    cache_home.write_text("")
+    code = "\n".join(
+        [
+            "import warnings, procgen",
+            "with warnings.catch_warnings(record=True) as caught:",
+            "    warnings.simplefilter('always')",
+            "    for _ in range(2):",
+            "        procgen.ProcgenGym3Env(num=1, env_name='coinrun').observe()",
+            "assert len([w for w in caught if 'cffi' in str(w.message)]) == 1, caught",
+        ]
+    )
+    env = dict(os.environ, XDG_CACHE_HOME=str(cache_home))
+    subprocess.run([sys.executable, "-c", code], check=True, env=env)
+
+
+STARTUP_CODE = {
+    "import": "import procgen",
+    "first-step": "\n".join(
+        [
+            "import numpy as np",
+            "from procgen import ProcgenGym3Env",
+            "env = ProcgenGym3Env(num=1, env_name='coinrun')",
+            "env.act(np.zeros(1, dtype=np.int32))",
+            "env.observe()",
+        ]
+    ),
+}
+
+
+@pytest.mark.parametrize("stage", ["import", "first-step"])
+def test_startup_speed(stage, benchmark):
+    benchmark.group = "startup"
+    # each round starts a new process, like a short lived evaluation worker
+    benchmark.pedantic(lambda: subprocess.run([sys.executable, "-c", STARTUP_CODE[stage]], check=True), rounds=10)
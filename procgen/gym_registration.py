@@ -1,9 +1,13 @@
-from gym.envs.registration import register
-from gym3 import ToGymEnv, ViewerWrapper, ExtractDictObWrapper
-from .env import ENV_NAMES, ProcgenGym3Env
+import importlib.abc
+import sys
+
+from .constants import ENV_NAMES
 
 
 def make_env(render_mode=None, render=False, **kwargs):
+    from gym3 import ToGymEnv, ViewerWrapper, ExtractDictObWrapper
+    from .env import ProcgenGym3Env
+
     # the render option is kept here for backwards compatibility
     # users should use `render_mode="human"` or `render_mode="rgb_array"`
     if render:
@@ -27,9 +31,86 @@ def make_env(render_mode=None, render=False, **kwargs):
 
 
 def register_environments():
+    from gym.envs.registration import register
+
     for env_name in ENV_NAMES:
         register(
             id=f'procgen-{env_name}-v0',
             entry_point='procgen.gym_registration:make_env',
             kwargs={"env_name": env_name},
-        )
\ No newline at end of file
+        )
+
+def register_vector_environments():
+    import gymnasium
+
+    for env_name in ENV_NAMES:
+        if f"procgen-{env_name}-v0" in gymnasium.registry:
+            continue
+        gymnasium.register(
+            id=f"procgen-{env_name}-v0",
+            vector_entry_point="procgen.vector:ProcgenVectorEnv",
+            kwargs={"env_name": env_name},
+        )
+
+
+class _RegisterOnImport(importlib.abc.MetaPathFinder):
+    """
+    Call a function right after a module is first imported, by wrapping the loader found by the other finders
+    """
+
+    def __init__(self, callbacks):
+        self._callbacks = dict(callbacks)
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in self._callbacks:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is None or not hasattr(spec.loader, "exec_module"):
+            return spec
+        spec.loader = _CallbackLoader(spec.loader, self._pop_callback(fullname))
+        return spec
+
+    def _pop_callback(self, fullname):
+        callback = self._callbacks.pop(fullname)
+        if not self._callbacks and self in sys.meta_path:
+            sys.meta_path.remove(self)
+        return callback
+
+
+class _CallbackLoader(importlib.abc.Loader):
+    def __init__(self, loader, callback):
+        self._loader = loader
+        self._callback = callback
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        # put the original loader back so the module looks the same as if it was imported normally
+        module.__loader__ = module.__spec__.loader = self._loader
+        self._loader.exec_module(module)
+        self._callback()
+
+
+def register_when_imported():
+    """
+    Register the gym environments and the gymnasium vector environments once gym or gymnasium is imported
+
+    Importing either one takes most of the time of importing procgen, so neither is imported here, the environments
+    are registered right away for the ones that are already loaded and right after the import for the others
+    """
+    callbacks = {}
+    for module_name, register in [("gym", register_environments), ("gymnasium", register_vector_environments)]:
+        if module_name in sys.modules:
+            register()
+        else:
+            callbacks[module_name] = register
+    if callbacks:
+        sys.meta_path.insert(0, _RegisterOnImport(callbacks))
@@ -7,6 +7,7 @@ from ruamel.yaml import YAML
 
 from procgen import ProcgenGym3Env
 from .env import ENV_NAMES
+from .recorder import ColumnarRecorderWrapper
 from gym3 import Interactive, TrajectoryRecorderWrapper, VideoRecorderWrapper, unwrap
 
 
@@ -26,7 +27,7 @@ class ProcgenInteractive(Interactive):
         super()._update(dt, keys_clicked, keys_pressed)
 
 
-def make_interactive(vision, record_dir, traj_dir, traj_prefix, traj_log_method, **kwargs):
+def make_interactive(vision, record_dir, traj_dir, traj_prefix, traj_log_method, traj_format="pickle", **kwargs):
     info_key = None
     ob_key = None
     if vision == "human":
@@ -51,11 +52,21 @@ def make_interactive(vision, record_dir, traj_dir, traj_prefix, traj_log_method,
             raise NotImplementedError
         assert not traj_path.exists(), \
             f"Expected traj_path \"{traj_dir}\" to not exist, but it already exists."
-        env = TrajectoryRecorderWrapper(
-            env=env,
-            directory=traj_path,
-            filename_prefix=traj_prefix,
-        )
+        if traj_format == "pickle":
+            env = TrajectoryRecorderWrapper(
+                env=env,
+                directory=traj_path,
+                filename_prefix=traj_prefix,
+            )
+        elif traj_format == "columnar":
+            env = ColumnarRecorderWrapper(
+                env=env,
+                directory=traj_path,
+                flush_every_episode=True,
+                metadata=dict(kwargs),
+            )
+        else:
+            raise NotImplementedError
         # Add a file of useful information
         yaml_path = traj_path / "info.yaml"
         yaml = YAML()
@@ -119,6 +130,12 @@ def main():
         choices=["append", "direct"],
         help="Specifies how the trajectories should be logged.",
     )
+    parser.add_argument(
+        "--traj-format",
+        default="pickle",
+        choices=["pickle", "columnar"],
+        help="Specifies the trajectory file format, columnar writes chunked arrays that can be read with procgen.recorder.TrajectoryReader.",
+    )
 
     advanced_group = parser.add_argument_group("advanced optional switch arguments")
     advanced_group.add_argument(
@@ -176,9 +193,11 @@ def main():
     if args.level_options is not None:
         kwargs["level_options"] = args.level_options
     ia = make_interactive(
-        args.vision, record_dir=args.record_dir, traj_dir=args.traj_dir, traj_prefix=args.traj_prefix, traj_log_method=args.traj_log_method, env_name=args.env_name, **kwargs
+        args.vision, record_dir=args.record_dir, traj_dir=args.traj_dir, traj_prefix=args.traj_prefix, traj_log_method=args.traj_log_method, traj_format=args.traj_format, env_name=args.env_name, **kwargs
     )
     ia.run()
+    if isinstance(ia._env, ColumnarRecorderWrapper):
+        ia._env.close()
 
 
 if __name__ == "__main__":
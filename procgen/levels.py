@@ -0,0 +1,149 @@
+"""
+Generate levels without rendering them and index their metadata by seed
+
+Every game reports the "width" and "height" of its level grid and the number of entities in the level
+("num_entities"), some games add their own fields:
+
+- maze: "maze_size" and "solution_length", the number of moves from the agent to the goal
+- heist: "num_keys"
+- coinrun: "goal_x", "num_enemies", "num_saws" and "num_crates", coinrun levels are a run of ground sections of
+  different heights rather than separate platforms, so unlike climber they don't report "num_platforms"
+- climber: "num_platforms"
+
+Levels are generated exactly as they are at the start of an episode with the same seed and options, so an index can
+be used to choose the seeds to train on, for instance with `level_options` or `set_state_pool()`.
+
+    python -m procgen.levels --env-name maze --num-levels 100000 --output maze.npz
+"""
+
+import argparse
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .env import ProcgenGym3Env
+
+FORMAT_VERSION = 1
+
+
+def generate(
+    env_name: str,
+    seeds: Sequence[int],
+    level_options: Optional[Sequence[int]] = None,
+    num_threads: int = 4,
+    **env_kwargs: Any,
+) -> Dict[str, np.ndarray]:
+    """
+    Generate the level for each seed and return a dict with the "seed" and an array for each metadata field
+
+    :param level_options: passed to ProcgenGym3Env, as are options such as distribution_mode in env_kwargs
+    :param num_threads: number of threads to generate levels on
+    """
+    env = ProcgenGym3Env(
+        num=1, env_name=env_name, level_options=level_options, num_threads=num_threads, **env_kwargs
+    )
+    try:
+        return env.generate_levels(seeds)
+    finally:
+        env.close()
+
+
+class LevelIndex:
+    """
+    Metadata of a set of levels, sorted by seed
+
+    :param env_name: name of the game
+    :param env_kwargs: options the levels were generated with, including level_options
+    :param metadata: dict with a "seed" array and an array for each metadata field
+    """
+
+    def __init__(self, env_name: str, env_kwargs: Dict[str, Any], metadata: Dict[str, np.ndarray]) -> None:
+        self.env_name = env_name
+        self.env_kwargs = dict(env_kwargs)
+        order = np.argsort(metadata["seed"], kind="stable")
+        self.metadata = {name: np.asarray(arr)[order] for name, arr in metadata.items()}
+        assert len(np.unique(self.seeds)) == len(self.seeds), "seeds must be unique"
+
+    @classmethod
+    def build(cls, env_name: str, seeds: Sequence[int], **kwargs: Any) -> "LevelIndex":
+        """
+        Generate the levels for `seeds`, kwargs are passed to generate()
+        """
+        seeds = np.unique(np.asarray(seeds, dtype=np.int32))
+        env_kwargs = {k: v for k, v in kwargs.items() if k != "num_threads"}
+        if env_kwargs.get("level_options") is not None:
+            env_kwargs["level_options"] = list(env_kwargs["level_options"])
+        return cls(env_name, env_kwargs, generate(env_name, seeds, **kwargs))
+
+    @property
+    def seeds(self) -> np.ndarray:
+        return self.metadata["seed"]
+
+    @property
+    def fields(self) -> List[str]:
+        return [name for name in self.metadata if name != "seed"]
+
+    def __len__(self) -> int:
+        return len(self.seeds)
+
+    def get(self, seeds: Sequence[int]) -> Dict[str, np.ndarray]:
+        """
+        Return the metadata of each of `seeds`, which must be in the index
+        """
+        seeds = np.asarray(seeds, dtype=np.int32)
+        idxs = np.searchsorted(self.seeds, seeds)
+        found = (idxs < len(self)) & (self.seeds[np.minimum(idxs, len(self) - 1)] == seeds)
+        if not np.all(found):
+            raise KeyError(f"seeds not in index: {seeds[~found].tolist()}")
+        return {name: arr[idxs] for name, arr in self.metadata.items()}
+
+    def select(self, mask: np.ndarray) -> np.ndarray:
+        """
+        Return the seeds of the levels where `mask` is set, for instance `index.select(index.metadata["num_keys"] >= 2)`
+        """
+        return self.seeds[np.asarray(mask, dtype=bool)]
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                version=np.array(FORMAT_VERSION),
+                env_name=np.array(self.env_name),
+                env_kwargs=np.array(json.dumps(self.env_kwargs)),
+                **{f"field.{name}": arr for name, arr in self.metadata.items()},
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "LevelIndex":
+        with np.load(path) as data:
+            version = int(data["version"])
+            assert version == FORMAT_VERSION, f"unsupported version {version}"
+            metadata = {
+                name[len("field."):]: data[name] for name in data.files if name.startswith("field.")
+            }
+            return cls(str(data["env_name"]), json.loads(str(data["env_kwargs"])), metadata)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="generate an index of procgen level metadata")
+    parser.add_argument("--env-name", default="maze")
+    parser.add_argument("--distribution-mode", default="hard")
+    parser.add_argument("--start-level", type=int, default=0)
+    parser.add_argument("--num-levels", type=int, default=10000)
+    parser.add_argument("--num-threads", type=int, default=4)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args(argv)
+
+    index = LevelIndex.build(
+        args.env_name,
+        np.arange(args.start_level, args.start_level + args.num_levels),
+        distribution_mode=args.distribution_mode,
+        num_threads=args.num_threads,
+    )
+    index.save(args.output)
+    print(f"saved metadata of {len(index)} levels with fields {', '.join(index.fields)} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
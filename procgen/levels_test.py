@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from .env import ENV_NAMES, ProcgenGym3Env
+from .levels import LevelIndex, generate
+
+
+@pytest.mark.parametrize("env_name", ["maze", "heist", "coinrun", "bigfish"])
+def test_generate(env_name):
+    seeds = np.arange(100)
+    metadata = generate(env_name, seeds, num_threads=4)
+    assert np.array_equal(metadata["seed"], seeds)
+    assert {"width", "height", "num_entities"} <= set(metadata.keys())
+    # levels don't depend on the number of threads
+    single = generate(env_name, seeds, num_threads=0)
+    for name, arr in metadata.items():
+        assert np.array_equal(arr, single[name])
+    if env_name == "maze":
+        assert np.all(metadata["solution_length"] > 0)
+        assert np.all(metadata["maze_size"] <= metadata["width"])
+
+
+@pytest.mark.parametrize("env_name", ENV_NAMES)
+def test_generate_matches_env(env_name):
+    # the levels are the same as the first level of an environment started at the seed
+    seeds = np.arange(20)
+    metadata = generate(env_name, seeds, distribution_mode="easy")
+    for i, seed in enumerate(seeds):
+        env = ProcgenGym3Env(num=1, env_name=env_name, start_level=int(seed), num_levels=1, distribution_mode="easy")
+        env_metadata = env.get_level_metadata()[0]
+        assert sorted(env_metadata.keys()) == sorted(name for name in metadata if name != "seed")
+        for name, value in env_metadata.items():
+            assert value == metadata[name][i], name
+        env.close()
+
+
+def test_level_options():
+    metadata = generate("heist", np.arange(20), level_options=[9, 2])
+    assert np.all(metadata["num_keys"] == 2)
+
+
+def test_level_index(tmp_path):
+    metadata = {
+        "seed": np.array([5, 1, 3], dtype=np.int32),
+        "num_keys": np.array([2, 0, 1], dtype=np.float32),
+    }
+    index = LevelIndex("heist", dict(distribution_mode="easy"), metadata)
+    assert index.fields == ["num_keys"]
+    assert np.array_equal(index.seeds, [1, 3, 5])
+    assert np.array_equal(index.get([5, 1])["num_keys"], [2, 0])
+    assert np.array_equal(index.select(index.metadata["num_keys"] >= 1), [3, 5])
+    with pytest.raises(KeyError):
+        index.get([2])
+
+    path = str(tmp_path / "levels.npz")
+    index.save(path)
+    loaded = LevelIndex.load(path)
+    assert loaded.env_name == "heist"
+    assert loaded.env_kwargs == dict(distribution_mode="easy")
+    for name, arr in index.metadata.items():
+        assert np.array_equal(loaded.metadata[name], arr)
@@ -0,0 +1,312 @@
+"""
+Streaming columnar trajectory storage
+
+A trajectory directory contains:
+
+- meta.json: the number of environments and the shape and dtype of each field
+- index.jsonl: one line per chunk, a chunk is only added to the index once all of its files are written
+- one subdirectory per chunk, holding one .npy file per field (or a single fields.npz when compressed)
+
+Each field is stored as an array of shape [steps, num, ...].  Row t holds the observation, info and first flag
+seen before the action at row t, the action itself and the reward caused by that action, so episodes start at the
+rows where first is set.  Uncompressed chunks are memory mapped when read.
+"""
+
+import bisect
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from gym3.wrapper import Wrapper
+
+FORMAT_VERSION = 1
+
+META_FILENAME = "meta.json"
+INDEX_FILENAME = "index.jsonl"
+COMPRESSED_FILENAME = "fields.npz"
+
+# target size of a chunk in memory, the number of steps in a chunk is chosen from this
+DEFAULT_CHUNK_BYTES = 2 ** 26
+
+
+def _chunk_dirname(chunk_idx):
+    return f"{chunk_idx:06d}"
+
+
+def _flatten(prefix, value):
+    if isinstance(value, dict):
+        return {f"{prefix}.{k}": np.asarray(v) for k, v in value.items()}
+    return {prefix: np.asarray(value)}
+
+
+class TrajectoryWriter:
+    """
+    Append steps from a batch of environments to a trajectory directory
+
+    If the directory already contains a trajectory, new steps are appended to it.
+
+    :param directory: directory to write to
+    :param num: number of environments in each step
+    :param compress: if set, store each chunk as a compressed .npz file, these can't be memory mapped
+    :param chunk_bytes: approximate size of a chunk, steps are buffered in memory until a chunk is full
+    :param metadata: json serializable data stored in meta.json, such as the environment options
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        num: int,
+        compress: bool = False,
+        chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.directory = os.path.abspath(directory)
+        self.num = num
+        self.compress = compress
+        self._chunk_bytes = chunk_bytes
+        self._metadata = {} if metadata is None else metadata
+        self._fields = None
+        self._buffers = None
+        self._buffer_len = 0
+        self._chunk_len = 0
+        self._num_chunks = 0
+        self.num_steps = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        meta_path = os.path.join(self.directory, META_FILENAME)
+        if os.path.exists(meta_path):
+            reader = TrajectoryReader(self.directory)
+            assert reader.num == num, f"existing trajectory has num={reader.num}"
+            self._fields = reader.fields
+            self._num_chunks = len(reader.chunks)
+            self.num_steps = len(reader)
+            self._metadata = reader.metadata
+
+    def _init_fields(self, step: Dict[str, np.ndarray]) -> None:
+        fields = {
+            name: dict(shape=list(arr.shape[1:]), dtype=arr.dtype.str)
+            for name, arr in step.items()
+        }
+        if self._fields is None:
+            self._fields = fields
+            meta = dict(
+                version=FORMAT_VERSION,
+                num=self.num,
+                fields=self._fields,
+                metadata=self._metadata,
+            )
+            with open(os.path.join(self.directory, META_FILENAME), "w") as f:
+                json.dump(meta, f)
+        else:
+            assert fields == self._fields, "fields do not match the existing trajectory"
+
+        step_bytes = sum(arr.nbytes for arr in step.values())
+        self._chunk_len = max(1, self._chunk_bytes // step_bytes)
+        self._buffers = {
+            name: np.zeros((self._chunk_len,) + arr.shape, dtype=arr.dtype)
+            for name, arr in step.items()
+        }
+
+    def append(self, step: Dict[str, np.ndarray]) -> None:
+        """
+        Add a single step, `step` maps field names to arrays of shape [num, ...]
+        """
+        if self._buffers is None:
+            self._init_fields(step)
+        assert sorted(step.keys()) == sorted(self._buffers.keys()), "fields changed between steps"
+        for name, arr in step.items():
+            assert arr.shape[0] == self.num, f"field {name} has the wrong batch size"
+            self._buffers[name][self._buffer_len] = arr
+        self._buffer_len += 1
+        if self._buffer_len == self._chunk_len:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write buffered steps to a new chunk
+        """
+        if self._buffer_len == 0:
+            return
+        chunk_idx = self._num_chunks
+        chunk_dir = os.path.join(self.directory, _chunk_dirname(chunk_idx))
+        os.makedirs(chunk_dir, exist_ok=True)
+        arrays = {name: buf[: self._buffer_len] for name, buf in self._buffers.items()}
+        if self.compress:
+            np.savez_compressed(os.path.join(chunk_dir, COMPRESSED_FILENAME), **arrays)
+        else:
+            for name, arr in arrays.items():
+                np.save(os.path.join(chunk_dir, name + ".npy"), arr)
+        entry = dict(
+            chunk=chunk_idx,
+            start=self.num_steps,
+            length=self._buffer_len,
+            compressed=self.compress,
+        )
+        with open(os.path.join(self.directory, INDEX_FILENAME), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        self.num_steps += self._buffer_len
+        self._num_chunks += 1
+        self._buffer_len = 0
+
+    def close(self) -> None:
+        self.flush()
+
+
+class TrajectoryReader:
+    """
+    Random access to a trajectory directory written by TrajectoryWriter
+
+    Chunks that were being written when the writer stopped are ignored.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = os.path.abspath(directory)
+        with open(os.path.join(self.directory, META_FILENAME)) as f:
+            meta = json.load(f)
+        assert meta["version"] == FORMAT_VERSION, f"unsupported version {meta['version']}"
+        self.num = meta["num"]
+        self.fields = meta["fields"]
+        self.metadata = meta["metadata"]
+        self.chunks = []
+        index_path = os.path.join(self.directory, INDEX_FILENAME)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        # partially written line
+                        break
+                    self.chunks.append(json.loads(line))
+        self._starts = [c["start"] for c in self.chunks]
+        self._loaded = {}
+
+    def __len__(self) -> int:
+        if len(self.chunks) == 0:
+            return 0
+        return self.chunks[-1]["start"] + self.chunks[-1]["length"]
+
+    def _load_chunk(self, chunk_idx: int, name: str) -> np.ndarray:
+        key = (chunk_idx, name)
+        if key not in self._loaded:
+            chunk = self.chunks[chunk_idx]
+            chunk_dir = os.path.join(self.directory, _chunk_dirname(chunk["chunk"]))
+            if chunk["compressed"]:
+                with np.load(os.path.join(chunk_dir, COMPRESSED_FILENAME)) as data:
+                    for field_name in data.files:
+                        self._loaded[(chunk_idx, field_name)] = data[field_name]
+            else:
+                self._loaded[key] = np.load(
+                    os.path.join(chunk_dir, name + ".npy"), mmap_mode="r"
+                )
+        return self._loaded[key]
+
+    def get(
+        self, name: str, start: int, stop: Optional[int] = None, env_idx: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Read rows [start, stop) of a field, optionally for a single environment
+        """
+        assert name in self.fields, f"unknown field {name}"
+        if stop is None:
+            stop = start + 1
+        assert 0 <= start <= stop <= len(self), "rows out of range"
+        parts = []
+        row = start
+        while row < stop:
+            chunk_idx = bisect.bisect_right(self._starts, row) - 1
+            chunk = self.chunks[chunk_idx]
+            offset = row - chunk["start"]
+            count = min(stop - row, chunk["length"] - offset)
+            arr = self._load_chunk(chunk_idx, name)[offset : offset + count]
+            if env_idx is not None:
+                arr = arr[:, env_idx]
+            parts.append(arr)
+            row += count
+        if len(parts) == 1:
+            return parts[0]
+        if len(parts) == 0:
+            shape = [0] + ([] if env_idx is not None else [self.num]) + self.fields[name]["shape"]
+            return np.zeros(shape, dtype=np.dtype(self.fields[name]["dtype"]))
+        return np.concatenate(parts)
+
+    def episodes(self) -> Iterator[Tuple[int, int, int]]:
+        """
+        Yield (env_idx, start, stop) for each episode, ordered by the row where it ends
+
+        Episodes that were still running when recording stopped are included.
+        """
+        first = self.get("first", 0, len(self))
+        ends = []
+        for env_idx in range(self.num):
+            starts = np.flatnonzero(first[:, env_idx]).tolist()
+            if len(starts) == 0 or starts[0] != 0:
+                starts.insert(0, 0)
+            bounds = starts + [len(first)]
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                if stop > start:
+                    ends.append((stop, env_idx, start))
+        for stop, env_idx, start in sorted(ends):
+            yield env_idx, start, stop
+
+    def read_episode(
+        self, env_idx: int, start: int, stop: int, fields: Optional[List[str]] = None
+    ) -> Dict[str, np.ndarray]:
+        if fields is None:
+            fields = list(self.fields.keys())
+        return {name: self.get(name, start, stop, env_idx=env_idx) for name in fields}
+
+
+class ColumnarRecorderWrapper(Wrapper):
+    """
+    Record all steps of a batch of environments with a TrajectoryWriter
+
+    Observations are stored as "ob" or "ob.<key>", actions as "act" or "act.<key>" and info entries as "info.<key>".
+
+    :param env: gym3 environment to record
+    :param directory: directory to save the trajectory to
+    :param info_keys: if set, only record these info keys
+    :param flush_every_episode: if set, write buffered steps whenever an episode ends, useful when the process may
+        exit without calling close()
+    :param kwargs: passed to TrajectoryWriter
+    """
+
+    def __init__(
+        self,
+        env,
+        directory: str,
+        info_keys: Optional[List[str]] = None,
+        flush_every_episode: bool = False,
+        **kwargs,
+    ) -> None:
+        super().__init__(env=env)
+        self._info_keys = info_keys
+        self._flush_every_episode = flush_every_episode
+        self._writer = TrajectoryWriter(directory, num=env.num, **kwargs)
+
+    def act(self, ac: Any) -> None:
+        _, ob, first = self.observe()
+        infos = self.get_info()
+        info_keys = self._info_keys
+        if info_keys is None:
+            info_keys = sorted(infos[0].keys())
+
+        step = {}
+        step.update(_flatten("ob", ob))
+        step.update(_flatten("act", ac))
+        for key in info_keys:
+            step[f"info.{key}"] = np.stack([np.asarray(info[key]) for info in infos])
+        step["first"] = np.asarray(first)
+
+        super().act(ac)
+
+        rew, _, first = self.observe()
+        step["reward"] = np.asarray(rew)
+        self._writer.append(step)
+        if self._flush_every_episode and np.any(first):
+            self._writer.flush()
+
+    def close(self) -> None:
+        """
+        Write any buffered steps, this must be called before the trajectory is read
+        """
+        self._writer.close()
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from gym3 import types
+from gym3.env import Env
+
+from .recorder import ColumnarRecorderWrapper, TrajectoryReader, TrajectoryWriter
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_writer_reader(tmp_path, compress):
+    num = 3
+    writer = TrajectoryWriter(tmp_path, num=num, compress=compress, chunk_bytes=200)
+    rng = np.random.RandomState(0)
+    steps = []
+    for _ in range(25):
+        step = {
+            "ob.rgb": rng.randint(0, 256, size=(num, 4, 4, 3), dtype=np.uint8),
+            "act": rng.randint(0, 15, size=(num,), dtype=np.int32),
+            "reward": rng.rand(num).astype(np.float32),
+            "first": rng.rand(num) < 0.2,
+        }
+        steps.append(step)
+        writer.append(step)
+    writer.close()
+
+    reader = TrajectoryReader(tmp_path)
+    assert len(reader) == 25
+    assert len(reader.chunks) > 1
+    for name in steps[0]:
+        expected = np.stack([s[name] for s in steps])
+        assert np.array_equal(reader.get(name, 0, len(reader)), expected)
+        assert np.array_equal(reader.get(name, 7, 19, env_idx=1), expected[7:19, 1])
+
+    # appending to an existing directory continues the trajectory
+    writer = TrajectoryWriter(tmp_path, num=num, compress=compress)
+    writer.append(steps[0])
+    writer.close()
+    reader = TrajectoryReader(tmp_path)
+    assert len(reader) == 26
+    assert np.array_equal(reader.get("ob.rgb", 25)[0], steps[0]["ob.rgb"])
+
+
+class CounterEnv(Env):
+    """
+    Observations count the steps in the current episode, episode lengths differ per environment
+    """
+
+    def __init__(self, episode_lens):
+        super().__init__(
+            ob_space=types.TensorType(eltype=types.Discrete(256), shape=(3,)),
+            ac_space=types.discrete_scalar(4),
+            num=len(episode_lens),
+        )
+        self._episode_lens = np.array(episode_lens)
+        self._steps = np.zeros(self.num, dtype=np.int64)
+
+    def observe(self):
+        rew = (self._steps == 0).astype(np.float32)
+        ob = np.repeat(self._steps[:, None], 3, axis=1).astype(np.uint8)
+        return rew, ob, self._steps == 0
+
+    def get_info(self):
+        return [{"step": int(s)} for s in self._steps]
+
+    def act(self, ac):
+        self._steps = (self._steps + 1) % self._episode_lens
+
+
+def test_recorder_wrapper(tmp_path):
+    ep_len1 = 3
+    ep_len2 = 4
+    env = ColumnarRecorderWrapper(env=CounterEnv([ep_len1, ep_len2]), directory=tmp_path)
+    action = np.zeros(env.num, dtype=np.int32)
+    num_acs = 10
+    obs = []
+    for _ in range(num_acs):
+        _, ob, _ = env.observe()
+        obs.append(ob)
+        env.act(action)
+    env.close()
+
+    reader = TrajectoryReader(tmp_path)
+    assert len(reader) == num_acs
+    assert np.array_equal(reader.get("ob", 0, num_acs), np.stack(obs))
+    assert np.array_equal(reader.get("info.step", 0, num_acs), np.stack(obs)[:, :, 0])
+    episodes = list(reader.episodes())
+    complete = [(e, start, stop) for e, start, stop in episodes if stop < num_acs]
+    assert sorted(stop - start for e, start, stop in complete if e == 0) == [ep_len1] * 3
+    assert sorted(stop - start for e, start, stop in complete if e == 1) == [ep_len2] * 2
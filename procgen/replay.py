@@ -0,0 +1,223 @@
+"""
+Compact trajectories that are regenerated by replaying actions
+
+Procgen is deterministic given the state of each environment and the actions taken, so instead of storing every
+frame, a trajectory can store the initial state of each environment (from get_state()), the environment options and
+the int32 action stream.  Rewards and episode boundaries are stored as well so that a replay can be checked against
+the recording.  Observations, including the "rgb" info at any resolution, are regenerated on demand by stepping a
+new environment, which renders on its stepping threads.
+
+Options that change level generation must be the same as when recording, options that are part of the saved state
+(such as use_backgrounds) are restored from it and can't be changed on replay.
+"""
+
+import json
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from gym3.wrapper import Wrapper
+
+from .env import ProcgenGym3Env
+
+FORMAT_VERSION = 1
+
+# options that are only relevant to the process that recorded a trajectory
+_IGNORED_ENV_KWARGS = {"num", "render_mode", "render_resolution", "num_threads", "rand_seed", "debug", "build_mode"}
+
+
+def _pack_states(states: Sequence[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    offsets = np.zeros(len(states) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(s) for s in states])
+    data = np.frombuffer(b"".join(states), dtype=np.uint8)
+    return data, offsets
+
+
+def _unpack_states(data: np.ndarray, offsets: np.ndarray) -> List[bytes]:
+    return [data[start:stop].tobytes() for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+class CompactTrajectory:
+    """
+    The initial state of a batch of environments and the steps taken from it
+
+    :param env_kwargs: keyword arguments used to create the ProcgenGym3Env, excluding num
+    :param states: initial state of each environment from get_state()
+    :param actions: int32 array of shape [steps, num]
+    :param rewards: float32 array of shape [steps, num], the reward from each action
+    :param firsts: bool array of shape [steps, num], the first flag after each action
+    """
+
+    def __init__(
+        self,
+        env_kwargs: Dict[str, Any],
+        states: Sequence[bytes],
+        actions: np.ndarray,
+        rewards: np.ndarray,
+        firsts: np.ndarray,
+    ) -> None:
+        self.env_kwargs = {k: v for k, v in env_kwargs.items() if k not in _IGNORED_ENV_KWARGS}
+        self.states = list(states)
+        self.actions = np.asarray(actions, dtype=np.int32)
+        self.rewards = np.asarray(rewards, dtype=np.float32)
+        self.firsts = np.asarray(firsts, dtype=bool)
+        assert self.actions.shape == (len(self), self.num)
+        assert self.rewards.shape == self.actions.shape
+        assert self.firsts.shape == self.actions.shape
+
+    @property
+    def num(self) -> int:
+        return len(self.states)
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    def save(self, path: str) -> None:
+        state_data, state_offsets = _pack_states(self.states)
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                version=np.array(FORMAT_VERSION),
+                env_kwargs=np.array(json.dumps(self.env_kwargs)),
+                state_data=state_data,
+                state_offsets=state_offsets,
+                actions=self.actions,
+                rewards=self.rewards,
+                firsts=self.firsts,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "CompactTrajectory":
+        with np.load(path) as data:
+            version = int(data["version"])
+            assert version == FORMAT_VERSION, f"unsupported version {version}"
+            return cls(
+                env_kwargs=json.loads(str(data["env_kwargs"])),
+                states=_unpack_states(data["state_data"], data["state_offsets"]),
+                actions=data["actions"],
+                rewards=data["rewards"],
+                firsts=data["firsts"],
+            )
+
+
+class CompactRecorderWrapper(Wrapper):
+    """
+    Record the actions taken in a ProcgenGym3Env as a CompactTrajectory
+
+    The initial state is saved when the wrapper is created.
+
+    :param env: ProcgenGym3Env, possibly wrapped, the wrappers must forward callmethod()
+    :param env_kwargs: keyword arguments that were used to create the environment, excluding num
+    """
+
+    def __init__(self, env, env_kwargs: Dict[str, Any]) -> None:
+        super().__init__(env=env)
+        self._env_kwargs = dict(env_kwargs)
+        self._states = env.callmethod("get_state")
+        self._actions = []
+        self._rewards = []
+        self._firsts = []
+
+    def act(self, ac: Any) -> None:
+        super().act(ac)
+        rew, _, first = self.observe()
+        self._actions.append(np.array(ac, dtype=np.int32))
+        self._rewards.append(np.array(rew, dtype=np.float32))
+        self._firsts.append(np.array(first, dtype=bool))
+
+    def get_trajectory(self) -> CompactTrajectory:
+        shape = (0, self.num)
+        return CompactTrajectory(
+            env_kwargs=self._env_kwargs,
+            states=self._states,
+            actions=np.stack(self._actions) if self._actions else np.zeros(shape, dtype=np.int32),
+            rewards=np.stack(self._rewards) if self._rewards else np.zeros(shape, dtype=np.float32),
+            firsts=np.stack(self._firsts) if self._firsts else np.zeros(shape, dtype=bool),
+        )
+
+    def save(self, path: str) -> None:
+        self.get_trajectory().save(path)
+
+
+def replay(
+    trajectories: Sequence[CompactTrajectory],
+    render_resolution: Optional[int] = None,
+    frame_interval: int = 1,
+    num_threads: int = 4,
+    check: bool = True,
+) -> Iterator[Tuple[int, Dict[str, np.ndarray]]]:
+    """
+    Regenerate the frames of a batch of trajectories in a single environment
+
+    All trajectories must have been recorded with the same env_kwargs.  Yields (t, frames) for every
+    `frame_interval`-th step t, including the final one, where frames["ob"] holds the observations of all
+    environments of all trajectories (concatenated in order) before action t is taken, and frames["rgb"] holds the
+    "rgb" info at `render_resolution` if it is set.  Trajectories that have ended repeat their last action, their
+    frames past the end should be ignored.
+
+    :param check: if set, raise an error if the rewards or episode boundaries differ from the recording
+    """
+    assert len(trajectories) > 0
+    env_kwargs = trajectories[0].env_kwargs
+    for traj in trajectories:
+        assert traj.env_kwargs == env_kwargs, "trajectories were recorded with different options"
+    assert frame_interval > 0
+
+    num = sum(traj.num for traj in trajectories)
+    steps = max(len(traj) for traj in trajectories)
+    actions = np.zeros((steps, num), dtype=np.int32)
+    valid = np.zeros((steps, num), dtype=bool)
+    offset = 0
+    for traj in trajectories:
+        n = len(traj)
+        actions[:n, offset : offset + traj.num] = traj.actions
+        if 0 < n < steps:
+            actions[n:, offset : offset + traj.num] = traj.actions[-1]
+        valid[:n, offset : offset + traj.num] = True
+        offset += traj.num
+
+    kwargs = dict(env_kwargs)
+    kwargs["num_threads"] = num_threads
+    if render_resolution is not None:
+        kwargs["render_mode"] = "rgb_array"
+        kwargs["render_resolution"] = render_resolution
+    env = ProcgenGym3Env(num=num, **kwargs)
+    env.set_state([state for traj in trajectories for state in traj.states])
+
+    def frames():
+        _, ob, _ = env.observe()
+        result = {"ob": ob["rgb"].copy()}
+        if render_resolution is not None:
+            result["rgb"] = np.stack([info["rgb"] for info in env.get_info()])
+        return result
+
+    for t in range(steps):
+        if t % frame_interval == 0:
+            yield t, frames()
+        env.act(actions[t])
+        if check:
+            rew, _, first = env.observe()
+            expected_rew = np.concatenate([_step_or_zero(traj.rewards, t, traj.num) for traj in trajectories])
+            expected_first = np.concatenate([_step_or_zero(traj.firsts, t, traj.num) for traj in trajectories])
+            mask = valid[t]
+            if not (np.array_equal(rew[mask], expected_rew[mask]) and np.array_equal(first[mask], expected_first[mask])):
+                raise RuntimeError(f"replay diverged from the recording at step {t}")
+    yield steps, frames()
+
+
+def _step_or_zero(arr: np.ndarray, t: int, num: int) -> np.ndarray:
+    if t < len(arr):
+        return arr[t]
+    return np.zeros(num, dtype=arr.dtype)
+
+
+def regenerate(
+    trajectory: CompactTrajectory, render_resolution: Optional[int] = None, **kwargs
+) -> Dict[str, np.ndarray]:
+    """
+    Regenerate the frames of a single trajectory, returning arrays of shape [frames, num, ...]
+    """
+    result = {}
+    for _, frames in replay([trajectory], render_resolution=render_resolution, **kwargs):
+        for name, arr in frames.items():
+            result.setdefault(name, []).append(arr)
+    return {name: np.stack(arrs) for name, arrs in result.items()}
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import gym3
+from procgen import ProcgenGym3Env
+from .replay import CompactRecorderWrapper, CompactTrajectory, regenerate, replay
+
+
+def test_save_load(tmp_path):
+    rng = np.random.RandomState(0)
+    traj = CompactTrajectory(
+        env_kwargs=dict(env_name="coinrun", num=2, rand_seed=3, level_options=[1, 2]),
+        states=[b"abc", b"\x00" * 10],
+        actions=rng.randint(0, 15, size=(5, 2)),
+        rewards=rng.rand(5, 2),
+        firsts=rng.rand(5, 2) < 0.5,
+    )
+    assert traj.env_kwargs == dict(env_name="coinrun", level_options=[1, 2])
+    path = str(tmp_path / "traj.npz")
+    traj.save(path)
+    loaded = CompactTrajectory.load(path)
+    assert loaded.env_kwargs == traj.env_kwargs
+    assert loaded.states == traj.states
+    for name in ["actions", "rewards", "firsts"]:
+        assert np.array_equal(getattr(loaded, name), getattr(traj, name))
+
+
+def record(env_kwargs, num, num_steps, seed):
+    env = CompactRecorderWrapper(ProcgenGym3Env(num=num, **env_kwargs), env_kwargs=env_kwargs)
+    rng = np.random.RandomState(seed)
+    obs = []
+    for _ in range(num_steps):
+        obs.append(env.observe()[1]["rgb"].copy())
+        env.act(gym3.types_np.sample(env.ac_space, bshape=(env.num,), rng=rng))
+    obs.append(env.observe()[1]["rgb"].copy())
+    return env.get_trajectory(), np.stack(obs)
+
+
+@pytest.mark.parametrize("env_name", ["coinrun", "starpilot"])
+def test_replay(tmp_path, env_name):
+    env_kwargs = dict(env_name=env_name, distribution_mode="easy")
+    traj_a, obs_a = record(env_kwargs, num=2, num_steps=100, seed=0)
+    traj_b, obs_b = record(env_kwargs, num=1, num_steps=60, seed=1)
+
+    path = str(tmp_path / "traj.npz")
+    traj_a.save(path)
+    traj_a = CompactTrajectory.load(path)
+
+    frames = regenerate(traj_a, render_resolution=128)
+    assert np.array_equal(frames["ob"], obs_a)
+    assert frames["rgb"].shape == (101, 2, 128, 128, 3)
+
+    # batched replay of trajectories with different lengths
+    for t, frames in replay([traj_a, traj_b], frame_interval=10):
+        assert np.array_equal(frames["ob"][:2], obs_a[t])
+        if t < len(obs_b):
+            assert np.array_equal(frames["ob"][2:], obs_b[t])
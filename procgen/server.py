@@ -0,0 +1,387 @@
+"""
+Serve a batched procgen environment to many clients over a socket
+
+The server hosts a single ProcgenGym3Env and gives each client a fixed slice of its environments.  Steps are
+coalesced: once every connected client has sent its actions, the whole batch is stepped at once on the
+environment's stepping threads, then each client receives the results for its slice.  A slow client therefore slows
+down every client of the same server.
+
+Messages are a little endian uint32 header length and uint32 payload length, followed by a JSON header and a binary
+payload.  Observations are written to a shared memory block per client when the client is on the same machine
+(the default for Unix sockets), otherwise they are sent zlib compressed.
+
+To run a server and measure its throughput:
+
+    python -m procgen.server serve --path /tmp/procgen.sock --env-name coinrun --max-clients 8 --client-num 16
+    python -m procgen.server loadtest --path /tmp/procgen.sock --clients 8 --steps 1000
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import socket
+import struct
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+_FRAME = struct.Struct("<II")
+
+
+def _pack_message(header: Dict[str, Any], payload: bytes = b"") -> bytes:
+    header_bytes = json.dumps(header).encode("utf8")
+    return _FRAME.pack(len(header_bytes), len(payload)) + header_bytes + payload
+
+
+def _unpack_header(data: bytes) -> Dict[str, Any]:
+    return json.loads(data.decode("utf8"))
+
+
+async def _read_message(reader: asyncio.StreamReader) -> Tuple[Dict[str, Any], bytes]:
+    header_len, payload_len = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+    header = _unpack_header(await reader.readexactly(header_len))
+    payload = await reader.readexactly(payload_len)
+    return header, payload
+
+
+def _recv_exactly(sock: socket.socket, n: int) -> bytearray:
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while n > 0:
+        count = sock.recv_into(view, n)
+        if count == 0:
+            raise ConnectionError("connection closed by server")
+        view = view[count:]
+        n -= count
+    return buf
+
+
+def _recv_message(sock: socket.socket) -> Tuple[Dict[str, Any], bytearray]:
+    header_len, payload_len = _FRAME.unpack(_recv_exactly(sock, _FRAME.size))
+    header = _unpack_header(bytes(_recv_exactly(sock, header_len)))
+    return header, _recv_exactly(sock, payload_len)
+
+
+def _create_shared_memory(size: int):
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        # python < 3.8
+        return None
+    return shared_memory.SharedMemory(create=True, size=size)
+
+
+def _attach_shared_memory(name: str):
+    from multiprocessing import shared_memory
+
+    # the server owns the block, the client's resource tracker must not unlink it when the client exits
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13
+        pass
+    # skip registering the block rather than unregistering it afterwards, which would also drop the server's
+    # registration when both processes share a resource tracker
+    from multiprocessing import resource_tracker
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class _Client:
+    def __init__(self, client_id: int, slot: int, shm) -> None:
+        self.client_id = client_id
+        self.slot = slot
+        self.shm = shm
+
+
+class EnvServer:
+    """
+    Serve slices of one ProcgenGym3Env to up to `max_clients` clients
+
+    :param max_clients: number of slices, the environment has max_clients * client_num environments
+    :param client_num: number of environments given to each client
+    :param compress_level: zlib compression level for observations sent over the socket
+    :param env_kwargs: passed to ProcgenGym3Env, num_threads should be > 0
+    """
+
+    def __init__(self, max_clients: int, client_num: int, compress_level: int = 1, **env_kwargs: Any) -> None:
+        from .aio import AsyncProcgenEnv
+        from .env import ProcgenGym3Env
+
+        self.max_clients = max_clients
+        self.client_num = client_num
+        self.compress_level = compress_level
+        self.env = AsyncProcgenEnv(ProcgenGym3Env(num=max_clients * client_num, **env_kwargs))
+        self._free_slots = list(range(max_clients))
+        self._clients = {}
+        self._next_client_id = 0
+        self._actions = np.zeros(self.env.num, dtype=np.int32)
+        self._submitted = set()
+        self._step_result = None
+        self._step_task = None
+        self.num_steps = 0
+
+    async def serve_unix(self, path: str) -> None:
+        server = await asyncio.start_unix_server(self._handle_connection, path=path)
+        async with server:
+            await server.serve_forever()
+
+    async def serve_tcp(self, host: str, port: int) -> None:
+        server = await asyncio.start_server(self._handle_connection, host=host, port=port)
+        async with server:
+            await server.serve_forever()
+
+    def _maybe_step(self) -> None:
+        if self._step_task is None and len(self._clients) > 0 and self._submitted >= set(self._clients):
+            self._step_task = asyncio.ensure_future(self._step())
+
+    async def _step(self) -> None:
+        result = self._step_result
+        self._submitted = set()
+        try:
+            rew, ob, first = await self.env.step(self._actions)
+            result.set_result((rew, ob["rgb"], first))
+            self.num_steps += 1
+        except Exception as e:
+            result.set_exception(e)
+        finally:
+            self._step_result = asyncio.get_running_loop().create_future()
+            self._step_task = None
+        # clients may have submitted the next step while this one was running
+        self._maybe_step()
+
+    def _response(self, client: _Client, rew: np.ndarray, ob: np.ndarray, first: np.ndarray) -> bytes:
+        sl = slice(client.slot * self.client_num, (client.slot + 1) * self.client_num)
+        payload = [rew[sl].astype(np.float32).tobytes(), first[sl].astype(np.uint8).tobytes()]
+        header = {}
+        if client.shm is not None:
+            np.ndarray(ob[sl].shape, dtype=ob.dtype, buffer=client.shm.buf)[:] = ob[sl]
+        else:
+            payload.append(zlib.compress(np.ascontiguousarray(ob[sl]).tobytes(), self.compress_level))
+        return _pack_message(header, b"".join(payload))
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if self._step_result is None:
+            self._step_result = asyncio.get_running_loop().create_future()
+        client = None
+        try:
+            header, _ = await _read_message(reader)
+            assert header["type"] == "hello", "expected hello message"
+            if len(self._free_slots) == 0:
+                writer.write(_pack_message({"error": "server is full"}))
+                await writer.drain()
+                return
+
+            ob_shape = [self.client_num] + list(self.env.env.ob_space["rgb"].shape)
+            shm = None
+            if header.get("shared_memory", False):
+                shm = _create_shared_memory(int(np.prod(ob_shape)))
+            client = _Client(self._next_client_id, self._free_slots.pop(0), shm)
+            self._next_client_id += 1
+            # wait for any step in flight so the new client joins between steps
+            while self._step_task is not None:
+                await asyncio.shield(self._step_result)
+            self._clients[client.client_id] = client
+
+            rew, ob, first = await self.env.observe()
+            hello = {
+                "num": self.client_num,
+                "ob_shape": ob_shape,
+                "num_actions": int(self.env.env.ac_space.eltype.n),
+                "shared_memory": None if shm is None else shm.name,
+            }
+            writer.write(_pack_message(hello) + self._response(client, rew, ob["rgb"], first))
+            await writer.drain()
+
+            while True:
+                header, payload = await _read_message(reader)
+                assert header["type"] == "step", f"unexpected message {header['type']}"
+                sl = slice(client.slot * self.client_num, (client.slot + 1) * self.client_num)
+                self._actions[sl] = np.frombuffer(payload, dtype=np.int32)
+                result = self._step_result
+                self._submitted.add(client.client_id)
+                self._maybe_step()
+                rew, ob, first = await asyncio.shield(result)
+                writer.write(self._response(client, rew, ob, first))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if client is not None:
+                self._clients.pop(client.client_id, None)
+                self._submitted.discard(client.client_id)
+                self._free_slots.append(client.slot)
+                if client.shm is not None:
+                    client.shm.close()
+                    client.shm.unlink()
+                self._maybe_step()
+            writer.close()
+
+
+class EnvClient:
+    """
+    Connect to an EnvServer, either with a Unix socket `path` or with `host` and `port`
+
+    :param shared_memory: receive observations through shared memory, only works if the server is on the same
+        machine, defaults to True for Unix sockets
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        shared_memory: Optional[bool] = None,
+    ) -> None:
+        if path is not None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(path)
+        else:
+            self._sock = socket.create_connection((host, port))
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if shared_memory is None:
+            shared_memory = path is not None
+
+        self._sock.sendall(_pack_message({"type": "hello", "shared_memory": shared_memory}))
+        hello, _ = _recv_message(self._sock)
+        if "error" in hello:
+            raise ConnectionError(hello["error"])
+        self.num = hello["num"]
+        self.num_actions = hello["num_actions"]
+        self.ob_shape = tuple(hello["ob_shape"])
+        self._shm = None
+        self._shm_ob = None
+        if hello["shared_memory"] is not None:
+            self._shm = _attach_shared_memory(hello["shared_memory"])
+            self._shm_ob = np.ndarray(self.ob_shape, dtype=np.uint8, buffer=self._shm.buf)
+        self._last = self._recv_step()
+
+    def _recv_step(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        _, payload = _recv_message(self._sock)
+        rew = np.frombuffer(payload, dtype=np.float32, count=self.num)
+        first = np.frombuffer(payload, dtype=np.uint8, count=self.num, offset=rew.nbytes).astype(bool)
+        if self._shm_ob is not None:
+            ob = self._shm_ob.copy()
+        else:
+            ob = np.frombuffer(zlib.decompress(payload[rew.nbytes + self.num :]), dtype=np.uint8)
+            ob = ob.reshape(self.ob_shape)
+        return rew, ob, first
+
+    def observe(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return (rew, ob, first) from the last step
+        """
+        return self._last
+
+    def step(self, ac: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        ac = np.ascontiguousarray(ac, dtype=np.int32)
+        assert ac.shape == (self.num,)
+        self._sock.sendall(_pack_message({"type": "step"}, ac.tobytes()))
+        self._last = self._recv_step()
+        return self._last
+
+    def close(self) -> None:
+        self._sock.close()
+        if self._shm is not None:
+            self._shm_ob = None
+            self._shm.close()
+            self._shm = None
+
+
+def _loadtest_worker(connect_kwargs: Dict[str, Any], num_steps: int, seed: int, result_queue) -> None:
+    client = EnvClient(**connect_kwargs)
+    rng = np.random.RandomState(seed)
+    latencies = np.zeros(num_steps)
+    for i in range(num_steps):
+        ac = rng.randint(0, client.num_actions, size=client.num, dtype=np.int32)
+        start = time.perf_counter()
+        client.step(ac)
+        latencies[i] = time.perf_counter() - start
+    client.close()
+    result_queue.put((client.num, latencies))
+
+
+def loadtest(connect_kwargs: Dict[str, Any], num_clients: int, num_steps: int) -> Dict[str, float]:
+    """
+    Step `num_clients` client processes against a server and report throughput and latency percentiles
+    """
+    ctx = mp.get_context("spawn")
+    result_queue = ctx.Queue()
+    procs = [
+        ctx.Process(target=_loadtest_worker, args=(connect_kwargs, num_steps, seed, result_queue))
+        for seed in range(num_clients)
+    ]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    results = [result_queue.get() for _ in procs]
+    elapsed = time.perf_counter() - start
+    for p in procs:
+        p.join()
+
+    latencies = np.concatenate([r[1] for r in results])
+    env_steps = sum(num * len(lat) for num, lat in results)
+    return {
+        "requests_per_sec": len(latencies) / elapsed,
+        "env_steps_per_sec": env_steps / elapsed,
+        "latency_p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "latency_p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "latency_p999_ms": float(np.percentile(latencies, 99.9) * 1000),
+        "latency_max_ms": float(latencies.max() * 1000),
+    }
+
+
+def _connect_kwargs(args) -> Dict[str, Any]:
+    if args.path is not None:
+        return dict(path=args.path)
+    return dict(host=args.host, port=args.port)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="serve procgen environments over a socket")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name in ["serve", "loadtest"]:
+        sub = subparsers.add_parser(name)
+        sub.add_argument("--path", help="Unix socket path")
+        sub.add_argument("--host", default="127.0.0.1")
+        sub.add_argument("--port", type=int, default=7373)
+        if name == "serve":
+            sub.add_argument("--env-name", default="coinrun")
+            sub.add_argument("--distribution-mode", default="hard")
+            sub.add_argument("--max-clients", type=int, default=8)
+            sub.add_argument("--client-num", type=int, default=16)
+            sub.add_argument("--num-threads", type=int, default=4)
+        else:
+            sub.add_argument("--clients", type=int, default=8)
+            sub.add_argument("--steps", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        server = EnvServer(
+            max_clients=args.max_clients,
+            client_num=args.client_num,
+            env_name=args.env_name,
+            distribution_mode=args.distribution_mode,
+            num_threads=args.num_threads,
+        )
+        if args.path is not None:
+            coro = server.serve_unix(args.path)
+        else:
+            coro = server.serve_tcp(args.host, args.port)
+        asyncio.run(coro)
+    else:
+        stats = loadtest(_connect_kwargs(args), num_clients=args.clients, num_steps=args.steps)
+        for key, value in stats.items():
+            print(f"{key}: {value:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import socket
+import threading
+
+import numpy as np
+import pytest
+from procgen import ProcgenGym3Env
+from .server import EnvClient, EnvServer, _pack_message, _recv_message
+
+
+def test_message_framing():
+    a, b = socket.socketpair()
+    payload = np.arange(100, dtype=np.int32).tobytes()
+    a.sendall(_pack_message({"type": "step", "n": 1}, payload) + _pack_message({"type": "hello"}))
+    header, data = _recv_message(b)
+    assert header == {"type": "step", "n": 1}
+    assert bytes(data) == payload
+    header, data = _recv_message(b)
+    assert header == {"type": "hello"}
+    assert len(data) == 0
+    a.close()
+    b.close()
+
+
+@pytest.mark.parametrize("shared_memory", [True, False])
+def test_server(tmp_path, shared_memory):
+    path = os.path.join(str(tmp_path), "procgen.sock")
+    client_num = 2
+    env_kwargs = dict(env_name="coinrun", rand_seed=0, num_threads=2)
+    server = EnvServer(max_clients=2, client_num=client_num, **env_kwargs)
+    ref_env = ProcgenGym3Env(num=2 * client_num, **env_kwargs)
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_until_complete, args=(server.serve_unix(path),), daemon=True)
+    thread.start()
+    while not os.path.exists(path):
+        pass
+
+    clients = [EnvClient(path=path, shared_memory=shared_memory) for _ in range(2)]
+    _, ref_ob, _ = ref_env.observe()
+    for i, client in enumerate(clients):
+        assert np.array_equal(client.observe()[1], ref_ob["rgb"][i * client_num : (i + 1) * client_num])
+
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+        acs = rng.randint(0, 15, size=(2, client_num), dtype=np.int32)
+        results = [None, None]
+
+        def step(i):
+            results[i] = clients[i].step(acs[i])
+
+        threads = [threading.Thread(target=step, args=(i,)) for i in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        ref_env.act(acs.reshape(-1))
+        ref_rew, ref_ob, ref_first = ref_env.observe()
+        for i, (rew, ob, first) in enumerate(results):
+            sl = slice(i * client_num, (i + 1) * client_num)
+            assert np.array_equal(rew, ref_rew[sl])
+            assert np.array_equal(ob, ref_ob["rgb"][sl])
+            assert np.array_equal(first, ref_first[sl])
+
+    for client in clients:
+        client.close()
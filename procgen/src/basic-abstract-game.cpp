@@ -3,6 +3,12 @@
 #include "assetgen.h"
 #include "qt-utils.h"
 
+#include <list>
+#include <map>
+#include <mutex>
+#include <tuple>
+#include <unordered_map>
+
 const float MAXVTHETA = 15 * PI / 180;
 const float MIXRATEROT = 0.5f;
 
@@ -59,7 +65,8 @@ void BasicAbstractGame::game_init() {
     if (main_bg_images_ptr == nullptr) {
         main_bg_images_ptr = new std::vector<std::shared_ptr<QImage>>();
         use_procgen_background = true;
-        auto main_bg_image = std::make_shared<QImage>(500, 500, QImage::Format_RGB32);
+        int res = options.generated_background_resolution;
+        auto main_bg_image = std::make_shared<QImage>(res, res, QImage::Format_RGB32);
         main_bg_images_ptr->push_back(main_bg_image);
     } else {
         use_procgen_background = false;
@@ -76,6 +83,26 @@ void BasicAbstractGame::game_init() {
     asset_num_themes.resize(USE_ASSET_THRESHOLD, 0);
 }
 
+/*
+  Assets depend only on the game, fixed_asset_seed and asset options, so they are created once per process and
+  shared by all instances, the images are never modified after they are created
+*/
+struct SharedAsset {
+    std::shared_ptr<QImage> image;
+    std::shared_ptr<QImage> reflection;
+    float aspect_ratio = 0.0f;
+    int num_themes = 0;
+    // state of asset_rand_gen after generating the asset, restored in every instance that uses the asset so that
+    // sharing assets does not change the saved state
+    bool generated = false;
+    RandGen rand_gen_after;
+};
+
+typedef std::tuple<std::string, int, bool, bool, int> SharedAssetKey;
+
+static std::mutex shared_assets_mutex;
+static std::map<SharedAssetKey, SharedAsset> shared_assets;
+
 void BasicAbstractGame::initialize_asset_if_necessary(int img_idx) {
     if (basic_assets.at(img_idx) != nullptr)
         return;
@@ -85,41 +112,118 @@ void BasicAbstractGame::initialize_asset_if_necessary(int img_idx) {
 
     theme = mask_theme_if_necessary(theme, type);
 
-    std::shared_ptr<QImage> asset_ptr = nullptr;
-    float aspect_ratio;
-    int num_themes;
-    std::vector<std::string> names;
+    SharedAssetKey key(game_name, fixed_asset_seed, options.use_generated_assets, options.restrict_themes, type + theme * MAX_ASSETS);
+    SharedAsset asset;
+    bool found = false;
 
-    if (!options.use_generated_assets) {
-        asset_for_type(type, names);
+    {
+        std::lock_guard<std::mutex> lock(shared_assets_mutex);
+        auto it = shared_assets.find(key);
+        if (it != shared_assets.end()) {
+            asset = it->second;
+            found = true;
+        }
+    }
+
+    if (!found) {
+        std::vector<std::string> names;
+
+        if (!options.use_generated_assets) {
+            asset_for_type(type, names);
+
+            if (names.size() == 0) {
+                reserved_asset_for_type(type, names);
+            }
+        }
 
         if (names.size() == 0) {
-            reserved_asset_for_type(type, names);
+            AssetGen pgen(&asset_rand_gen);
+            asset_rand_gen.seed(fixed_asset_seed + type);
+
+            std::shared_ptr<QImage> small_image(new QImage(64, 64, QImage::Format_ARGB32));
+            asset.image = small_image;
+            pgen.generate_resource(asset.image, 0, 5, use_block_asset(type));
+
+            asset.num_themes = 1;
+            asset.aspect_ratio = 1.0;
+            asset.generated = true;
+            asset.rand_gen_after = asset_rand_gen;
+        } else {
+            asset.image = get_asset_ptr(names[theme]);
+            asset.num_themes = (int)(names.size());
+            asset.aspect_ratio = asset.image->width() * 1.0 / asset.image->height();
         }
+
+        asset.reflection = std::make_shared<QImage>(asset.image->mirrored(true, false));
+
+        // another thread may have created the same asset in the meantime, in which case theirs is used
+        std::lock_guard<std::mutex> lock(shared_assets_mutex);
+        asset = shared_assets.emplace(key, asset).first->second;
     }
 
-    if (names.size() == 0) {
-        AssetGen pgen(&asset_rand_gen);
-        asset_rand_gen.seed(fixed_asset_seed + type);
+    if (asset.generated) {
+        asset_rand_gen = asset.rand_gen_after;
+    }
 
-        std::shared_ptr<QImage> small_image(new QImage(64, 64, QImage::Format_ARGB32));
-        asset_ptr = small_image;
-        pgen.generate_resource(asset_ptr, 0, 5, use_block_asset(type));
+    basic_assets[img_idx] = asset.image;
+    asset_aspect_ratios[img_idx] = asset.aspect_ratio;
+    asset_num_themes[type] = asset.num_themes;
+    basic_reflections[img_idx] = asset.reflection;
+}
 
-        num_themes = 1;
-        aspect_ratio = 1.0;
-    } else {
-        asset_ptr = get_asset_ptr(names[theme]);
-        num_themes = (int)(names.size());
-        aspect_ratio = asset_ptr->width() * 1.0 / asset_ptr->height();
+/*
+  Generated backgrounds depend only on the state of rand_gen and the image size, and the same levels are often
+  generated many times, so recently generated backgrounds are kept for all instances.  A cached background also
+  records the state of rand_gen after generating it so that the rest of the level is generated the same way.
+*/
+struct CachedBackground {
+    std::shared_ptr<QImage> image;
+    RandGen rand_gen_after;
+};
+
+// each 500x500 background takes 1MB
+const size_t MAX_CACHED_BACKGROUNDS = 32;
+
+static std::mutex background_cache_mutex;
+// most recently used first
+static std::list<std::pair<std::string, CachedBackground>> background_cache;
+static std::unordered_map<std::string, std::list<std::pair<std::string, CachedBackground>>::iterator> background_cache_index;
+
+void BasicAbstractGame::generate_background() {
+    auto &image = main_bg_images_ptr->at(background_index);
+
+    std::string key = std::to_string(image->width()) + "x" + std::to_string(image->height()) + " " + std::to_string(rand_gen.gen.index) + " ";
+    key.append((const char *)(rand_gen.gen.state), sizeof(rand_gen.gen.state));
+
+    {
+        std::lock_guard<std::mutex> lock(background_cache_mutex);
+        auto it = background_cache_index.find(key);
+        if (it != background_cache_index.end()) {
+            background_cache.splice(background_cache.begin(), background_cache, it->second);
+            image = it->second->second.image;
+            rand_gen = it->second->second.rand_gen_after;
+            return;
+        }
     }
 
-    basic_assets[img_idx] = asset_ptr;
-    asset_aspect_ratios[img_idx] = aspect_ratio;
-    asset_num_themes[type] = num_themes;
+    // the generated image is shared once it is in the cache, so never paint over the previous one
+    CachedBackground bg;
+    bg.image = std::make_shared<QImage>(image->width(), image->height(), QImage::Format_RGB32);
+    AssetGen bggen(&rand_gen);
+    bggen.generate_resource(bg.image);
+    bg.rand_gen_after = rand_gen;
+    image = bg.image;
 
-    std::shared_ptr<QImage> reflection_ptr(new QImage(asset_ptr->mirrored(true, false)));
-    basic_reflections[img_idx] = reflection_ptr;
+    std::lock_guard<std::mutex> lock(background_cache_mutex);
+    if (background_cache_index.find(key) != background_cache_index.end()) {
+        return;
+    }
+    background_cache.emplace_front(key, bg);
+    background_cache_index[key] = background_cache.begin();
+    if (background_cache.size() > MAX_CACHED_BACKGROUNDS) {
+        background_cache_index.erase(background_cache.back().first);
+        background_cache.pop_back();
+    }
 }
 
 void BasicAbstractGame::fill_elem(int x, int y, int dx, int dy, char elem) {
@@ -128,6 +232,7 @@ void BasicAbstractGame::fill_elem(int x, int y, int dx, int dy, char elem) {
             grid.set(x + j, y + k, elem);
         }
     }
+    invalidate_static_layer();
 }
 
 float BasicAbstractGame::get_distance(const std::shared_ptr<Entity> &p0, const std::shared_ptr<Entity> &p1) {
@@ -215,13 +320,23 @@ std::vector<int> BasicAbstractGame::get_cells_with_type(int type) {
 }
 
 void BasicAbstractGame::set_obj(int idx, int elem) {
+    if (!grid.contains_index(idx) || grid.get_index(idx) != elem) {
+        invalidate_static_layer();
+    }
     grid.set_index(idx, elem);
 }
 
 void BasicAbstractGame::set_obj(int x, int y, int elem) {
+    if (!grid.contains(x, y) || grid.get(x, y) != elem) {
+        invalidate_static_layer();
+    }
     grid.set(x, y, elem);
 }
 
+void BasicAbstractGame::invalidate_static_layer() {
+    static_layer_version++;
+}
+
 std::shared_ptr<Entity> BasicAbstractGame::spawn_child(const std::shared_ptr<Entity> &src, int type, float obj_r, bool match_vel) {
     float vx = match_vel ? src->vx : 0;
     float vy = match_vel ? src->vy : 0;
@@ -763,13 +878,12 @@ void BasicAbstractGame::game_reset() {
 
     grid_size = main_width * main_height;
     grid.resize(main_width, main_height);
+    invalidate_static_layer();
 
     background_index = rand_gen.randn((int)(main_bg_images_ptr->size()));
 
-    AssetGen bggen(&rand_gen);
-
     if (use_procgen_background) {
-        bggen.generate_resource(main_bg_images_ptr->at(background_index));
+        generate_background();
     }
 
     entities.clear();
@@ -925,11 +1039,15 @@ void BasicAbstractGame::draw_foreground(QPainter &p, const QRect &rect) {
     prepare_for_drawing(rect.height());
 
     draw_entities(p, entities, -1);
+    draw_grid(p);
+    draw_overlay(p, rect);
+}
 
+void BasicAbstractGame::draw_grid(QPainter &p, int extra_cells) {
     int low_x, high_x, low_y, high_y;
 
     if (options.center_agent) {
-        float margin = (visibility / 2.0 + 1);
+        float margin = (visibility / 2.0 + 1 + extra_cells);
         low_x = center_x - margin;
         high_x = center_x + margin;
         low_y = center_y - margin;
@@ -956,7 +1074,9 @@ void BasicAbstractGame::draw_foreground(QPainter &p, const QRect &rect) {
             draw_image(p, r2, 0, false, type, theme, 1.0, 0.0);
         }
     }
+}
 
+void BasicAbstractGame::draw_overlay(QPainter &p, const QRect &rect) {
     draw_entities(p, entities, 0);
     draw_entities(p, entities, 1);
 
@@ -1009,7 +1129,89 @@ void BasicAbstractGame::draw_background(QPainter &p, const QRect &rect) {
     }
 }
 
+/*
+  Describe the render_z = -1 entities, which are drawn between the background and the grid, so that the static layer
+  can be redrawn when they change.  Returns false if they can't be cached.
+*/
+bool BasicAbstractGame::get_underlay_signature(std::vector<float> &sig) {
+    sig.clear();
+    for (const auto &e : entities) {
+        if (e->render_z != -1 || !should_draw_entity(e)) {
+            continue;
+        }
+        if (e->use_abs_coords) {
+            // these don't move with the camera
+            return false;
+        }
+        sig.insert(sig.end(), {e->x, e->y, e->rx, e->ry, e->rotation, e->alpha, get_tile_aspect_ratio(e)});
+        sig.insert(sig.end(), {(float)e->is_reflected, (float)image_for_type(e->image_type), (float)e->image_theme});
+    }
+    return true;
+}
+
+/*
+  Draw the background, render_z = -1 entities and grid tiles from a cached image, which is redrawn when the grid or
+  those entities change.  Games that center the camera on the agent are drawn without the cache, since an image
+  drawn at one camera position and shifted doesn't match drawing at the new position pixel for pixel.  Returns false
+  if nothing was drawn.
+*/
+bool BasicAbstractGame::draw_static_layer(QPainter &p, const QRect &rect) {
+    if (options.center_agent) {
+        return false;
+    }
+
+    prepare_for_drawing(rect.height());
+
+    std::vector<float> underlay;
+    if (!get_underlay_signature(underlay)) {
+        return false;
+    }
+
+    StaticLayer *layer = nullptr;
+    for (auto &l : static_layers) {
+        if (l.size == rect.size()) {
+            layer = &l;
+        }
+    }
+    if (layer == nullptr) {
+        // one layer per resolution, the observation and the "rgb" info are usually rendered at different sizes
+        static_layers.emplace_back();
+        layer = &static_layers.back();
+        layer->size = rect.size();
+    }
+
+    bool valid = layer->version == static_layer_version && layer->unit == unit && layer->underlay == underlay;
+    valid = valid && layer->x_off == x_off && layer->y_off == y_off;
+
+    if (!valid) {
+        if (layer->image.size() != rect.size()) {
+            layer->image = QImage(rect.size(), QImage::Format_RGB32);
+        }
+        layer->image.fill(QColor(0, 0, 0));
+
+        QPainter lp(&layer->image);
+        lp.setRenderHints(p.renderHints());
+        draw_background(lp, rect);
+        draw_entities(lp, entities, -1);
+        draw_grid(lp, 3);
+        lp.end();
+
+        layer->version = static_layer_version;
+        layer->unit = unit;
+        layer->x_off = x_off;
+        layer->y_off = y_off;
+        layer->underlay = underlay;
+    }
+
+    p.drawImage(rect.topLeft(), layer->image);
+    return true;
+}
+
 void BasicAbstractGame::game_draw(QPainter &p, const QRect &rect) {
+    if (options.cache_static_layer && draw_static_layer(p, rect)) {
+        draw_overlay(p, rect);
+        return;
+    }
     draw_background(p, rect);
     draw_foreground(p, rect);
 }
@@ -1169,6 +1371,17 @@ void BasicAbstractGame::read_entities(ReadBuffer *b, std::vector<std::shared_ptr
     }
 }
 
+void BasicAbstractGame::level_metadata_names(std::vector<std::string> &names) {
+    Game::level_metadata_names(names);
+    names.insert(names.end(), {"width", "height", "num_entities"});
+}
+
+void BasicAbstractGame::get_level_metadata(std::vector<float> &values) {
+    Game::get_level_metadata(values);
+    // not counting the agent
+    values.insert(values.end(), {(float)(main_width), (float)(main_height), (float)(entities.size()) - 1});
+}
+
 void BasicAbstractGame::serialize(WriteBuffer *b) {
     Game::serialize(b);
 
@@ -1288,4 +1501,47 @@ void BasicAbstractGame::deserialize(ReadBuffer *b) {
     min_visibility = b->read_float();
 
     grid.deserialize(b);
+    invalidate_static_layer();
+}
+
+void BasicAbstractGame::serialize_reset_carryover(WriteBuffer *b) {
+    Game::serialize_reset_carryover(b);
+
+    // set by game_step()
+    b->write_int(last_move_action);
+    b->write_int(move_action);
+    b->write_int(special_action);
+    b->write_float(action_vx);
+    b->write_float(action_vy);
+    b->write_float(action_vrot);
+    b->write_int(step_rand_int);
+
+    // set when drawing
+    b->write_float(center_x);
+    b->write_float(center_y);
+    b->write_float(unit);
+    b->write_float(view_dim);
+    b->write_float(x_off);
+    b->write_float(y_off);
+    b->write_float(visibility);
+}
+
+void BasicAbstractGame::deserialize_reset_carryover(ReadBuffer *b) {
+    Game::deserialize_reset_carryover(b);
+
+    last_move_action = b->read_int();
+    move_action = b->read_int();
+    special_action = b->read_int();
+    action_vx = b->read_float();
+    action_vy = b->read_float();
+    action_vrot = b->read_float();
+    step_rand_int = b->read_int();
+
+    center_x = b->read_float();
+    center_y = b->read_float();
+    unit = b->read_float();
+    view_dim = b->read_float();
+    x_off = b->read_float();
+    y_off = b->read_float();
+    visibility = b->read_float();
 }
@@ -27,6 +27,10 @@ class BasicAbstractGame : public Game {
     void game_init() override;
     void serialize(WriteBuffer *b) override;
     void deserialize(ReadBuffer *b) override;
+    void serialize_reset_carryover(WriteBuffer *b) override;
+    void deserialize_reset_carryover(ReadBuffer *b) override;
+    void level_metadata_names(std::vector<std::string> &names) override;
+    void get_level_metadata(std::vector<float> &values) override;
 
     void write_entities(WriteBuffer *b, std::vector<std::shared_ptr<Entity>> &ents);
     void read_entities(ReadBuffer *b, std::vector<std::shared_ptr<Entity>> &ents);
@@ -73,6 +77,7 @@ class BasicAbstractGame : public Game {
     int get_obj(int idx);
     void set_obj(int i, int j, int obj);
     void set_obj(int idx, int elem);
+    void invalidate_static_layer();
     int to_grid_idx(int x, int y);
     void to_grid_xy(int idx, int *x, int *y);
     void fill_elem(int x, int y, int dx, int dy, char elem);
@@ -103,6 +108,8 @@ class BasicAbstractGame : public Game {
     QRectF get_object_rect(const std::shared_ptr<Entity> &obj);
 
     void draw_foreground(QPainter &p, const QRect &rect);
+    void draw_grid(QPainter &p, int extra_cells = 0);
+    void draw_overlay(QPainter &p, const QRect &rect);
 
     void step_entities(const std::vector<std::shared_ptr<Entity>> &given);
 
@@ -161,6 +168,23 @@ class BasicAbstractGame : public Game {
   private:
     Grid<int> grid;
 
+    // background, render_z = -1 entities and grid tiles, rendered once and reused while they don't change
+    struct StaticLayer {
+        QImage image;
+        QSize size;
+        int version = -1;
+        float unit = 0.0f;
+        float x_off = 0.0f;
+        float y_off = 0.0f;
+        std::vector<float> underlay;
+    };
+    std::vector<StaticLayer> static_layers;
+    int static_layer_version = 0;
+
+    void generate_background();
+    bool draw_static_layer(QPainter &p, const QRect &rect);
+    bool get_underlay_signature(std::vector<float> &sig);
+
     QImage *lookup_asset(int img_idx, bool is_reflected = false);
     void initialize_asset_if_necessary(int img_idx);
     void prepare_for_drawing(float rect_height);
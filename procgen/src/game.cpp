@@ -2,8 +2,13 @@
 #include "game.h"
 #include "vecoptions.h"
 
+#include <algorithm>
+#include <cstring>
+
 // this should be updated whenever the state format or environments may have changed
-const int SERIALIZE_VERSION = 0;
+// version 1 saves random number generators in binary, version 2 adds episode stats, earlier states can still be
+// loaded
+const int SERIALIZE_VERSION = 2;
 
 void bgr32_to_rgb888(void *dst_rgb888, void *src_bgr32, int w, int h) {
     uint8_t *src = (uint8_t *)src_bgr32;
@@ -48,6 +53,9 @@ void Game::parse_options(std::string name, VecOptions opts) {
     opts.consume_bool("use_backgrounds", &options.use_backgrounds);
     opts.consume_bool("center_agent", &options.center_agent);
     opts.consume_bool("use_sequential_levels", &options.use_sequential_levels);
+    opts.consume_bool("cache_static_layer", &options.cache_static_layer);
+    opts.consume_int("generated_background_resolution", &options.generated_background_resolution);
+    fassert(options.generated_background_resolution > 0);
 
     int dist_mode = EasyMode;
     opts.consume_int("distribution_mode", &dist_mode);
@@ -76,6 +84,47 @@ void Game::parse_options(std::string name, VecOptions opts) {
     opts.ensure_empty();
 }
 
+// 64 bit FNV-1a, used for digests that must be the same on every platform
+static uint64_t fnv1a_64(const uint8_t *data, size_t length) {
+    uint64_t hash = 0xcbf29ce484222325ULL;
+    for (size_t i = 0; i < length; i++) {
+        hash ^= data[i];
+        hash *= 0x100000001b3ULL;
+    }
+    return hash;
+}
+
+static void write_digest(void *dst, uint64_t digest) {
+    // always little endian so that digests can be compared across machines
+    uint8_t *d = (uint8_t *)dst;
+    for (int i = 0; i < 8; i++) {
+        d[i] = (uint8_t)(digest >> (8 * i));
+    }
+}
+
+uint64_t Game::state_digest() {
+    // observe() runs on the stepping threads, so use a buffer per thread
+    thread_local std::vector<char> buf(MAX_STATE_SIZE);
+    auto b = WriteBuffer(buf.data(), buf.size());
+    // hash the same bytes as get_state() so that the digest can be checked against a saved state
+    write_state(&b);
+    return fnv1a_64((uint8_t *)buf.data(), b.offset);
+}
+
+void Game::write_state(WriteBuffer *b) {
+    serialize(b);
+    b->write_int(END_OF_BUFFER);
+}
+
+void Game::read_state(ReadBuffer *b) {
+    deserialize(b);
+    fassert(b->read_int() == END_OF_BUFFER);
+}
+
+uint64_t Game::obs_digest() {
+    return fnv1a_64((uint8_t *)obs_bufs[0], RES_W * RES_H * 3);
+}
+
 void Game::render_to_buf(void *dst, int w, int h, bool antialias) {
     // Qt focuses on RGB32 performance:
     // https://doc.qt.io/qt-5/qpainter.html#performance
@@ -92,15 +141,129 @@ void Game::render_to_buf(void *dst, int w, int h, bool antialias) {
     game_draw(p, rect);
 }
 
+void Game::reset_from_state_pool() {
+    const auto &weights = state_pool->cumulative_weights;
+    double x = state_pool_rand_gen.rand01() * weights.back();
+    size_t idx = std::upper_bound(weights.begin(), weights.end(), x) - weights.begin();
+    idx = std::min(idx, weights.size() - 1);
+
+    // keep the results of the step that ended the episode, the same as a normal reset
+    StepData last_step_data = step_data;
+    int last_level_seed = prev_level_seed;
+    int last_level_progress = prev_level_progress;
+    int last_level_progress_max = prev_level_progress_max;
+    EpisodeStats ended_episode = last_episode;
+    // each env draws its own level seeds, which continue after the pool is cleared
+    RandGen seed_gen = level_seed_rand_gen;
+
+    const auto &state = (*state_pool->all_states)[state_pool->indices[idx]];
+    auto b = ReadBuffer((char *)(state.data()), state.size());
+    deserialize(&b);
+
+    step_data = last_step_data;
+    prev_level_seed = last_level_seed;
+    prev_level_progress = last_level_progress;
+    prev_level_progress_max = last_level_progress_max;
+    last_episode = ended_episode;
+    level_seed_rand_gen = seed_gen;
+}
+
+void Game::request_next_level() {
+    if (next_level != nullptr) {
+        // keep the requested level, and don't request another one while the generator may still be in use
+        if (!next_level->cancelled || !next_level->done) {
+            return;
+        }
+        next_level = nullptr;
+    }
+    // states with generated assets can't be saved, so they can't be copied from the generator
+    if (state_pool != nullptr || options.use_generated_assets) {
+        return;
+    }
+
+    if (level_generator == nullptr) {
+        level_generator = globalGameRegistry->at(game_name)();
+        level_generator->options = options;
+        level_generator->game_type = game_type;
+        level_generator->fixed_asset_seed = fixed_asset_seed;
+        level_generator->game_init();
+    }
+
+    auto level = std::make_shared<PregeneratedLevel>();
+    level->generator = level_generator;
+    // draw from a copy so that reset() still draws the same seed
+    RandGen seed_gen = level_seed_rand_gen;
+    level->level_seed = seed_gen.randint(level_seed_low, level_seed_high);
+    // the generator starts from a copy of this game every time, so nothing it kept from an earlier level can leak
+    // into this one
+    thread_local std::vector<char> buf(MAX_STATE_SIZE);
+    auto b = WriteBuffer(buf.data(), buf.size());
+    serialize(&b);
+    level->base_state.assign(buf.data(), buf.data() + b.offset);
+    next_level = level;
+}
+
+void Game::generate_level(PregeneratedLevel *level) {
+    if (!level->cancelled) {
+        auto rb = ReadBuffer(level->base_state.data(), level->base_state.size());
+        deserialize(&rb);
+        // the part of reset() that generates a new level
+        current_level_seed = level->level_seed;
+        rand_gen.seed(current_level_seed);
+        game_reset();
+
+        thread_local std::vector<char> buf(MAX_STATE_SIZE);
+        auto b = WriteBuffer(buf.data(), buf.size());
+        serialize(&b);
+        level->state.assign(buf.data(), buf.data() + b.offset);
+    }
+    level->done = true;
+}
+
+bool Game::swap_in_next_level() {
+    if (next_level == nullptr || next_level->cancelled || !next_level->done || next_level->level_seed != current_level_seed) {
+        return false;
+    }
+
+    // the generator's state is the same as if this game had called game_reset(), except for the parts that
+    // game_reset() doesn't set, which must be the ones from this game
+    thread_local std::vector<char> carryover(MAX_STATE_SIZE);
+    auto wb = WriteBuffer(carryover.data(), carryover.size());
+    serialize_reset_carryover(&wb);
+
+    auto &state = next_level->state;
+    auto b = ReadBuffer(state.data(), state.size());
+    deserialize(&b);
+    auto rb = ReadBuffer(carryover.data(), wb.offset);
+    deserialize_reset_carryover(&rb);
+
+    next_level = nullptr;
+    return true;
+}
+
+void Game::discard_next_level() {
+    if (next_level != nullptr) {
+        next_level->cancelled = true;
+    }
+}
+
 void Game::reset() {
     reset_count++;
 
+    if (state_pool != nullptr) {
+        reset_from_state_pool();
+        update_level_progress();
+        return;
+    }
+
+    bool drew_level_seed = false;
     if (episodes_remaining == 0) {
         if (options.use_sequential_levels && step_data.level_complete) {
             // prevent overflow in seed sequences
             current_level_seed = (int32_t)(current_level_seed + 997);
         } else {
             current_level_seed = level_seed_rand_gen.randint(level_seed_low, level_seed_high);
+            drew_level_seed = true;
         }
 
         episodes_remaining = 1;
@@ -110,16 +273,24 @@ void Game::reset() {
         step_data.level_complete = false;
     }
 
-    rand_gen.seed(current_level_seed);
-    game_reset();
+    if (!swap_in_next_level()) {
+        if (drew_level_seed) {
+            // the level was requested for the seed that was just drawn, so it will never be used
+            discard_next_level();
+        }
+        rand_gen.seed(current_level_seed);
+        game_reset();
+    }
 
     cur_time = 0;
     total_reward = 0;
     episodes_remaining -= 1;
     action = default_action;
+
+    update_level_progress();
 }
 
-void Game::step() {
+void Game::step(bool render) {
     cur_time += 1;
     bool will_force_reset = false;
 
@@ -133,6 +304,11 @@ void Game::step() {
     step_data.level_complete = false;
     game_step();
 
+    prev_level_progress = level_progress;
+    prev_level_progress_max = level_progress_max;
+    // before the episode stats so that they include the progress made by this step
+    update_level_progress();
+
     step_data.done = step_data.done || will_force_reset || (cur_time >= timeout);
     total_reward += step_data.reward;
 
@@ -143,8 +319,14 @@ void Game::step() {
 
     prev_level_seed = current_level_seed;
 
-    prev_level_progress = level_progress;
-    prev_level_progress_max = level_progress_max;
+    current_episode.episode_return += step_data.reward;
+    current_episode.length += 1;
+    current_episode.max_progress = std::max(current_episode.max_progress, level_progress_max);
+    // with sequential levels, completing a level doesn't end the episode
+    if (step_data.done && !(options.use_sequential_levels && step_data.level_complete)) {
+        // before reset() so that the stats are from the level that was played
+        end_episode();
+    }
 
     if (step_data.done) {
         reset();
@@ -156,12 +338,128 @@ void Game::step() {
 
     episode_done = step_data.done;
 
-    observe();
+    if (pregenerate_levels) {
+        request_next_level();
+    }
+
+    render_human_counter++;
+    if (render) {
+        observe();
+    }
+}
+
+void Game::run_rollout() {
+    const int obs_size = RES_W * RES_H * 3;
+    for (int t = 0; t < rollout.num_steps; t++) {
+        bool keep_frame = (t + 1) % rollout.frame_interval == 0;
+        action = rollout.actions[t * rollout.num_envs + rollout.env_idx];
+        // the last step is always rendered so that the buffers hold the final observation
+        step(keep_frame || t == rollout.num_steps - 1);
+        rollout.rews[t * rollout.num_envs + rollout.env_idx] = step_data.reward;
+        rollout.firsts[t * rollout.num_envs + rollout.env_idx] = (uint8_t)step_data.done;
+        if (keep_frame) {
+            int frame = (t + 1) / rollout.frame_interval - 1;
+            memcpy(rollout.obs + ((size_t)frame * rollout.num_envs + rollout.env_idx) * obs_size, obs_bufs[0], obs_size);
+        }
+    }
+    rollout = Rollout();
+}
+
+void Game::end_episode() {
+    last_episode = current_episode;
+    last_episode.level_complete = step_data.level_complete;
+    last_episode.level_seed = current_level_seed;
+    current_episode = EpisodeStats();
+    if (episode_stats) {
+        if (recent_episodes.size() == MAX_RECENT_EPISODES) {
+            recent_episodes.pop_front();
+        }
+        recent_episodes.push_back(last_episode);
+    }
+}
+
+static void write_episode_stats(WriteBuffer *b, const EpisodeStats &stats) {
+    b->write_float(stats.episode_return);
+    b->write_int(stats.length);
+    b->write_int(stats.level_complete);
+    b->write_int(stats.max_progress);
+    b->write_int(stats.level_seed);
+}
+
+static void read_episode_stats(ReadBuffer *b, EpisodeStats *stats) {
+    stats->episode_return = b->read_float();
+    stats->length = b->read_int();
+    stats->level_complete = b->read_int();
+    stats->max_progress = b->read_int();
+    stats->level_seed = b->read_int();
+}
+
+void Game::level_metadata_names(std::vector<std::string> &names) {
+}
+
+void Game::get_level_metadata(std::vector<float> &values) {
+}
+
+void Game::update_level_progress() {
+}
+
+void Game::serialize_reset_carryover(WriteBuffer *b) {
+    level_seed_rand_gen.serialize(b);
+
+    b->write_float(step_data.reward);
+    b->write_int(step_data.done);
+    b->write_int(step_data.level_complete);
+
+    b->write_int(prev_level_seed);
+    b->write_int(episodes_remaining);
+    b->write_int(episode_done);
+
+    b->write_int(last_reward_timer);
+    b->write_float(last_reward);
+
+    b->write_int(prev_level_progress);
+    b->write_int(prev_level_progress_max);
+
+    write_episode_stats(b, current_episode);
+    write_episode_stats(b, last_episode);
+}
+
+void Game::deserialize_reset_carryover(ReadBuffer *b) {
+    level_seed_rand_gen.deserialize(b);
+
+    step_data.reward = b->read_float();
+    step_data.done = b->read_int();
+    step_data.level_complete = b->read_int();
+
+    prev_level_seed = b->read_int();
+    episodes_remaining = b->read_int();
+    episode_done = b->read_int();
+
+    last_reward_timer = b->read_int();
+    last_reward = b->read_float();
+
+    prev_level_progress = b->read_int();
+    prev_level_progress_max = b->read_int();
+
+    read_episode_stats(b, &current_episode);
+    read_episode_stats(b, &last_episode);
 }
 
 void Game::observe() {
     render_to_buf(render_buf, RES_W, RES_H, false);
     bgr32_to_rgb888(obs_bufs[0], render_buf, RES_W, RES_H);
+    if (render_human_res > 0 && render_human_counter % render_human_interval == 0) {
+        // this runs on the stepping threads, so each game has its own buffer
+        render_human_buf.resize(render_human_res * render_human_res);
+        render_to_buf(render_human_buf.data(), render_human_res, render_human_res, true);
+        bgr32_to_rgb888(info_bufs[info_name_to_offset.at("rgb")], render_human_buf.data(), render_human_res, render_human_res);
+    }
+    if (episode_stats) {
+        *(float *)(info_bufs[info_name_to_offset.at("episode_return")]) = last_episode.episode_return;
+        *(int32_t *)(info_bufs[info_name_to_offset.at("episode_length")]) = last_episode.length;
+        *(uint8_t *)(info_bufs[info_name_to_offset.at("episode_level_complete")]) = (uint8_t)(last_episode.level_complete);
+        *(int32_t *)(info_bufs[info_name_to_offset.at("episode_max_progress")]) = last_episode.max_progress;
+    }
     *reward_ptr = step_data.reward;
     *first_ptr = (uint8_t)step_data.done;
     *(int32_t *)(info_bufs[info_name_to_offset.at("prev_level_seed")]) = (int32_t)(prev_level_seed);
@@ -169,6 +467,13 @@ void Game::observe() {
     *(int32_t *)(info_bufs[info_name_to_offset.at("level_seed")]) = (int32_t)(current_level_seed);
     *(int32_t *)(info_bufs[info_name_to_offset.at("prev_level_progress")]) = prev_level_progress;
     *(int32_t *)(info_bufs[info_name_to_offset.at("prev_level_progress_max")]) = prev_level_progress_max;
+    *(int32_t *)(info_bufs[info_name_to_offset.at("level_progress")]) = level_progress;
+    *(int32_t *)(info_bufs[info_name_to_offset.at("level_progress_max")]) = level_progress_max;
+    // last, so that the digests cover everything this step changed
+    if (digest_info) {
+        write_digest(info_bufs[info_name_to_offset.at("state_digest")], state_digest());
+        write_digest(info_bufs[info_name_to_offset.at("obs_digest")], obs_digest());
+    }
 }
 
 void Game::game_init() {
@@ -224,7 +529,9 @@ void Game::serialize(WriteBuffer *b) {
     // uint32_t render_buf[RES_W * RES_H];
 
     b->write_int(cur_time);
-    b->write_int(is_waiting_for_step);
+    // is_waiting_for_step belongs to the stepping threads rather than the game, so it is saved as false, which is its
+    // value whenever get_state() runs
+    b->write_int(false);
 
     // don't serialize these, since they are pointers, and will likely have incorrect values
     // if deserialized into another game object
@@ -238,10 +545,17 @@ void Game::serialize(WriteBuffer *b) {
     b->write_int(level_progress_max);
     b->write_int(prev_level_progress);
     b->write_int(prev_level_progress_max);
+
+    write_episode_stats(b, current_episode);
+    write_episode_stats(b, last_episode);
 }
 
 void Game::deserialize(ReadBuffer *b) {
-    fassert(SERIALIZE_VERSION == b->read_int());
+    // the requested level was generated from the state that is being replaced
+    discard_next_level();
+
+    int version = b->read_int();
+    fassert(version >= 0 && version <= SERIALIZE_VERSION);
     fassert(game_name == b->read_string());
 
     options.paint_vel_info = b->read_int();
@@ -286,10 +600,19 @@ void Game::deserialize(ReadBuffer *b) {
     fixed_asset_seed = b->read_int();
 
     cur_time = b->read_int();
-    is_waiting_for_step = b->read_int();
+    // is_waiting_for_step, always false
+    b->read_int();
 
     level_progress = b->read_int();
     level_progress_max = b->read_int();
     prev_level_progress = b->read_int();
     prev_level_progress_max = b->read_int();
+
+    if (version >= 2) {
+        read_episode_stats(b, &current_episode);
+        read_episode_stats(b, &last_episode);
+    } else {
+        current_episode = EpisodeStats();
+        last_episode = EpisodeStats();
+    }
 }
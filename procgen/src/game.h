@@ -7,8 +7,11 @@ Base class used for all games, all games must inherit from this
 */
 
 #include <QtGui/QPainter>
+#include <atomic>
 #include <memory>
+#include <deque>
 #include <functional>
+#include <map>
 #include <vector>
 #include <string>
 #include "entity.h"
@@ -25,6 +28,11 @@ const int RES_H = 64;
 
 const int RENDER_RES = 512;
 
+// should match MAX_STATE_SIZE in env.py
+const int MAX_STATE_SIZE = 1 << 20;
+// written after the serialized game by write_state()
+const int32_t END_OF_BUFFER = 0xCAFECAFE;
+
 void bgr32_to_rgb888(void *dst_rgb888, void *src_bgr32, int w, int h);
 
 class VecOptions;
@@ -52,6 +60,10 @@ struct GameOptions {
     int debug_mode = 0;
     DistributionMode distribution_mode = HardMode;
     bool use_sequential_levels = false;
+    // rendering only, not part of the saved state
+    bool cache_static_layer = false;
+    // size of the square background painted for each level when use_generated_assets is set
+    int generated_background_resolution = 500;
 
     // coinrun_old
     bool use_easy_jump = false;
@@ -63,6 +75,65 @@ struct GameOptions {
     int level_options_2 = -1;
 };
 
+// the number of episodes that each game keeps stats for until VecGame::get_episode_stats() is called
+const int MAX_RECENT_EPISODES = 64;
+
+struct EpisodeStats {
+    float episode_return = 0.0f;
+    int length = 0;
+    bool level_complete = false;
+    // highest level_progress_max of the levels in the episode
+    int max_progress = 0;
+    int level_seed = 0;
+};
+
+// a sequence of steps that a game takes on a stepping thread without returning to python, see VecGame::rollout()
+struct Rollout {
+    int num_steps = 0;
+    // index of the game in the arrays, which are shared by all games in the rollout
+    int env_idx = 0;
+    int num_envs = 0;
+    // only keep the observation of every frame_interval-th step
+    int frame_interval = 1;
+    // [num_steps, num_envs]
+    const int32_t *actions = nullptr;
+    // [num_steps / frame_interval, num_envs, RES_H, RES_W, 3]
+    uint8_t *obs = nullptr;
+    // [num_steps, num_envs]
+    float *rews = nullptr;
+    uint8_t *firsts = nullptr;
+};
+
+// saved states of one game that episodes start from instead of a new level, see VecGame::set_state_pool()
+struct StatePool {
+    // states of all games in the pool, shared between pools so that changing the weights doesn't copy them
+    std::shared_ptr<const std::vector<std::vector<char>>> all_states;
+    // indices of this game's states in all_states, and the running sums of their sampling weights
+    std::vector<int> indices;
+    std::vector<double> cumulative_weights;
+};
+
+class Game;
+
+// the level that a game expects its next reset() to generate, generated ahead of time on an idle stepping thread
+// by a copy of the game, see Game::request_next_level()
+struct PregeneratedLevel {
+    // the game that generates the level, which belongs to the stepping thread until done is set
+    std::shared_ptr<Game> generator;
+    // seed that the next reset() is expected to draw
+    int level_seed = 0;
+    // state of the requesting game when the level was requested, which the generator copies before generating
+    std::vector<char> base_state;
+    // state of the generator after generating the level, only valid once done is set
+    std::vector<char> state;
+    // set by the stepping thread that generated the level
+    std::atomic<bool> done{false};
+    // set when the level won't be used, so that it isn't generated if it hasn't been yet
+    std::atomic<bool> cancelled{false};
+    // set once the level has been added to the queue of levels to generate
+    bool queued = false;
+};
+
 class Game {
   public:
     const std::string game_name;
@@ -98,6 +169,38 @@ class Game {
 
     uint32_t render_buf[RES_W * RES_H];
 
+    // resolution of the "rgb" info render, 0 if disabled for this game
+    int render_human_res = 0;
+    // only render the "rgb" info every this many steps
+    int render_human_interval = 1;
+    int render_human_counter = 0;
+    std::vector<uint32_t> render_human_buf;
+
+    // write "state_digest" and "obs_digest" info fields on each observation
+    bool digest_info = false;
+    // write the "episode_*" info fields and keep the stats of recent episodes
+    bool episode_stats = false;
+    // the episode in progress and the last one that ended
+    EpisodeStats current_episode;
+    EpisodeStats last_episode;
+    // episodes that ended since the last call to VecGame::get_episode_stats(), oldest first
+    std::deque<EpisodeStats> recent_episodes;
+    // running average of the seconds taken by step(), used to queue the slowest games first
+    float step_cost = 0.0f;
+
+    // steps to take the next time the game is queued for a step, instead of a single step
+    Rollout rollout;
+
+    // if set, reset() restores a state drawn from this pool instead of generating a level
+    std::shared_ptr<const StatePool> state_pool;
+    // not part of the saved state, so restoring a state from the pool doesn't change the states drawn after it
+    RandGen state_pool_rand_gen;
+
+    // generate the next level on idle stepping threads so that reset() only has to swap it in
+    bool pregenerate_levels = false;
+    // the level requested for the next reset(), if any
+    std::shared_ptr<PregeneratedLevel> next_level;
+
     int cur_time = 0;
 
     bool is_waiting_for_step = false;
@@ -115,21 +218,50 @@ class Game {
     uint8_t *first_ptr = nullptr;
 
     Game(std::string name);
-    void step();
+    void step(bool render = true);
+    void run_rollout();
     void reset();
+    void request_next_level();
+    void generate_level(PregeneratedLevel *level);
     void render_to_buf(void *buf, int w, int h, bool antialias);
     void parse_options(std::string name, VecOptions opt_vec);
+    uint64_t state_digest();
+    // the saved state returned by get_state() and loaded by set_state()
+    void write_state(WriteBuffer *b);
+    void read_state(ReadBuffer *b);
+    uint64_t obs_digest();
 
     virtual ~Game() = 0;
-    virtual void observe();
+    void observe();
     virtual void game_init() = 0;
     virtual void game_reset() = 0;
     virtual void game_step() = 0;
     virtual void game_draw(QPainter &p, const QRect &rect) = 0;
+    // set level_progress and level_progress_max from the current state, called after every step and reset, whether
+    // or not the step is rendered
+    virtual void update_level_progress();
     virtual void serialize(WriteBuffer *b);
     virtual void deserialize(ReadBuffer *b);
+    // the saved state that reset() keeps from the previous episode, which is everything that game_reset() doesn't
+    // set, a pregenerated level is swapped in by loading its state and then this part of the current state
+    //
+    // a game that adds a saved field set by game_step() but not game_reset() must add it here, and members that
+    // aren't saved must be derived again in deserialize() so that loading a state restores them, test_pregenerate_levels
+    // compares every env of every game with and without pregenerated levels to check this
+    virtual void serialize_reset_carryover(WriteBuffer *b);
+    virtual void deserialize_reset_carryover(ReadBuffer *b);
+    // describe the current level for procgen.levels, the names of the fields don't depend on the level, and
+    // get_level_metadata() appends one value for each name in the same order
+    virtual void level_metadata_names(std::vector<std::string> &names);
+    virtual void get_level_metadata(std::vector<float> &values);
 
   private:
+    void reset_from_state_pool();
+    bool swap_in_next_level();
+    void discard_next_level();
+    // game of the same type that generates this game's levels ahead of time
+    std::shared_ptr<Game> level_generator;
+    void end_episode();
     int reset_count = 0;
     float total_reward = 0.0f;
 };
@@ -475,6 +475,23 @@ class BossfightGame : public BasicAbstractGame {
         fassert(shields_idx >= 0);
         shields = entities[shields_idx];
     }
+
+    void serialize_reset_carryover(WriteBuffer *b) override {
+        BasicAbstractGame::serialize_reset_carryover(b);
+        // drawn at the start of each step
+        b->write_float(rand_pct);
+        b->write_float(rand_fire_pct);
+        b->write_float(rand_pct_x);
+        b->write_float(rand_pct_y);
+    }
+
+    void deserialize_reset_carryover(ReadBuffer *b) override {
+        BasicAbstractGame::deserialize_reset_carryover(b);
+        rand_pct = b->read_float();
+        rand_fire_pct = b->read_float();
+        rand_pct_x = b->read_float();
+        rand_pct_y = b->read_float();
+    }
 };
 
 REGISTER_GAME(NAME, BossfightGame);
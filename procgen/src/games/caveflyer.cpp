@@ -264,6 +264,13 @@ class CaveFlyerGame : public BasicAbstractGame {
         visibility = options.distribution_mode == EasyMode ? 10 : 16;
     }
 
+    void deserialize_reset_carryover(ReadBuffer *b) override {
+        // unlike the other games, game_reset() sets the visibility
+        float reset_visibility = visibility;
+        BasicAbstractGame::deserialize_reset_carryover(b);
+        visibility = reset_visibility;
+    }
+
     void set_action_xy(int move_action) override {
         float acceleration = move_action % 3 - 1;
         if (acceleration < 0)
@@ -346,11 +346,37 @@ class Climber : public BasicAbstractGame {
         wall_theme = b->read_int();
         gravity = b->read_float();
         air_control = b->read_float();
+
+        // not saved, found from the level as the highest platform
+        auto rows = platform_rows();
+        last_platform_y = rows.empty() ? 0 : rows.back();
+    }
+
+    // rows above the floor that have a platform, each platform is at least 3 rows above the previous one
+    std::vector<int> platform_rows() {
+        std::vector<int> rows;
+        for (int y = 1; y < main_height; y++) {
+            for (int x = 1; x < main_width - 1; x++) {
+                if (get_obj(x, y) == WALL_TOP) {
+                    rows.push_back(y);
+                    break;
+                }
+            }
+        }
+        return rows;
     }
 
-    void observe() override {
-        Game::observe();
+    void level_metadata_names(std::vector<std::string> &names) override {
+        BasicAbstractGame::level_metadata_names(names);
+        names.push_back("num_platforms");
+    }
+
+    void get_level_metadata(std::vector<float> &values) override {
+        BasicAbstractGame::get_level_metadata(values);
+        values.push_back((float)(platform_rows().size()));
+    }
 
+    void update_level_progress() override {
         int obj_below_1 = get_obj_from_floats(agent->x - (agent->rx - .01), agent->y - (agent->ry + .01));
         int obj_below_2 = get_obj_from_floats(agent->x + (agent->rx - .01), agent->y - (agent->ry + .01));
         if (is_wall(obj_below_1) || is_wall(obj_below_2)) {
@@ -359,8 +385,6 @@ class Climber : public BasicAbstractGame {
         }
 
         level_progress_max = (level_progress > level_progress_max) ? level_progress : level_progress_max;
-        *(int32_t *)(info_bufs[info_name_to_offset.at("level_progress")]) = level_progress;
-        *(int32_t *)(info_bufs[info_name_to_offset.at("level_progress_max")]) = level_progress_max;
     }
 };
 
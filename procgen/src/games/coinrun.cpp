@@ -523,17 +523,39 @@ class CoinRun : public BasicAbstractGame {
         is_on_crate = b->read_bool();
         gravity = b->read_float();
         air_control = b->read_float();
+
+        // not saved, found from the level
+        goal_x = 0;
+        for (int i = 0; i < main_width * main_height; i++) {
+            if (get_obj(i) == GOAL) {
+                goal_x = i % main_width;
+            }
+        }
     }
 
-    void observe() override {
-        Game::observe();
+    void level_metadata_names(std::vector<std::string> &names) override {
+        BasicAbstractGame::level_metadata_names(names);
+        names.insert(names.end(), {"goal_x", "num_enemies", "num_saws", "num_crates"});
+    }
+
+    void get_level_metadata(std::vector<float> &values) override {
+        BasicAbstractGame::get_level_metadata(values);
+        int num_enemies = 0;
+        int num_saws = 0;
+        int num_crates = 0;
+        for (const auto &ent : entities) {
+            num_enemies += ent->type == ENEMY;
+            num_saws += ent->type == SAW;
+            num_crates += ent->type == CRATE;
+        }
+        values.insert(values.end(), {(float)(goal_x), (float)(num_enemies), (float)(num_saws), (float)(num_crates)});
+    }
 
+    void update_level_progress() override {
         float agent_x_prog = agent->x - agent->rx - 1.0f;
         level_progress = std::lround(agent_x_prog/(float(goal_x) - 2.0f*agent->rx - 1.0f)*100.0f);
         level_progress = (level_progress > 100) ? 100 : level_progress;
         level_progress_max = (level_progress > level_progress_max) ? level_progress : level_progress_max;
-        *(int32_t *)(info_bufs[info_name_to_offset.at("level_progress")]) = level_progress;
-        *(int32_t *)(info_bufs[info_name_to_offset.at("level_progress_max")]) = level_progress_max;
     }
 };
 
@@ -299,11 +299,31 @@ class HeistGame : public BasicAbstractGame {
         last_stage_y = b->read_float();
         next_stage_x = b->read_float();
         next_stage_y = b->read_float();
+
+        // not saved, counted from the keys held and the doors left
+        keys_collected = 0;
+        for (bool has_key : has_keys) {
+            keys_collected += has_key;
+        }
+        num_doors_unlocked = num_keys;
+        for (const auto &ent : entities) {
+            if (ent->type == LOCKED_DOOR && !ent->will_erase) {
+                num_doors_unlocked--;
+            }
+        }
+    }
+
+    void level_metadata_names(std::vector<std::string> &names) override {
+        BasicAbstractGame::level_metadata_names(names);
+        names.push_back("num_keys");
     }
 
-    void observe() override {
-        Game::observe();
+    void get_level_metadata(std::vector<float> &values) override {
+        BasicAbstractGame::get_level_metadata(values);
+        values.push_back((float)(num_keys));
+    }
 
+    void update_level_progress() override {
         float dist_between_stages = pow(pow(next_stage_x - last_stage_x, 2.0f) + pow(next_stage_y - last_stage_y, 2.0f), 0.5f);
         float dist_to_next_stage = pow(pow(next_stage_x - agent->x, 2.0f) + pow(next_stage_y - agent->y, 2.0f), 0.5f);
 
@@ -312,8 +332,6 @@ class HeistGame : public BasicAbstractGame {
 
         level_progress = (interp_progress > level_progress) ? interp_progress : level_progress;
         level_progress_max = (level_progress > level_progress_max) ? level_progress : level_progress_max;
-        *(int32_t *)(info_bufs[info_name_to_offset.at("level_progress")]) = level_progress;
-        *(int32_t *)(info_bufs[info_name_to_offset.at("level_progress_max")]) = level_progress_max;
     }
 
     void set_action_xy(int move_action) override {
@@ -302,14 +302,11 @@ class LeaperGame : public BasicAbstractGame {
         goal_y = b->read_int();
     }
 
-    void observe() override {
-        Game::observe();
+    void update_level_progress() override {
         float agent_w_offset = agent->y - 0.4f;
         float goal_w_offset = goal_y - 1.0f;
         level_progress = std::lround(agent_w_offset/goal_w_offset*100.0f);
         level_progress_max = (level_progress > level_progress_max) ? level_progress : level_progress_max;
-        *(int32_t *)(info_bufs[info_name_to_offset.at("level_progress")]) = level_progress;
-        *(int32_t *)(info_bufs[info_name_to_offset.at("level_progress_max")]) = level_progress_max;
     }
 };
 
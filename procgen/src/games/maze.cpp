@@ -133,6 +133,47 @@ class MazeGame : public BasicAbstractGame {
         maze_dim = b->read_int();
         world_dim = b->read_int();
     }
+
+    // number of moves on the shortest path from the agent to the goal
+    int solution_length() {
+        std::vector<int> dist(grid_size, -1);
+        std::queue<int> frontier;
+        int start = to_grid_idx(int(agent->x), int(agent->y));
+        dist[start] = 0;
+        frontier.push(start);
+
+        while (!frontier.empty()) {
+            int idx = frontier.front();
+            frontier.pop();
+            if (get_obj(idx) == GOAL) {
+                return dist[idx];
+            }
+
+            int x, y;
+            to_grid_xy(idx, &x, &y);
+            const int dxs[] = {1, -1, 0, 0};
+            const int dys[] = {0, 0, 1, -1};
+            for (int k = 0; k < 4; k++) {
+                int next_idx = to_grid_idx(x + dxs[k], y + dys[k]);
+                if (next_idx != INVALID_IDX && dist[next_idx] == -1 && get_obj(next_idx) != WALL_OBJ) {
+                    dist[next_idx] = dist[idx] + 1;
+                    frontier.push(next_idx);
+                }
+            }
+        }
+
+        return -1;
+    }
+
+    void level_metadata_names(std::vector<std::string> &names) override {
+        BasicAbstractGame::level_metadata_names(names);
+        names.insert(names.end(), {"maze_size", "solution_length"});
+    }
+
+    void get_level_metadata(std::vector<float> &values) override {
+        BasicAbstractGame::get_level_metadata(values);
+        values.insert(values.end(), {(float)(maze_dim), (float)(solution_length())});
+    }
 };
 
 REGISTER_GAME(NAME, MazeGame);
@@ -322,6 +322,17 @@ class MinerGame : public BasicAbstractGame {
         BasicAbstractGame::deserialize(b);
         diamonds_remaining = b->read_int();
     }
+
+    void serialize_reset_carryover(WriteBuffer *b) override {
+        BasicAbstractGame::serialize_reset_carryover(b);
+        // counted at the end of each step
+        b->write_int(diamonds_remaining);
+    }
+
+    void deserialize_reset_carryover(ReadBuffer *b) override {
+        BasicAbstractGame::deserialize_reset_carryover(b);
+        diamonds_remaining = b->read_int();
+    }
 };
 
 REGISTER_GAME(NAME, MinerGame);
\ No newline at end of file
@@ -1,25 +1,70 @@
 #include "randgen.h"
 #include "cpp-utils.h"
+#include <locale>
 #include <set>
 #include <sstream>
 
+// RandGen states saved before the binary format start with is_seeded (0 or 1) followed by the generator as text,
+// binary states start with one of these
+const int BINARY_FORMAT_UNSEEDED = 2;
+const int BINARY_FORMAT_SEEDED = 3;
+
+const int MT_SHIFT = 397;
+const uint32_t MT_MATRIX = 0x9908b0df;
+const uint32_t MT_UPPER_MASK = 0x80000000;
+const uint32_t MT_LOWER_MASK = 0x7fffffff;
+
+Mt19937::Mt19937() {
+    // same default seed as std::mt19937
+    seed(5489u);
+}
+
+void Mt19937::seed(uint32_t value) {
+    state[0] = value;
+    for (int i = 1; i < STATE_SIZE; i++) {
+        state[i] = 1812433253u * (state[i - 1] ^ (state[i - 1] >> 30)) + (uint32_t)(i);
+    }
+    index = STATE_SIZE;
+}
+
+void Mt19937::regenerate() {
+    for (int i = 0; i < STATE_SIZE; i++) {
+        uint32_t y = (state[i] & MT_UPPER_MASK) | (state[(i + 1) % STATE_SIZE] & MT_LOWER_MASK);
+        state[i] = state[(i + MT_SHIFT) % STATE_SIZE] ^ (y >> 1) ^ ((y & 1) ? MT_MATRIX : 0);
+    }
+    index = 0;
+}
+
+uint32_t Mt19937::operator()() {
+    if (index >= STATE_SIZE) {
+        regenerate();
+    }
+
+    uint32_t z = state[index++];
+    z ^= z >> 11;
+    z ^= (z << 7) & 0x9d2c5680;
+    z ^= (z << 15) & 0xefc60000;
+    z ^= z >> 18;
+    return z;
+}
+
 int RandGen::randint(int low, int high) {
     fassert(is_seeded);
-    uint32_t x = stdgen();
+    uint32_t x = gen();
     uint32_t range = high - low;
     return low + (x % range);
 }
 
 int RandGen::randn(int high) {
     fassert(is_seeded);
-    uint32_t x = stdgen();
+    uint32_t x = gen();
     return (x % high);
 }
 
 float RandGen::rand01() {
     fassert(is_seeded);
-    uint32_t x = stdgen();
-    return (float)((double)(x) / ((double)(stdgen.max()) + 1));
+    uint32_t x = gen();
+    return (float)((double)(x) / ((double)(gen.max()) + 1));
 }
 
 bool RandGen::randbool() {
@@ -89,26 +134,52 @@ std::vector<int> RandGen::simple_choose(int n, int k) {
 
 int RandGen::randint() {
     fassert(is_seeded);
-    return stdgen();
+    return gen();
 }
 
 void RandGen::seed(int seed) {
-    stdgen.seed(seed);
+    gen.seed(seed);
     is_seeded = true;
 }
 
 void RandGen::serialize(WriteBuffer *b) {
-    b->write_int(is_seeded);
-    std::ostringstream ostream;
-    ostream << stdgen;
-    auto str = ostream.str();
-    b->write_string(str);
+    b->write_int(is_seeded ? BINARY_FORMAT_SEEDED : BINARY_FORMAT_UNSEEDED);
+    b->write_int(gen.index);
+    for (int i = 0; i < Mt19937::STATE_SIZE; i++) {
+        b->write_int((int)(gen.state[i]));
+    }
 }
 
 void RandGen::deserialize(ReadBuffer *b) {
-    is_seeded = b->read_int();
+    int format = b->read_int();
+
+    if (format == BINARY_FORMAT_UNSEEDED || format == BINARY_FORMAT_SEEDED) {
+        is_seeded = format == BINARY_FORMAT_SEEDED;
+        gen.index = b->read_int();
+        fassert(0 <= gen.index && gen.index <= Mt19937::STATE_SIZE);
+        for (int i = 0; i < Mt19937::STATE_SIZE; i++) {
+            gen.state[i] = (uint32_t)(b->read_int());
+        }
+        return;
+    }
+
+    // text written by operator<< of std::mt19937, libstdc++ writes the state followed by the index,
+    // libc++ writes the state starting from the oldest value
+    fassert(format == 0 || format == 1);
+    is_seeded = format;
     auto str = b->read_string();
     std::istringstream istream;
+    istream.imbue(std::locale::classic());
     istream.str(str);
-    istream >> stdgen;
+    std::vector<unsigned long> values;
+    unsigned long value;
+    while (istream >> value) {
+        values.push_back(value);
+    }
+    fassert(values.size() == Mt19937::STATE_SIZE || values.size() == Mt19937::STATE_SIZE + 1);
+    for (int i = 0; i < Mt19937::STATE_SIZE; i++) {
+        gen.state[i] = (uint32_t)(values[i]);
+    }
+    gen.index = values.size() == Mt19937::STATE_SIZE + 1 ? (int)(values.back()) : Mt19937::STATE_SIZE;
+    fassert(0 <= gen.index && gen.index <= Mt19937::STATE_SIZE);
 }
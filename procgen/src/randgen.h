@@ -7,11 +7,36 @@ Random number generator with consistent behavior across platforms
 */
 
 #include "buffer.h"
-#include <random>
+#include <cstdint>
+
+// 32 bit Mersenne Twister producing the same sequence as std::mt19937, implemented here so that
+// its state can be saved directly instead of through a text stream
+class Mt19937 {
+  public:
+    typedef uint32_t result_type;
+    static const int STATE_SIZE = 624;
+
+    uint32_t state[STATE_SIZE];
+    // index of the next value in state to output, the state is regenerated when this reaches STATE_SIZE
+    int index = STATE_SIZE;
+
+    Mt19937();
+    void seed(uint32_t value);
+    uint32_t operator()();
+    static constexpr uint32_t min() {
+        return 0;
+    }
+    static constexpr uint32_t max() {
+        return 0xffffffff;
+    }
+
+  private:
+    void regenerate();
+};
 
 class RandGen {
   public:
-    std::mt19937 stdgen;
+    Mt19937 gen;
     int randint(int low, int high);
     int randn(int high);
     float rand01();
@@ -3,7 +3,17 @@
 #include "vecoptions.h"
 #include "game.h"
 
-const int32_t END_OF_BUFFER = 0xCAFECAFE;
+#include <algorithm>
+#include <atomic>
+#include <chrono>
+#include <cmath>
+#include <functional>
+#include <numeric>
+
+#ifndef _WIN32
+#include <fcntl.h>
+#include <unistd.h>
+#endif
 
 extern void coinrun_old_init(int rand_seed);
 
@@ -100,12 +110,20 @@ void libenv_close(libenv_env *handle) {
 
 // end libenv api
 
+// weight of the previous estimate in the running average of each game's step time
+const float STEP_COST_DECAY = 0.9f;
+
 static void stepping_worker(std::mutex &stepping_thread_mutex,
+                            std::list<std::function<void()>> &pending_tasks,
                             std::list<std::shared_ptr<Game>> &pending_games,
+                            std::list<std::shared_ptr<PregeneratedLevel>> &pending_levels,
                             std::condition_variable &pending_games_added,
-                            std::condition_variable &pending_game_complete, bool &time_to_die) {
+                            std::condition_variable &pending_game_complete, bool &time_to_die,
+                            int &num_pending_games, const int &completion_write_fd) {
     while (1) {
+        std::function<void()> task;
         std::shared_ptr<Game> game;
+        std::shared_ptr<PregeneratedLevel> level;
 
         {
             std::unique_lock<std::mutex> lock(stepping_thread_mutex);
@@ -113,16 +131,38 @@ static void stepping_worker(std::mutex &stepping_thread_mutex,
                 if (time_to_die) {
                     return;
                 }
+                if (!pending_tasks.empty()) {
+                    task = std::move(pending_tasks.front());
+                    pending_tasks.pop_front();
+                    break;
+                }
                 if (!pending_games.empty()) {
                     game = pending_games.front();
                     pending_games.pop_front();
                     break;
                 }
+                // levels are only generated by threads that have no games to step
+                if (!pending_levels.empty()) {
+                    level = pending_levels.front();
+                    pending_levels.pop_front();
+                    break;
+                }
 
                 pending_games_added.wait(lock);
             }
         }
 
+        if (task) {
+            task();
+            continue;
+        }
+
+        if (level != nullptr) {
+            // the generator belongs to this thread until the level is done, and isn't part of any step
+            level->generator->generate_level(level.get());
+            continue;
+        }
+
         // the first time the threads are activated is before any step, just to initialize
         // the environment and produce the initial observation
         if (!game->initial_reset_complete) {
@@ -130,12 +170,41 @@ static void stepping_worker(std::mutex &stepping_thread_mutex,
             game->observe();
             game->initial_reset_complete = true;
         } else{
-            game->step();
+            auto start = std::chrono::steady_clock::now();
+            int num_steps = 1;
+            if (game->rollout.num_steps > 0) {
+                num_steps = game->rollout.num_steps;
+                game->run_rollout();
+            } else {
+                game->step();
+            }
+            std::chrono::duration<float> elapsed = std::chrono::steady_clock::now() - start;
+            float cost = elapsed.count() / num_steps;
+            if (game->step_cost == 0.0f) {
+                game->step_cost = cost;
+            } else {
+                game->step_cost = STEP_COST_DECAY * game->step_cost + (1 - STEP_COST_DECAY) * cost;
+            }
         }
 
         {
             std::unique_lock<std::mutex> lock(stepping_thread_mutex);
+            const auto &next_level = game->next_level;
+            if (next_level != nullptr && !next_level->queued) {
+                next_level->queued = true;
+                pending_levels.push_back(next_level);
+                pending_games_added.notify_one();
+            }
             game->is_waiting_for_step = false;
+            num_pending_games--;
+#ifndef _WIN32
+            if (num_pending_games == 0 && completion_write_fd >= 0) {
+                // the pipe is non-blocking, if it is full there is already a notification waiting
+                uint8_t byte = 0;
+                ssize_t written = write(completion_write_fd, &byte, 1);
+                (void)written;
+            }
+#endif
             pending_game_complete.notify_all();
         }
     }
@@ -168,6 +237,12 @@ inline uint32_t hash_str_uint32(const std::string &str) {
 
 VecGame::VecGame(int _nenvs, VecOptions opts) {
     render_human = false;
+    render_resolution = RENDER_RES;
+    bool digest_info = false;
+    bool episode_stats = false;
+    bool pregenerate_levels = false;
+    int render_interval = 1;
+    std::vector<int32_t> render_env_indices;
     num_envs = _nenvs;
     games.resize(num_envs);
     std::string env_name;
@@ -188,6 +263,16 @@ VecGame::VecGame(int _nenvs, VecOptions opts) {
     opts.consume_int("num_threads", &num_threads);
     opts.consume_string("resource_root", &resource_root);
     opts.consume_bool("render_human", &render_human);
+    opts.consume_int("render_resolution", &render_resolution);
+    fassert(render_resolution > 0);
+    opts.consume_bool("digest_info", &digest_info);
+    opts.consume_bool("episode_stats", &episode_stats);
+    opts.consume_bool("pregenerate_levels", &pregenerate_levels);
+    opts.consume_int("render_interval", &render_interval);
+    fassert(render_interval > 0);
+    // by default every env is rendered
+    render_env_indices.push_back(-1);
+    opts.consume_int_array("render_env_indices", &render_env_indices);
 
     std::call_once(global_init_flag, global_init, rand_seed,
                    resource_root);
@@ -198,10 +283,14 @@ VecGame::VecGame(int _nenvs, VecOptions opts) {
         threads[t] = std::thread(
             stepping_worker,
             std::ref(stepping_thread_mutex),
+            std::ref(pending_tasks),
             std::ref(pending_games),
+            std::ref(pending_levels),
             std::ref(pending_games_added),
             std::ref(pending_game_complete),
-            std::ref(time_to_die));
+            std::ref(time_to_die),
+            std::ref(num_pending_games),
+            std::ref(completion_fds[1]));
     }
 
     fassert(env_name != "");
@@ -311,13 +400,74 @@ VecGame::VecGame(int _nenvs, VecOptions opts) {
         info_types.push_back(s);
     }
 
+    if (digest_info) {
+        for (const char *name : {"state_digest", "obs_digest"}) {
+            struct libenv_tensortype s;
+            strcpy(s.name, name);
+            s.scalar_type = LIBENV_SCALAR_TYPE_DISCRETE;
+            s.dtype = LIBENV_DTYPE_UINT8;
+            s.shape[0] = 8;
+            s.ndim = 1,
+            s.low.uint8 = 0;
+            s.high.uint8 = 255;
+            info_types.push_back(s);
+        }
+    }
+
+    if (episode_stats) {
+        // stats of the last episode that ended
+        {
+            struct libenv_tensortype s;
+            strcpy(s.name, "episode_return");
+            s.scalar_type = LIBENV_SCALAR_TYPE_REAL;
+            s.dtype = LIBENV_DTYPE_FLOAT32;
+            s.ndim = 0,
+            s.low.float32 = -INFINITY;
+            s.high.float32 = INFINITY;
+            info_types.push_back(s);
+        }
+
+        {
+            struct libenv_tensortype s;
+            strcpy(s.name, "episode_length");
+            s.scalar_type = LIBENV_SCALAR_TYPE_DISCRETE;
+            s.dtype = LIBENV_DTYPE_INT32;
+            s.ndim = 0,
+            s.low.int32 = 0;
+            s.high.int32 = INT32_MAX;
+            info_types.push_back(s);
+        }
+
+        {
+            struct libenv_tensortype s;
+            strcpy(s.name, "episode_level_complete");
+            s.scalar_type = LIBENV_SCALAR_TYPE_DISCRETE;
+            s.dtype = LIBENV_DTYPE_UINT8;
+            s.ndim = 0,
+            s.low.uint8 = 0;
+            s.high.uint8 = 1;
+            info_types.push_back(s);
+        }
+
+        {
+            struct libenv_tensortype s;
+            strcpy(s.name, "episode_max_progress");
+            s.scalar_type = LIBENV_SCALAR_TYPE_DISCRETE;
+            s.dtype = LIBENV_DTYPE_INT32;
+            s.ndim = 0,
+            s.low.int32 = 0;
+            s.high.int32 = 100;
+            info_types.push_back(s);
+        }
+    }
+
     if (render_human) {
         struct libenv_tensortype s;
         strcpy(s.name, "rgb");
         s.scalar_type = LIBENV_SCALAR_TYPE_DISCRETE;
         s.dtype = LIBENV_DTYPE_UINT8;
-        s.shape[0] = RENDER_RES;
-        s.shape[1] = RENDER_RES;
+        s.shape[0] = render_resolution;
+        s.shape[1] = render_resolution;
         s.shape[2] = 3;
         s.ndim = 3,
         s.low.uint8 = 0;
@@ -336,7 +486,18 @@ VecGame::VecGame(int _nenvs, VecOptions opts) {
         level_seed_high = start_level + num_levels;
     }
 
-    std::vector<std::string> env_names = split(env_name, ",");
+    // env_name is a comma separated list of games, each optionally followed by ":<weight>", envs are assigned
+    // games round-robin from a list where each game appears weight times
+    std::vector<std::string> env_names;
+    for (const auto &spec : split(env_name, ",")) {
+        auto parts = split(spec, ":");
+        fassert(parts.size() <= 2);
+        int weight = parts.size() == 2 ? std::stoi(parts[1]) : 1;
+        fassert(weight > 0);
+        for (int i = 0; i < weight; i++) {
+            env_names.push_back(parts[0]);
+        }
+    }
 
     num_joint_games = (int)(env_names.size());
 
@@ -350,18 +511,46 @@ VecGame::VecGame(int _nenvs, VecOptions opts) {
         info_name_to_offset[info_types[i].name] = i;
     }
 
+    // parse the options once for each game and copy them to every env of that game
+    std::map<std::string, std::shared_ptr<Game>> parsed_games;
+    for (const auto &name : env_names) {
+        if (parsed_games.count(name) == 0) {
+            auto game = globalGameRegistry->at(name)();
+            game->parse_options(name, opts);
+            parsed_games[name] = game;
+        }
+    }
+
+    // draw the level seeds in env order so they don't depend on the order in which games are constructed
+    std::vector<int> level_seed_gen_seeds(num_envs);
+    for (int n = 0; n < num_envs; n++) {
+        level_seed_gen_seeds[n] = game_level_seed_gen.randint();
+    }
+    // drawn after the level seeds so that they don't change the level seeds
+    std::vector<int> state_pool_seeds(num_envs);
     for (int n = 0; n < num_envs; n++) {
+        state_pool_seeds[n] = game_level_seed_gen.randint();
+    }
+
+    auto construct_game = [&](int n) {
         auto name = env_names[n % num_joint_games];
+        const auto &parsed = parsed_games.at(name);
 
         games[n] = globalGameRegistry->at(name)();
         fassert(games[n]->game_name == name);
-        games[n]->level_seed_rand_gen.seed(game_level_seed_gen.randint());
+        games[n]->level_seed_rand_gen.seed(level_seed_gen_seeds[n]);
+        games[n]->state_pool_rand_gen.seed(state_pool_seeds[n]);
         games[n]->level_seed_high = level_seed_high;
         games[n]->level_seed_low = level_seed_low;
         games[n]->game_n = n;
         games[n]->is_waiting_for_step = false;
-        games[n]->parse_options(name, opts);
+        games[n]->options = parsed->options;
+        games[n]->game_type = parsed->game_type;
         games[n]->info_name_to_offset = info_name_to_offset;
+        games[n]->digest_info = digest_info;
+        games[n]->episode_stats = episode_stats;
+        // levels are generated by the stepping threads
+        games[n]->pregenerate_levels = pregenerate_levels && num_threads > 0;
 
         // Auto-selected a fixed_asset_seed if one wasn't specified on
         // construction
@@ -371,10 +560,42 @@ VecGame::VecGame(int _nenvs, VecOptions opts) {
         }
 
         games[n]->game_init();
+    };
+
+    // games are independent, so construct them on the stepping threads
+    parallel_for(num_envs, construct_game);
+
+    step_order.resize(num_envs);
+    std::iota(step_order.begin(), step_order.end(), 0);
+
+    std::vector<bool> render_enabled(num_envs, false);
+    for (int32_t idx : render_env_indices) {
+        if (idx == -1) {
+            render_enabled.assign(num_envs, true);
+        } else {
+            fassert(idx >= 0 && idx < num_envs);
+            render_enabled[idx] = true;
+        }
+    }
+    set_render_human(render_enabled, render_interval);
+}
+
+void VecGame::set_render_human(const std::vector<bool> &enabled, int interval) {
+    wait_for_stepping_threads();
+    fassert((int)(enabled.size()) == num_envs);
+    fassert(interval > 0);
+    for (int e = 0; e < num_envs; e++) {
+        games[e]->render_human_res = (render_human && enabled[e]) ? render_resolution : 0;
+        games[e]->render_human_interval = interval;
+        games[e]->render_human_counter = 0;
     }
 }
 
 void VecGame::set_buffers(const std::vector<std::vector<void *>> &ac, const std::vector<std::vector<void *>> &ob, const std::vector<std::vector<void *>> &info, float *rew, uint8_t *first) {
+    // buffers may be replaced after the initial call, in which case the games must not be
+    // writing to the old buffers while we switch them
+    wait_for_stepping_threads();
+
     {
         std::unique_lock<std::mutex> lock(stepping_thread_mutex);
 
@@ -386,10 +607,15 @@ void VecGame::set_buffers(const std::vector<std::vector<void *>> &ac, const std:
             game->info_bufs = info[e];
             game->reward_ptr = &rew[e];
             game->first_ptr = &first[e];
-            
-            // render the initial state so we don't see a black screen on the first frame
+
             fassert(!game->is_waiting_for_step);
-            fassert(!game->initial_reset_complete);
+            if (game->initial_reset_complete) {
+                // fill the new buffers with the current state
+                game->observe();
+                continue;
+            }
+
+            // render the initial state so we don't see a black screen on the first frame
             if (threads.size() == 0) {
                 // special case for no threads
                 game->reset();
@@ -398,6 +624,7 @@ void VecGame::set_buffers(const std::vector<std::vector<void *>> &ac, const std:
             } else {
                 game->is_waiting_for_step = true;
                 pending_games.push_back(game);
+                num_pending_games++;
             }
         }
     }
@@ -407,35 +634,65 @@ void VecGame::set_buffers(const std::vector<std::vector<void *>> &ac, const std:
 void VecGame::observe() {
     wait_for_stepping_threads();
     // at this point all games belong to the python thread
+    // the "rgb" info is rendered by Game::observe() on the stepping threads
+}
 
-    if (render_human) {
-        uint8_t render_hires_buf[RENDER_RES * RENDER_RES * 4];
-
-        for (int e = 0; e < num_envs; e++) {
-            const auto &game = games[e];
-            game->render_to_buf(render_hires_buf, RENDER_RES, RENDER_RES, true);
-            bgr32_to_rgb888(game->info_bufs[game->info_name_to_offset.at("rgb")], render_hires_buf, RENDER_RES, RENDER_RES);
-        }
+void VecGame::act() {
+    wait_for_stepping_threads();
+    for (const auto &game : games) {
+        // save the action since it's only valid for the duration of this call
+        game->action = *game->action_ptr;
     }
+    queue_steps();
 }
 
-void VecGame::act() {
+void VecGame::rollout(const int32_t *actions, int num_steps, int frame_interval, uint8_t *obs, float *rews, uint8_t *firsts) {
     wait_for_stepping_threads();
+    fassert(num_steps >= 0);
+    fassert(frame_interval > 0);
+    if (num_steps == 0) {
+        return;
+    }
+    for (int e = 0; e < num_envs; e++) {
+        auto &rollout = games[e]->rollout;
+        rollout.num_steps = num_steps;
+        rollout.env_idx = e;
+        rollout.num_envs = num_envs;
+        rollout.frame_interval = frame_interval;
+        rollout.actions = actions;
+        rollout.obs = obs;
+        rollout.rews = rews;
+        rollout.firsts = firsts;
+    }
+    queue_steps();
+    // the arrays are only valid for the duration of this call
+    wait_for_stepping_threads();
+}
+
+void VecGame::queue_steps() {
+    // the threads take games from the front of the queue, so queueing the slowest games first keeps
+    // threads from sitting idle at the end of the step while one of them finishes an expensive game
+    std::stable_sort(step_order.begin(), step_order.end(), [this](int a, int b) {
+        return games[a]->step_cost > games[b]->step_cost;
+    });
 
     {
         std::unique_lock<std::mutex> lock(stepping_thread_mutex);
 
-        for (int e = 0; e < num_envs; e++) {
+        for (int e : step_order) {
             const auto &game = games[e];
             fassert(!game->is_waiting_for_step);
-            // save the action since it's only valid for the duration of this call
-            game->action = *game->action_ptr;
             if (threads.size() == 0) {
                 // special case for no threads
-                game->step();
+                if (game->rollout.num_steps > 0) {
+                    game->run_rollout();
+                } else {
+                    game->step();
+                }
             } else {
                 game->is_waiting_for_step = true;
                 pending_games.push_back(game);
+                num_pending_games++;
             }
         }
     }
@@ -455,6 +712,231 @@ VecGame::~VecGame() {
     for (auto &t : threads) {
         t.join();
     }
+
+#ifndef _WIN32
+    for (int fd : completion_fds) {
+        if (fd >= 0) {
+            close(fd);
+        }
+    }
+#endif
+}
+
+void VecGame::parallel_for(int count, const std::function<void(int)> &fn) {
+    int num_workers = std::min((int)(threads.size()), count);
+    if (num_workers <= 1) {
+        for (int i = 0; i < count; i++) {
+            fn(i);
+        }
+        return;
+    }
+
+    std::atomic<int> next(0);
+    // guarded by stepping_thread_mutex
+    int num_running = num_workers;
+    auto work = [&]() {
+        for (int i = next++; i < count; i = next++) {
+            fn(i);
+        }
+        std::unique_lock<std::mutex> lock(stepping_thread_mutex);
+        num_running--;
+        pending_game_complete.notify_all();
+    };
+
+    std::unique_lock<std::mutex> lock(stepping_thread_mutex);
+    for (int t = 0; t < num_workers; t++) {
+        pending_tasks.push_back(work);
+    }
+    pending_games_added.notify_all();
+    while (num_running > 0) {
+        pending_game_complete.wait(lock);
+    }
+}
+
+void VecGame::clone_envs(const std::vector<int> &src_indices, const std::vector<int> &dst_indices, bool observe) {
+    wait_for_stepping_threads();
+    fassert(src_indices.size() == dst_indices.size());
+    int count = (int)(src_indices.size());
+
+    // serialize each source once before writing to any destination, so sources may also be destinations
+    std::vector<int> sources;
+    std::vector<int> source_slot(num_envs, -1);
+    std::vector<bool> is_dst(num_envs, false);
+    for (int i = 0; i < count; i++) {
+        int src = src_indices[i];
+        int dst = dst_indices[i];
+        fassert(src >= 0 && src < num_envs);
+        fassert(dst >= 0 && dst < num_envs);
+        fassert(!is_dst[dst]);
+        is_dst[dst] = true;
+        if (source_slot[src] == -1) {
+            source_slot[src] = (int)(sources.size());
+            sources.push_back(src);
+        }
+    }
+
+    std::vector<std::vector<char>> states(sources.size());
+    std::vector<float> step_costs(sources.size());
+    parallel_for((int)(sources.size()), [&](int i) {
+        thread_local std::vector<char> buf(MAX_STATE_SIZE);
+        auto b = WriteBuffer(buf.data(), buf.size());
+        games[sources[i]]->serialize(&b);
+        states[i].assign(buf.data(), buf.data() + b.offset);
+        step_costs[i] = games[sources[i]]->step_cost;
+    });
+
+    parallel_for(count, [&](int i) {
+        int slot = source_slot[src_indices[i]];
+        const auto &game = games[dst_indices[i]];
+        auto b = ReadBuffer(states[slot].data(), states[slot].size());
+        game->deserialize(&b);
+        game->step_cost = step_costs[slot];
+        if (observe) {
+            game->observe();
+        }
+    });
+}
+
+void VecGame::set_state_pool(const std::vector<std::vector<char>> &states, const std::vector<float> &weights) {
+    wait_for_stepping_threads();
+    fassert(states.size() == weights.size());
+    std::vector<std::string> game_names;
+    for (const auto &state : states) {
+        // states start with the format version and the game name
+        auto b = ReadBuffer((char *)(state.data()), state.size());
+        b.read_int();
+        game_names.push_back(b.read_string());
+    }
+    state_pool_states = std::make_shared<const std::vector<std::vector<char>>>(states);
+    state_pool_game_names = game_names;
+    set_state_pool_weights(weights);
+}
+
+void VecGame::set_state_pool_weights(const std::vector<float> &weights) {
+    wait_for_stepping_threads();
+    int count = state_pool_states == nullptr ? 0 : (int)(state_pool_states->size());
+    fassert((int)(weights.size()) == count);
+
+    // each game samples from the states of the same game, games without states with nonzero weight reset normally
+    std::map<std::string, std::shared_ptr<StatePool>> pools;
+    for (int i = 0; i < count; i++) {
+        fassert(weights[i] >= 0 && std::isfinite(weights[i]));
+        if (weights[i] == 0) {
+            continue;
+        }
+        auto &pool = pools[state_pool_game_names[i]];
+        if (pool == nullptr) {
+            pool = std::make_shared<StatePool>();
+            pool->all_states = state_pool_states;
+        }
+        double total = pool->cumulative_weights.empty() ? 0.0 : pool->cumulative_weights.back();
+        pool->indices.push_back(i);
+        pool->cumulative_weights.push_back(total + weights[i]);
+    }
+
+    for (const auto &game : games) {
+        auto it = pools.find(game->game_name);
+        game->state_pool = it == pools.end() ? nullptr : it->second;
+    }
+}
+
+// a game like the first env's game that is not connected to any buffers, used to generate levels without stepping
+std::shared_ptr<Game> VecGame::make_headless_game() {
+    const auto &src = games[0];
+    auto game = globalGameRegistry->at(src->game_name)();
+    game->options = src->options;
+    game->game_type = src->game_type;
+    game->fixed_asset_seed = src->fixed_asset_seed;
+    game->level_seed_low = src->level_seed_low;
+    game->level_seed_high = src->level_seed_high;
+    game->game_init();
+    return game;
+}
+
+std::vector<std::string> VecGame::level_metadata_names() {
+    // the names don't depend on the level, so the first env's game can be asked while it is being stepped
+    std::vector<std::string> names;
+    games[0]->level_metadata_names(names);
+    return names;
+}
+
+void VecGame::generate_levels(const std::vector<int> &seeds, float *values) {
+    wait_for_stepping_threads();
+    int count = (int)(seeds.size());
+    int num_fields = (int)(level_metadata_names().size());
+    int num_workers = std::min(std::max((int)(threads.size()), 1), count);
+
+    // each worker generates every num_workers-th level with its own game
+    parallel_for(num_workers, [&](int worker) {
+        auto game = make_headless_game();
+        std::vector<float> level_values;
+        for (int i = worker; i < count; i += num_workers) {
+            game->current_level_seed = seeds[i];
+            game->rand_gen.seed(seeds[i]);
+            game->game_reset();
+            level_values.clear();
+            game->get_level_metadata(level_values);
+            fassert((int)(level_values.size()) == num_fields);
+            std::copy(level_values.begin(), level_values.end(), values + i * num_fields);
+        }
+    });
+}
+
+int VecGame::num_episode_stats() {
+    wait_for_stepping_threads();
+    int count = 0;
+    for (const auto &game : games) {
+        count += (int)(game->recent_episodes.size());
+    }
+    return count;
+}
+
+int VecGame::get_episode_stats(int *env_indices, float *returns, int *lengths, uint8_t *level_completes, int *max_progress, int *level_seeds, int max_count) {
+    wait_for_stepping_threads();
+    int count = 0;
+    for (int e = 0; e < num_envs; e++) {
+        auto &recent = games[e]->recent_episodes;
+        while (!recent.empty() && count < max_count) {
+            const auto &stats = recent.front();
+            env_indices[count] = e;
+            returns[count] = stats.episode_return;
+            lengths[count] = stats.length;
+            level_completes[count] = (uint8_t)(stats.level_complete);
+            max_progress[count] = stats.max_progress;
+            level_seeds[count] = stats.level_seed;
+            recent.pop_front();
+            count++;
+        }
+    }
+    return count;
+}
+
+void VecGame::get_step_costs(float *costs) {
+    wait_for_stepping_threads();
+    for (int e = 0; e < num_envs; e++) {
+        costs[e] = games[e]->step_cost;
+    }
+}
+
+bool VecGame::is_step_complete() {
+    std::unique_lock<std::mutex> lock(stepping_thread_mutex);
+    return num_pending_games == 0;
+}
+
+int VecGame::create_completion_fd() {
+#ifdef _WIN32
+    return -1;
+#else
+    std::unique_lock<std::mutex> lock(stepping_thread_mutex);
+    if (completion_fds[0] < 0) {
+        fassert(pipe(completion_fds) == 0);
+        for (int fd : completion_fds) {
+            fassert(fcntl(fd, F_SETFL, fcntl(fd, F_GETFL) | O_NONBLOCK) == 0);
+            fassert(fcntl(fd, F_SETFD, FD_CLOEXEC) == 0);
+        }
+    }
+    return completion_fds[0];
+#endif
 }
 
 void VecGame::wait_for_stepping_threads() {
@@ -483,8 +965,7 @@ extern "C" {
         auto venv = (VecGame *)(handle);
         venv->wait_for_stepping_threads();
         auto b = WriteBuffer(data, length);
-        venv->games.at(env_idx)->serialize(&b);
-        b.write_int(END_OF_BUFFER);
+        venv->games.at(env_idx)->write_state(&b);
         return b.offset;
     }
 
@@ -492,10 +973,142 @@ extern "C" {
         auto venv = (VecGame *)(handle);
         venv->wait_for_stepping_threads();
         auto b = ReadBuffer(data, length);
-        venv->games.at(env_idx)->deserialize(&b);
-        fassert(b.read_int() == END_OF_BUFFER);
+        venv->games.at(env_idx)->read_state(&b);
         // after deserializing, we need to update the observation and info buffers so that the
         // next time VecGame::observe() is called, the correct data will be in the buffers
         venv->games.at(env_idx)->observe();
     }
+
+    // returns a file descriptor that becomes readable when a step completes, or -1 if not supported
+    // the caller should read all available bytes and then check is_step_complete()
+    LIBENV_API int create_completion_fd(libenv_env *handle) {
+        auto venv = (VecGame *)(handle);
+        return venv->create_completion_fd();
+    }
+
+    // copy the state of env src_indices[i] to env dst_indices[i] for each i < count, if observe is zero the
+    // observation and info buffers of the destinations keep their old contents until the next step
+    LIBENV_API void clone_envs(libenv_env *handle, int *src_indices, int *dst_indices, int count, int observe) {
+        auto venv = (VecGame *)(handle);
+        std::vector<int> src(src_indices, src_indices + count);
+        std::vector<int> dst(dst_indices, dst_indices + count);
+        venv->clone_envs(src, dst, observe != 0);
+    }
+
+    // replace the pool of states that episodes start from, data holds count states back to back, the length of
+    // each one is in lengths, a count of 0 clears the pool
+    LIBENV_API void set_state_pool(libenv_env *handle, char *data, int *lengths, float *weights, int count) {
+        auto venv = (VecGame *)(handle);
+        std::vector<std::vector<char>> states(count);
+        for (int i = 0; i < count; i++) {
+            states[i].assign(data, data + lengths[i]);
+            data += lengths[i];
+        }
+        venv->set_state_pool(states, std::vector<float>(weights, weights + count));
+    }
+
+    // change the sampling weights of the states in the pool, a weight of 0 excludes a state
+    LIBENV_API void set_state_pool_weights(libenv_env *handle, float *weights, int count) {
+        auto venv = (VecGame *)(handle);
+        venv->set_state_pool_weights(std::vector<float>(weights, weights + count));
+    }
+
+    // write the comma separated names of the level metadata fields of the first env's game to names, and return
+    // the length of the names, which are only written if they fit in length bytes
+    LIBENV_API int get_level_metadata_names(libenv_env *handle, char *names, int length) {
+        auto venv = (VecGame *)(handle);
+        std::string joined;
+        for (const auto &name : venv->level_metadata_names()) {
+            joined += (joined.empty() ? "" : ",") + name;
+        }
+        if ((int)(joined.size()) <= length) {
+            memcpy(names, joined.data(), joined.size());
+        }
+        return (int)(joined.size());
+    }
+
+    // generate the level for each of count seeds with the first env's game and options, without rendering, and write
+    // the metadata fields of each level to values, an array of count rows of fields ordered as by
+    // get_level_metadata_names
+    LIBENV_API void generate_levels(libenv_env *handle, int *seeds, int count, float *values) {
+        auto venv = (VecGame *)(handle);
+        venv->generate_levels(std::vector<int>(seeds, seeds + count), values);
+    }
+
+    // write the comma separated names of the metadata fields of the current level of env env_idx to names and their
+    // values to values, and return the length of the names, the names are only written if they fit in length bytes
+    // and the values if there are at most max_values fields
+    LIBENV_API int get_env_level_metadata(libenv_env *handle, int env_idx, char *names, int length, float *values, int max_values) {
+        auto venv = (VecGame *)(handle);
+        venv->wait_for_stepping_threads();
+        const auto &game = venv->games.at(env_idx);
+        std::vector<std::string> field_names;
+        game->level_metadata_names(field_names);
+        std::vector<float> field_values;
+        game->get_level_metadata(field_values);
+        fassert(field_values.size() == field_names.size());
+        std::string joined;
+        for (const auto &name : field_names) {
+            joined += (joined.empty() ? "" : ",") + name;
+        }
+        if ((int)(joined.size()) <= length) {
+            memcpy(names, joined.data(), joined.size());
+        }
+        if ((int)(field_values.size()) <= max_values) {
+            std::copy(field_values.begin(), field_values.end(), values);
+        }
+        return (int)(joined.size());
+    }
+
+    // take num_steps steps with actions from the [num_steps, num_envs] array, each game takes all of its steps on one
+    // stepping thread, writes its rewards and first flags to [num_steps, num_envs] arrays and the observation of
+    // every frame_interval-th step to obs, which has num_steps / frame_interval frames
+    LIBENV_API void rollout(libenv_env *handle, int32_t *actions, int num_steps, int frame_interval, uint8_t *obs, float *rews, uint8_t *firsts) {
+        auto venv = (VecGame *)(handle);
+        venv->rollout(actions, num_steps, frame_interval, obs, rews, firsts);
+    }
+
+    // number of episodes that get_episode_stats would return
+    LIBENV_API int num_episode_stats(libenv_env *handle) {
+        auto venv = (VecGame *)(handle);
+        return venv->num_episode_stats();
+    }
+
+    // move the stats of up to max_count episodes that ended since the last call into the arrays, ordered by env
+    // and then by the time the episodes ended, and return the number of episodes
+    LIBENV_API int get_episode_stats(libenv_env *handle, int *env_indices, float *returns, int *lengths, uint8_t *level_completes, int *max_progress, int *level_seeds, int max_count) {
+        auto venv = (VecGame *)(handle);
+        return venv->get_episode_stats(env_indices, returns, lengths, level_completes, max_progress, level_seeds, max_count);
+    }
+
+    // running average of the seconds taken by each game's step
+    LIBENV_API void get_step_costs(libenv_env *handle, float *costs) {
+        auto venv = (VecGame *)(handle);
+        venv->get_step_costs(costs);
+    }
+
+    // 64 bit digests of each game's serialized state (as returned by get_state) and observation
+    LIBENV_API void get_digests(libenv_env *handle, uint64_t *state_digests, uint64_t *obs_digests) {
+        auto venv = (VecGame *)(handle);
+        venv->wait_for_stepping_threads();
+        for (int e = 0; e < venv->num_envs; e++) {
+            state_digests[e] = venv->games[e]->state_digest();
+            obs_digests[e] = venv->games[e]->obs_digest();
+        }
+    }
+
+    // select which envs render the "rgb" info, and how often, enabled is an array of num_envs bools
+    LIBENV_API void set_render_human(libenv_env *handle, uint8_t *enabled, int interval) {
+        auto venv = (VecGame *)(handle);
+        std::vector<bool> enabled_vec(venv->num_envs);
+        for (int e = 0; e < venv->num_envs; e++) {
+            enabled_vec[e] = enabled[e] != 0;
+        }
+        venv->set_render_human(enabled_vec, interval);
+    }
+
+    LIBENV_API int is_step_complete(libenv_env *handle) {
+        auto venv = (VecGame *)(handle);
+        return venv->is_step_complete();
+    }
 }
\ No newline at end of file
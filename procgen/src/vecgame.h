@@ -13,9 +13,11 @@ This implements the libenv interface and manages a vector of Game instances
 #include <condition_variable>
 #include <thread>
 #include <list>
+#include <functional>
 
 class VecOptions;
 class Game;
+struct PregeneratedLevel;
 
 class VecGame {
   public:
@@ -27,6 +29,7 @@ class VecGame {
     int num_joint_games;
     int num_actions;
     bool render_human;
+    int render_resolution;
 
     std::vector<std::shared_ptr<Game>> games;
 
@@ -36,17 +39,48 @@ class VecGame {
     void set_buffers(const std::vector<std::vector<void *>> &ac, const std::vector<std::vector<void *>> &ob, const std::vector<std::vector<void *>> &info, float *rew, uint8_t *first);
     void observe();
     void act();
+    void rollout(const int32_t *actions, int num_steps, int frame_interval, uint8_t *obs, float *rews, uint8_t *firsts);
     void wait_for_stepping_threads();
+    bool is_step_complete();
+    void set_render_human(const std::vector<bool> &enabled, int interval);
+    int create_completion_fd();
+    void get_step_costs(float *costs);
+    void clone_envs(const std::vector<int> &src_indices, const std::vector<int> &dst_indices, bool observe);
+    void set_state_pool(const std::vector<std::vector<char>> &states, const std::vector<float> &weights);
+    void set_state_pool_weights(const std::vector<float> &weights);
+    std::vector<std::string> level_metadata_names();
+    void generate_levels(const std::vector<int> &seeds, float *values);
+    int num_episode_stats();
+    int get_episode_stats(int *env_indices, float *returns, int *lengths, uint8_t *level_completes, int *max_progress, int *level_seeds, int max_count);
 
   private:
+    std::shared_ptr<Game> make_headless_game();
+    // call fn(i) for i in [0, count) on the stepping threads, or on this thread if there are none, the games must
+    // not be being stepped
+    void parallel_for(int count, const std::function<void(int)> &fn);
+    void queue_steps();
     // this mutex synchronizes access to pending_games and game->is_waiting_for_step
     // when game->is_waiting_for_step is set to true
     // ownership of game objects is transferred to the stepping thread until
     // game->is_waiting_for_step is set to false
     std::mutex stepping_thread_mutex;
+    // functions queued by parallel_for(), run before any games or levels
+    std::list<std::function<void()>> pending_tasks;
     std::list<std::shared_ptr<Game>> pending_games;
+    // levels requested by games with pregenerate_levels set, generated when there are no games to step
+    std::list<std::shared_ptr<PregeneratedLevel>> pending_levels;
     std::condition_variable pending_games_added;
     std::condition_variable pending_game_complete;
     std::vector<std::thread> threads;
     bool time_to_die = false;
+    // number of games in pending_games or being stepped
+    int num_pending_games = 0;
+    // pipe that the stepping threads write a byte to whenever num_pending_games reaches 0
+    // so that event loops can wait for steps to complete without blocking
+    int completion_fds[2] = {-1, -1};
+    // order in which games are queued for stepping, most expensive first
+    std::vector<int> step_order;
+    // states set by set_state_pool() and the name of the game each one belongs to
+    std::shared_ptr<const std::vector<std::vector<char>>> state_pool_states;
+    std::vector<std::string> state_pool_game_names;
 };
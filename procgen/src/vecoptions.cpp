@@ -31,6 +31,14 @@ void VecOptions::consume_bool(std::string name, bool *value) {
     *value = (bool)v;
 }
 
+void VecOptions::consume_int_array(std::string name, std::vector<int32_t> *value) {
+    auto opt = find_option(name, LIBENV_DTYPE_INT32);
+    if (opt.data == nullptr) {
+        return;
+    }
+    *value = std::vector<int32_t>((int32_t *)(opt.data), (int32_t *)(opt.data) + opt.count);
+}
+
 void VecOptions::ensure_empty() {
     if (m_options.size() > 0) {
         fatal("unused options found, first unused option: %s\n", m_options[0].name);
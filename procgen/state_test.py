@@ -122,3 +122,95 @@ def run_state_test(env_name):
     )
     assert_rollouts_identical(ref_rollouts[offset:], state_restore_rollouts)
     assert_rollouts_identical(state_rollouts[offset:], state_restore_rollouts)
+
+
+@pytest.mark.parametrize("env_name", ["coinrun", "bigfish"])
+def test_clone_envs(env_name):
+    rng = np.random.RandomState(0)
+    env1 = ProcgenGym3Env(num=4, env_name=env_name, rand_seed=0)
+    env2 = ProcgenGym3Env(num=4, env_name=env_name, rand_seed=0)
+    for _ in range(32):
+        ac = rng.randint(0, env1.ac_space.eltype.n, size=(env1.num,), dtype=np.int32)
+        env1.act(ac)
+        env2.act(ac)
+
+    # states are read before any are written, so env 0 gets the old state of env 3
+    src, dst = [0, 0, 3], [1, 2, 0]
+    states = env1.get_state()
+    env1.set_state([states[3], states[0], states[0], states[3]])
+    env2.clone_envs(src, dst)
+    assert env1.get_state() == env2.get_state()
+    assert np.array_equal(env1.observe()[1]["rgb"], env2.observe()[1]["rgb"])
+
+    env2.clone_envs([1], [3], observe=False)
+    env1.set_state([states[3], states[0], states[0], states[0]])
+    for _ in range(32):
+        ac = rng.randint(0, env1.ac_space.eltype.n, size=(env1.num,), dtype=np.int32)
+        env1.act(ac)
+        env2.act(ac)
+        _, obs1, first1 = env1.observe()
+        _, obs2, first2 = env2.observe()
+        assert np.array_equal(obs1["rgb"], obs2["rgb"])
+        assert np.array_equal(first1, first2)
+
+
+@pytest.mark.parametrize("env_name", ["coinrun", "climber", "heist"])
+def test_set_state_derived_members(env_name):
+    # these games keep members that aren't saved, which must be derived again from a loaded state
+    rng = np.random.RandomState(0)
+    env1 = ProcgenGym3Env(num=4, env_name=env_name, rand_seed=0)
+    for _ in range(64):
+        env1.act(rng.randint(0, env1.ac_space.eltype.n, size=(env1.num,), dtype=np.int32))
+    env2 = ProcgenGym3Env(num=4, env_name=env_name, rand_seed=1)
+    env2.set_state(env1.get_state())
+    for _ in range(500):
+        ac = rng.randint(0, env1.ac_space.eltype.n, size=(env1.num,), dtype=np.int32)
+        env1.act(ac)
+        env2.act(ac)
+        for info1, info2 in zip(env1.get_info(), env2.get_info()):
+            assert info1["level_progress"] == info2["level_progress"]
+        assert np.array_equal(env1.observe()[1]["rgb"], env2.observe()[1]["rgb"])
+    assert env1.get_state() == env2.get_state()
+
+
+def test_state_pool():
+    env = ProcgenGym3Env(num=4, env_name="coinrun,bigfish", rand_seed=0)
+    for _ in range(16):
+        env.act(np.zeros(env.num, dtype=np.int32))
+    states = env.get_state()
+    ref = ProcgenGym3Env(num=4, env_name="coinrun,bigfish", rand_seed=1)
+    ref.set_state(states)
+    _, ref_obs, _ = ref.observe()
+
+    # an action of -1 ends the episode
+    end_episode = np.full(env.num, -1, dtype=np.int32)
+    # only coinrun has states in the pool, so the bigfish envs reset normally
+    env.set_state_pool(states[:3], weights=[0, 0, 1])
+    env.act(end_episode)
+    _, obs, first = env.observe()
+    assert first.all()
+    assert np.array_equal(obs["rgb"][0], ref_obs["rgb"][2])
+    assert np.array_equal(obs["rgb"][2], ref_obs["rgb"][2])
+    assert not np.array_equal(obs["rgb"][1], ref_obs["rgb"][1])
+
+    env.set_state_pool_weights([1, 0, 0])
+    env.act(end_episode)
+    _, obs, _ = env.observe()
+    assert np.array_equal(obs["rgb"][0], ref_obs["rgb"][0])
+    assert np.array_equal(obs["rgb"][2], ref_obs["rgb"][0])
+
+
+def test_state_pool_level_seeds():
+    # episodes started from the pool don't change the level seeds that each env draws afterwards
+    end_episode = np.full(4, -1, dtype=np.int32)
+    ref = ProcgenGym3Env(num=4, env_name="coinrun", rand_seed=0)
+    env = ProcgenGym3Env(num=4, env_name="coinrun", rand_seed=0)
+    env.set_state_pool(ProcgenGym3Env(num=1, env_name="coinrun", rand_seed=1).get_state())
+    env.act(end_episode)
+    env.set_state_pool([])
+    for _ in range(4):
+        ref.act(end_episode)
+        env.act(end_episode)
+        ref_seeds = [info["level_seed"] for info in ref.get_info()]
+        assert [info["level_seed"] for info in env.get_info()] == ref_seeds
+        assert len(set(ref_seeds)) == env.num
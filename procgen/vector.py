@@ -0,0 +1,103 @@
+"""
+Gymnasium vector environment backed by a single batched procgen environment
+"""
+
+from typing import Any, Dict, Optional
+
+import numpy as np
+from gymnasium import spaces
+from gymnasium.vector import VectorEnv
+from gymnasium.vector.utils import batch_space
+
+from .env import ProcgenGym3Env
+
+try:
+    from gymnasium.vector import AutoresetMode
+
+    AUTORESET_MODE = AutoresetMode.SAME_STEP
+except ImportError:
+    # older versions of gymnasium don't declare an autoreset mode
+    AUTORESET_MODE = "same-step"
+
+# should match RES_W and RES_H in game.h
+OB_SHAPE = (64, 64, 3)
+# should match the length of BaseProcgenEnv.get_combos()
+NUM_ACTIONS = 15
+
+
+class ProcgenVectorEnv(VectorEnv):
+    """
+    Gymnasium VectorEnv API for a batch of procgen environments stepped by procgen's own threads
+
+    Procgen resets environments automatically in the same step that an episode ends, so the observation returned by
+    step() is already the first observation of the next episode.  The last observation of an episode is never
+    rendered and is not included in the info.  Episodes that end because of a timeout are reported as terminated,
+    truncations are always False.
+
+    Procgen environments can't be reset in place, so reset() creates the underlying environment, calling it a
+    second time replaces it with a new one.  Passing a seed to reset() sets rand_seed for the new environment.
+
+    :param num_envs: number of environments
+    :param env_name: name of the game, see ProcgenGym3Env for the other options
+    :param render_mode: None or "rgb_array", render() returns the "rgb" info of every environment
+    """
+
+    metadata = {"render_modes": ["rgb_array"], "autoreset_mode": AUTORESET_MODE}
+
+    def __init__(
+        self,
+        num_envs: int,
+        env_name: str,
+        render_mode: Optional[str] = None,
+        num_threads: int = 4,
+        **kwargs: Any,
+    ) -> None:
+        assert render_mode in (None, "rgb_array"), f"invalid render mode {render_mode}"
+        self.num_envs = num_envs
+        self.render_mode = render_mode
+        self._env_kwargs = dict(env_name=env_name, render_mode=render_mode, num_threads=num_threads, **kwargs)
+        self._env = None
+
+        self.single_observation_space = spaces.Box(low=0, high=255, shape=OB_SHAPE, dtype=np.uint8)
+        self.single_action_space = spaces.Discrete(NUM_ACTIONS)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+
+    def reset(self, *, seed: Optional[int] = None, options: Optional[Dict[str, Any]] = None):
+        super().reset(seed=seed)
+        if seed is not None:
+            self._env_kwargs["rand_seed"] = seed
+        if self._env is not None:
+            self._env.close()
+        self._env = ProcgenGym3Env(num=self.num_envs, **self._env_kwargs)
+        _, ob, _ = self._env.observe()
+        return ob["rgb"], self._get_infos()
+
+    def step(self, actions):
+        assert self._env is not None, "reset() must be called before step()"
+        self._env.act(actions)
+        rew, ob, first = self._env.observe()
+        truncations = np.zeros(self.num_envs, dtype=bool)
+        return ob["rgb"], rew, first, truncations, self._get_infos()
+
+    def render(self):
+        if self.render_mode is None or self._env is None:
+            return None
+        return self._env.get_buffers()["info"]["rgb"].copy()
+
+    def close_extras(self, **kwargs: Any) -> None:
+        if self._env is not None:
+            self._env.close()
+            self._env = None
+
+    def _get_infos(self) -> Dict[str, np.ndarray]:
+        infos = {}
+        mask = np.ones(self.num_envs, dtype=bool)
+        for key, values in self._env.get_buffers()["info"].items():
+            if key == "rgb":
+                # returned by render() instead
+                continue
+            infos[key] = values.copy()
+            infos[f"_{key}"] = mask
+        return infos
+
@@ -0,0 +1,62 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+gymnasium = pytest.importorskip("gymnasium")
+
+from procgen import ProcgenGym3Env
+from .env import ENV_NAMES
+from .vector import ProcgenVectorEnv
+
+
+def test_spaces():
+    env = ProcgenVectorEnv(num_envs=3, env_name="coinrun")
+    gym3_env = ProcgenGym3Env(num=1, env_name="coinrun")
+    assert env.single_observation_space.shape == gym3_env.ob_space["rgb"].shape
+    assert env.single_action_space.n == gym3_env.ac_space.eltype.n
+    assert env.observation_space.shape == (3,) + gym3_env.ob_space["rgb"].shape
+    assert tuple(env.action_space.nvec) == (gym3_env.ac_space.eltype.n,) * 3
+
+
+def test_registration():
+    for env_name in ENV_NAMES:
+        assert f"procgen-{env_name}-v0" in gymnasium.registry
+
+
+def test_registration_after_import():
+    # procgen was imported before gymnasium, so the ids are registered right after gymnasium is imported
+    code = "\n".join(
+        [
+            "import sys, procgen, gymnasium",
+            "assert 'procgen.vector' not in sys.modules",
+            "gymnasium.make_vec('procgen-coinrun-v0', num_envs=2).close()",
+        ]
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+@pytest.mark.parametrize("env_name", ["coinrun", "starpilot"])
+def test_matches_gym3(env_name):
+    num_envs = 4
+    env = gymnasium.make_vec(f"procgen-{env_name}-v0", num_envs=num_envs, distribution_mode="easy")
+    assert isinstance(env.unwrapped, ProcgenVectorEnv)
+    gym3_env = ProcgenGym3Env(num=num_envs, env_name=env_name, distribution_mode="easy", rand_seed=7)
+
+    obs, infos = env.reset(seed=7)
+    _, gym3_ob, _ = gym3_env.observe()
+    assert np.array_equal(obs, gym3_ob["rgb"])
+    assert "level_seed" in infos and infos["_level_seed"].all()
+
+    env.action_space.seed(0)
+    for _ in range(100):
+        actions = env.action_space.sample()
+        obs, rew, terminated, truncated, infos = env.step(actions)
+        gym3_env.act(actions)
+        gym3_rew, gym3_ob, gym3_first = gym3_env.observe()
+        assert np.array_equal(obs, gym3_ob["rgb"])
+        assert np.array_equal(rew, gym3_rew)
+        assert np.array_equal(terminated, gym3_first)
+        assert not truncated.any()
+    env.close()
@@ -0,0 +1,169 @@
+"""
+Fork worker processes from a parent that has already initialized procgen
+
+The first environment created in a process loads the environment library, decodes the game images and builds the
+asset tables of its game, and the library may have to be located or built.  A Zygote does this once for a set of
+games and then forks the workers, so environments created in a worker skip all of it and the memory holding the
+assets is shared between the workers copy-on-write instead of being duplicated in each one.
+
+    zygote = Zygote(["coinrun", "bigfish"], env_kwargs=dict(distribution_mode="easy"), level_seeds=range(200))
+    workers = [zygote.start(actor_main, args=(i,)) for i in range(8)]
+
+A worker can call `env.set_state_pool(zygote.level_states["coinrun"])` to start episodes from the levels generated
+by the parent instead of generating them again.  Forking requires a platform with the "fork" start method, and
+the parent should not be stepping environments while it forks since only the forking thread is copied.
+
+To compare the startup time and unique memory of forked and newly started workers:
+
+    python -m procgen.zygote --env-name coinrun --workers 8
+"""
+
+import argparse
+import gc
+import multiprocessing as mp
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .env import ProcgenGym3Env
+
+# options that are chosen by the zygote for each environment it creates
+_ZYGOTE_ENV_KWARGS = {"num", "env_name", "num_threads", "start_level", "num_levels"}
+
+
+def warm(env_names: Sequence[str], **env_kwargs: Any) -> None:
+    """
+    Create and step an environment of each game, which loads everything that the environments of a process share
+    """
+    for env_name in env_names:
+        env = ProcgenGym3Env(num=1, env_name=env_name, num_threads=0, **env_kwargs)
+        env.act(np.zeros(1, dtype=np.int32))
+        env.observe()
+        env.close()
+
+
+def generate_level_states(env_name: str, seeds: Sequence[int], **env_kwargs: Any) -> List[bytes]:
+    """
+    Return the state at the start of the level with each seed, for use with set_state_pool()
+    """
+    states = []
+    for seed in seeds:
+        env = ProcgenGym3Env(
+            num=1, env_name=env_name, start_level=int(seed), num_levels=1, num_threads=0, **env_kwargs
+        )
+        states.extend(env.get_state())
+        env.close()
+    return states
+
+
+class Zygote:
+    """
+    Initialize procgen in this process and fork workers that inherit it
+
+    :param env_names: games that the workers will use
+    :param env_kwargs: options that the workers will use, such as distribution_mode, options that change the assets
+        (use_generated_assets, restrict_themes, use_monochrome_assets) must match for the assets to be shared
+    :param level_seeds: if set, generate the levels with these seeds for each game, see `level_states`
+    """
+
+    def __init__(
+        self,
+        env_names: Sequence[str],
+        env_kwargs: Optional[Dict[str, Any]] = None,
+        level_seeds: Optional[Sequence[int]] = None,
+    ) -> None:
+        self._ctx = mp.get_context("fork")
+        self.env_kwargs = {k: v for k, v in (env_kwargs or {}).items() if k not in _ZYGOTE_ENV_KWARGS}
+        warm(env_names, **self.env_kwargs)
+        self.level_states = {}
+        if level_seeds is not None:
+            for env_name in env_names:
+                self.level_states[env_name] = generate_level_states(env_name, level_seeds, **self.env_kwargs)
+
+    def start(
+        self,
+        target: Callable[..., Any],
+        args: Sequence[Any] = (),
+        kwargs: Optional[Dict[str, Any]] = None,
+        daemon: Optional[bool] = None,
+    ) -> mp.Process:
+        """
+        Fork a worker process that runs target(*args, **kwargs), target doesn't need to be picklable
+        """
+        proc = self._ctx.Process(target=target, args=tuple(args), kwargs=kwargs or {}, daemon=daemon)
+        # objects that exist at the fork are never collected in the worker, so the garbage collector doesn't write to
+        # their pages and make private copies of them, the parent collects them as usual after the fork
+        gc.collect()
+        gc.freeze()
+        try:
+            proc.start()
+        finally:
+            gc.unfreeze()
+        return proc
+
+
+def unique_memory() -> int:
+    """
+    Bytes of memory that are only used by this process (the unique set size), only supported on Linux
+    """
+    total = 0
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                total += int(line.split()[1]) * 1024
+    return total
+
+
+def _startup_worker(env_name: str, env_kwargs: Dict[str, Any], start_time: float, result_queue: Any) -> None:
+    env = ProcgenGym3Env(num=1, env_name=env_name, **env_kwargs)
+    env.act(np.zeros(1, dtype=np.int32))
+    env.observe()
+    result_queue.put((time.time() - start_time, unique_memory()))
+    env.close()
+
+
+def measure_startup(
+    env_name: str, num_workers: int, zygote: Optional[Zygote] = None, **env_kwargs: Any
+) -> List[Tuple[float, int]]:
+    """
+    Start workers that each create an environment and take a step, and return the seconds from starting each worker
+    to the end of its step and its unique memory at that point
+
+    Workers are forked from `zygote` if it is set and started with the "spawn" method otherwise.
+    """
+    ctx = mp.get_context("fork" if zygote is not None else "spawn")
+    result_queue = ctx.Queue()
+    procs = []
+    for _ in range(num_workers):
+        kwargs = dict(env_name=env_name, env_kwargs=env_kwargs, start_time=time.time(), result_queue=result_queue)
+        if zygote is not None:
+            procs.append(zygote.start(_startup_worker, kwargs=kwargs))
+        else:
+            proc = ctx.Process(target=_startup_worker, kwargs=kwargs)
+            proc.start()
+            procs.append(proc)
+    results = [result_queue.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="compare the startup of forked and newly started workers")
+    parser.add_argument("--env-name", default="coinrun")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    zygote = Zygote([args.env_name])
+    print(f"zygote initialized in {time.time() - start:.3f}s")
+    for name, z in [("spawn", None), ("zygote", zygote)]:
+        results = measure_startup(args.env_name, args.workers, zygote=z)
+        startup = np.mean([r[0] for r in results])
+        uss = np.mean([r[1] for r in results]) / 2 ** 20
+        print(f"{name}: {startup:.3f}s to the first step, {uss:.1f}MiB unique memory per worker")
+
+
+if __name__ == "__main__":
+    main()
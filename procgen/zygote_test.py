@@ -0,0 +1,59 @@
+import gc
+import multiprocessing as mp
+
+import numpy as np
+import pytest
+
+from .env import ProcgenGym3Env
+from .zygote import Zygote, measure_startup
+
+
+ENV_KWARGS = dict(rand_seed=0)
+
+
+def pooled_rollout(level_states, num_steps=32):
+    env = ProcgenGym3Env(num=2, env_name="coinrun", **ENV_KWARGS)
+    env.set_state_pool(level_states)
+    obs = []
+    for step in range(num_steps):
+        # an action of -1 ends the episode, so the first episode starts from the pool
+        ac = np.full(env.num, -1 if step == 0 else 0, dtype=np.int32)
+        env.act(ac)
+        obs.append(env.observe()[1]["rgb"])
+    return np.array(obs)
+
+
+def test_zygote():
+    zygote = Zygote(["coinrun"], env_kwargs=ENV_KWARGS, level_seeds=[3, 5])
+    level_states = zygote.level_states["coinrun"]
+    result_queue = mp.get_context("fork").Queue()
+
+    def worker():
+        result_queue.put((gc.get_freeze_count(), pooled_rollout(level_states)))
+
+    proc = zygote.start(worker)
+    # only the worker keeps the objects that existed at the fork frozen
+    assert gc.get_freeze_count() == 0
+    freeze_count, worker_obs = result_queue.get()
+    assert freeze_count > 0
+    proc.join()
+    assert proc.exitcode == 0
+    # forked workers behave the same as environments created in the zygote
+    assert np.array_equal(worker_obs, pooled_rollout(level_states))
+
+    level_obs = []
+    for seed, state in zip([3, 5], level_states):
+        env = ProcgenGym3Env(num=1, env_name="coinrun", start_level=seed, num_levels=1, **ENV_KWARGS)
+        assert env.get_state() == [state]
+        level_obs.append(env.observe()[1]["rgb"][0])
+    # the worker's environments started their episodes from the pool
+    for ob in worker_obs[0]:
+        assert any(np.array_equal(ob, level_ob) for level_ob in level_obs)
+
+
+@pytest.mark.parametrize("use_zygote", [False, True])
+def test_worker_startup_speed(use_zygote, benchmark):
+    benchmark.group = "worker-startup"
+    zygote = Zygote(["coinrun"]) if use_zygote else None
+    results = benchmark.pedantic(lambda: measure_startup("coinrun", 4, zygote=zygote), rounds=5)
+    benchmark.extra_info["unique_memory"] = int(np.mean([uss for _, uss in results]))
@@ -1,9 +1,12 @@
 import argparse
+import os
 import pickle
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+import matplotlib.image
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
@@ -50,6 +53,38 @@ def parse_arguments(input_args):
         default=False,
         help="If specified, do not round up level progress metrics upon a level being complete.",
     )
+    headless_group = parser.add_argument_group("headless mode arguments")
+    headless_group.add_argument(
+        "--headless",
+        action="store_true",
+        default=False,
+        help="If specified, stream trajectories without displaying them and write the results as a table, requires --output-dir.",
+    )
+    headless_group.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Specifies the number of processes used to analyze trajectory directories in headless mode.",
+    )
+    headless_group.add_argument(
+        "--table-format",
+        default="csv",
+        choices=["csv", "parquet"],
+        help="Specifies the format of the results table in headless mode, parquet requires pyarrow.",
+    )
+    headless_group.add_argument(
+        "--thumbnail-batch",
+        type=int,
+        default=64,
+        help="Specifies the number of last-frame thumbnails tiled into each image in headless mode, 0 disables thumbnails.",
+    )
+    headless_group.add_argument(
+        "--thumbnail-stride",
+        type=int,
+        default=4,
+        help="Specifies the factor by which last frames are downsampled for thumbnails.",
+    )
     args = parser.parse_args(input_args)
     return args
 
@@ -79,6 +114,220 @@ def get_traj_paths_from_dir(input_dir):
     return traj_paths
 
 
+def find_traj_sequences(input_dir):
+    traj_paths = get_traj_paths_from_dir(input_dir)
+    if len(traj_paths) > 0:
+        # Assume there are no subdirectories
+        return [traj_paths]
+
+    # Assume there are subdirectories
+    traj_sequences_unsorted = []
+    candidate_dirs_time = []
+    for dir in input_dir.iterdir():
+        if not dir.is_dir():
+            continue
+        try:
+            dir_time = datetime.strptime(dir.name, "%Y-%m-%d-%H-%M-%S")
+        except ValueError:
+            continue
+        dir_traj_paths = get_traj_paths_from_dir(dir)
+        if len(dir_traj_paths) > 0:
+            traj_sequences_unsorted.append(dir_traj_paths)
+            candidate_dirs_time.append(dir_time)
+        else:
+            # Just warn for now
+            print(f"Directory \"{dir}\" has a valid timestamp name but contains no data.")
+
+    idx_dir_sort = np.argsort(candidate_dirs_time)
+    return [traj_sequences_unsorted[x] for x in idx_dir_sort]
+
+
+def load_info_dict(traj_dir):
+    info_path = traj_dir / "info.yaml"
+    if not info_path.exists():
+        return {}
+    yaml = YAML(typ="safe")
+    with open(info_path, "r") as f:
+        return yaml.load(f)
+
+
+def level_option_columns(info_dict):
+    """
+    Values of the "Level option 1" and "Level option 2" columns for a trajectory directory
+    """
+    if not info_dict:
+        # info.yaml does not exist -- can't determine
+        return "unknown", "unknown"
+    # info.yaml exists, -1 means the default was used
+    level_options = list(info_dict.get("level_options", []))
+    level_options += [-1] * (2 - len(level_options))
+    return level_options[0], level_options[1]
+
+
+class ThumbnailWriter:
+    """
+    Tile downsampled frames into one image per batch so that large datasets don't produce thousands of files
+    """
+
+    def __init__(self, output_dir, name, batch_size, stride, columns=8):
+        self.output_dir = output_dir
+        self.name = name
+        self.batch_size = batch_size
+        self.stride = stride
+        self.columns = columns
+        self.frames = []
+        self.num_batches = 0
+
+    def add(self, frame):
+        """
+        Returns the filename of the image the frame will be written to and its index in that image
+        """
+        if self.batch_size <= 0 or frame is None:
+            return "", -1
+        filename = f"{self.name}-{self.num_batches:04d}.png"
+        index = len(self.frames)
+        self.frames.append(np.asarray(frame)[:: self.stride, :: self.stride])
+        if len(self.frames) == self.batch_size:
+            self.flush()
+        return filename, index
+
+    def flush(self):
+        if len(self.frames) == 0:
+            return
+        frames = np.stack(self.frames)
+        n, h, w, c = frames.shape
+        columns = min(self.columns, n)
+        rows = -(-n // columns)
+        grid = np.zeros((rows * columns, h, w, c), dtype=frames.dtype)
+        grid[:n] = frames
+        grid = grid.reshape(rows, columns, h, w, c).transpose(0, 2, 1, 3, 4).reshape(rows * h, columns * w, c)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        matplotlib.image.imsave(self.output_dir / f"{self.name}-{self.num_batches:04d}.png", grid)
+        self.frames = []
+        self.num_batches += 1
+
+
+def _last_frame(trajectory):
+    last_info = trajectory["info"][-1]
+    if "rgb" in last_info:
+        return last_info["rgb"]
+    last_ob = trajectory["ob"][-1]
+    if isinstance(last_ob, dict) and "rgb" in last_ob:
+        return last_ob["rgb"]
+    return None
+
+
+def analyze_traj_sequence(traj_paths, use_raw_progress, thumbnail_dir, thumbnail_batch, thumbnail_stride):
+    """
+    Compute one row of results per trajectory in a directory, loading a single trajectory ahead at a time
+    """
+    traj_dir = traj_paths[0].parent
+    info_dict = load_info_dict(traj_dir)
+    env_name = info_dict.get("env_name", "unknown")
+    reward_threshold = ENV_REWARD_SOLVED_THRESHOLD.get(str(env_name).lower())
+    level_option1, level_option2 = level_option_columns(info_dict)
+    thumbnails = ThumbnailWriter(thumbnail_dir, traj_dir.name, thumbnail_batch, thumbnail_stride)
+
+    def load(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    columns = {
+        "Path": [],
+        "Filename": [],
+        "Level seed": [],
+        "Episode length": [],
+        "Episode reward": [],
+        "Level complete": [],
+        "Level progress": [],
+        "Max level progress": [],
+        "Thumbnail": [],
+        "Thumbnail index": [],
+    }
+    next_trajectory = load(traj_paths[0])
+    for idx_traj, traj_path in enumerate(traj_paths):
+        trajectory = next_trajectory
+        next_trajectory = load(traj_paths[idx_traj + 1]) if idx_traj + 1 < len(traj_paths) else None
+
+        infos = trajectory["info"]
+        rewards = np.asarray(trajectory["reward"], dtype=np.float64)
+        episode_len = len(rewards)
+        assert episode_len == len(infos)
+        level_seeds = np.fromiter((i["level_seed"] for i in infos), dtype=np.int64, count=episode_len)
+        assert episode_len > 0 and np.all(level_seeds == level_seeds[0])
+        traj_reward = rewards.sum()
+
+        if next_trajectory is not None:
+            first_info_next_traj = next_trajectory["info"][0]
+            level_complete = first_info_next_traj["prev_level_complete"]
+            level_progress_at_end = first_info_next_traj["prev_level_progress"]
+            level_progress_max = first_info_next_traj["prev_level_progress_max"]
+        else:
+            if reward_threshold is not None:
+                level_complete = 1 if traj_reward >= reward_threshold else 0
+            elif "env_name" in info_dict:
+                level_complete = "determine by reward (env reward threshold not implemented)"
+            else:
+                level_complete = "determine by reward"
+            level_progress_at_end = infos[-1]["level_progress"]
+            level_progress_max = infos[-1]["level_progress_max"]
+
+        columns["Path"].append(str(traj_dir))
+        columns["Filename"].append(traj_path.name)
+        columns["Level seed"].append(int(level_seeds[0]))
+        columns["Episode length"].append(episode_len)
+        columns["Episode reward"].append(traj_reward)
+        columns["Level complete"].append(level_complete)
+        columns["Level progress"].append(level_progress_at_end)
+        columns["Max level progress"].append(level_progress_max)
+        thumbnail, thumbnail_index = thumbnails.add(_last_frame(trajectory))
+        columns["Thumbnail"].append(thumbnail)
+        columns["Thumbnail index"].append(thumbnail_index)
+    thumbnails.flush()
+
+    df = pd.DataFrame(columns)
+    df.insert(2, "Env name", env_name)
+    df.insert(4, "Level option 1", level_option1)
+    df.insert(5, "Level option 2", level_option2)
+    if not use_raw_progress:
+        # level complete can be a string when it could not be determined
+        complete = (df["Level complete"].astype(str) == "1").to_numpy()
+        df.loc[complete, ["Level progress", "Max level progress"]] = 100
+    return df
+
+
+def analyze_trajs_headless(args):
+    assert args.output_dir is not None, "--headless requires --output-dir"
+    traj_sequences = find_traj_sequences(args.input_dir)
+    thumbnail_dir = args.output_dir / "thumbnails"
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    tasks = [
+        (traj_paths, args.use_raw_progress, thumbnail_dir, args.thumbnail_batch, args.thumbnail_stride)
+        for traj_paths in traj_sequences
+    ]
+    dfs = []
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = [executor.submit(analyze_traj_sequence, *task) for task in tasks]
+        for traj_paths, future in zip(traj_sequences, futures):
+            df = future.result()
+            print(f"{traj_paths[0].parent}: {len(df)} trajectories")
+            dfs.append(df)
+
+    if len(dfs) == 0:
+        print("No trajectories found.")
+        return
+    df = pd.concat(dfs, ignore_index=True)
+    df.insert(0, "Trial", np.arange(1, len(df) + 1))
+    # mixed types (e.g. "unknown" level options) can't be stored in parquet columns
+    for column in df.columns[df.dtypes == object]:
+        df[column] = df[column].astype(str)
+    if args.table_format == "parquet":
+        df.to_parquet(args.output_dir / "results.parquet", index=False)
+    else:
+        df.to_csv(args.output_dir / "results.csv", index=False)
+
+
 def analyze_trajs(input_args):
 
     # Parse arguments
@@ -96,32 +345,11 @@ def analyze_trajs(input_args):
     assert args.input_dir.exists(), \
         f"Expected input_dir \"{args.input_dir}\" to exist, but it does not."
 
-    traj_paths = get_traj_paths_from_dir(args.input_dir)
-    if len(traj_paths) > 0:
-        # Assume there are no subdirectories
-        traj_sequences = [traj_paths]
-    else:
-        # Assume there are subdirectories
-        dir_dirs = [dir for dir in args.input_dir.iterdir() if dir.is_dir()]
-
-        traj_sequences_unsorted = []
-        candidate_dirs_time = []
-        for dir in dir_dirs:
-            try:
-                dir_time = datetime.strptime(dir.name, "%Y-%m-%d-%H-%M-%S")
-
-                dir_traj_paths = get_traj_paths_from_dir(dir)
-                if len(dir_traj_paths) > 0:
-                    traj_sequences_unsorted.append(dir_traj_paths)
-                    candidate_dirs_time.append(dir_time)
-                else:
-                    # Just warn for now
-                    print(f"Directory \"{dir}\" has a valid timestamp name but contains no data.")
-            except:
-                pass
+    if args.headless:
+        analyze_trajs_headless(args)
+        return
 
-        idx_dir_sort = np.argsort(candidate_dirs_time)
-        traj_sequences = [traj_sequences_unsorted[x] for x in idx_dir_sort]
+    traj_sequences = find_traj_sequences(args.input_dir)
 
     # Prepare spreadsheet data
     if save_results:
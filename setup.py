@@ -99,7 +99,10 @@ setup(
             *asset_relpaths,
         ]
     },
-    extras_require={"test": ["pytest==6.2.5", "pytest-benchmark==3.4.1"]},
+    extras_require={
+        "test": ["pytest==6.2.5", "pytest-benchmark==3.4.1"],
+        "gymnasium": ["gymnasium>=1.0.0"],
+    },
     ext_modules=[DummyExtension()],
     cmdclass={"build_ext": custom_build_ext},
 